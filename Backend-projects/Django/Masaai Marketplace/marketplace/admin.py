@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Coalesce, Round
 from django.utils.html import format_html
 from .models import Category, Product, Customer, Order, OrderItem, CartItem, Wishlist, Review, Payment
 
@@ -10,9 +12,13 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ['name', 'description']
     readonly_fields = ['created_at']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_product_count=Count('products'))
+    
     def product_count(self, obj):
-        return obj.products.count()
+        return obj._product_count
     product_count.short_description = 'Products'
+    product_count.admin_order_field = '_product_count'
 
 
 @admin.register(Product)
@@ -28,6 +34,7 @@ class ProductAdmin(admin.ModelAdmin):
     ]
     search_fields = ['name', 'description', 'artisan_name', 'materials', 'sku']
     readonly_fields = ['sku', 'created_at', 'updated_at', 'average_rating', 'review_count']
+    list_select_related = ['category']
     
     fieldsets = (
         ('Basic Information', {
@@ -55,13 +62,24 @@ class ProductAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        # Computed from the stored rating aggregates, so no join on reviews
+        return super().get_queryset(request).annotate(
+            _average_rating=Case(
+                When(rating_count__gt=0, then=Round(F('rating_sum') * 1.0 / F('rating_count'), 1)),
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+    
     def average_rating(self, obj):
-        rating = obj.average_rating
+        rating = obj._average_rating
         if rating > 0:
             stars = '★' * int(rating) + '☆' * (5 - int(rating))
             return format_html(f'{stars} ({rating})')
         return 'No ratings'
     average_rating.short_description = 'Rating'
+    average_rating.admin_order_field = '_average_rating'
 
 
 @admin.register(Customer)
@@ -74,6 +92,7 @@ class CustomerAdmin(admin.ModelAdmin):
     list_filter = ['preferred_language', 'newsletter_subscription', 'created_at']
     search_fields = ['user__username', 'user__email', 'user__first_name', 'user__last_name', 'phone_number']
     readonly_fields = ['created_at', 'updated_at', 'order_count']
+    list_select_related = ['user']
     
     fieldsets = (
         ('User Information', {
@@ -95,9 +114,13 @@ class CustomerAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_order_count=Count('orders'))
+    
     def order_count(self, obj):
-        return obj.orders.count()
+        return obj._order_count
     order_count.short_description = 'Orders'
+    order_count.admin_order_field = '_order_count'
 
 
 class OrderItemInline(admin.TabularInline):
@@ -126,6 +149,7 @@ class OrderAdmin(admin.ModelAdmin):
         'item_count', 'shipped_at', 'delivered_at'
     ]
     inlines = [OrderItemInline]
+    list_select_related = ['customer__user']
     
     fieldsets = (
         ('Order Information', {
@@ -152,9 +176,13 @@ class OrderAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_item_count=Coalesce(Sum('items__quantity'), 0))
+    
     def item_count(self, obj):
-        return obj.item_count
+        return obj._item_count
     item_count.short_description = 'Items'
+    item_count.admin_order_field = '_item_count'
 
 
 @admin.register(Review)
@@ -167,6 +195,7 @@ class ReviewAdmin(admin.ModelAdmin):
     list_filter = ['rating', 'would_recommend', 'is_verified_purchase', 'created_at']
     search_fields = ['product__name', 'customer__user__username', 'title', 'comment']
     readonly_fields = ['created_at', 'updated_at']
+    list_select_related = ['product', 'customer__user']
     
     def rating_stars(self, obj):
         stars = '★' * obj.rating + '☆' * (5 - obj.rating)
@@ -184,6 +213,7 @@ class PaymentAdmin(admin.ModelAdmin):
     list_filter = ['payment_method', 'status', 'created_at']
     search_fields = ['transaction_id', 'order__order_number']
     readonly_fields = ['created_at', 'processed_at']
+    list_select_related = ['order']
 
 
 # Register the remaining models with basic admin
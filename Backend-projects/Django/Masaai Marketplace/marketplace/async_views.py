@@ -0,0 +1,108 @@
+"""
+Async versions of the catalogue views, served under ASGI.
+
+Each view issues its independent reads at the same time instead of one
+after another. Django's async ORM methods all run on a single shared
+thread, which would serialise them again, so every read here runs through
+`_concurrently()`: in its own worker thread, on that thread's database
+connection. The views reuse the filtering and context helpers of the sync
+views in `views.py`, so both paths render the same pages.
+
+`masaai_marketplace/asgi.py` selects `masaai_marketplace.asgi_urls`, which
+routes these views in place of their sync counterparts. Like the sync views
+they answer conditional GETs (see conditional.py) before doing any of this.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.shortcuts import get_object_or_404, render
+
+from . import views
+from .cache import get_categories, get_featured_products, get_related_products
+from .conditional import conditional_page
+from .facets import compute_facets
+from .models import Product
+from .pagination import paginate
+
+
+def _concurrently(func):
+    """Wrap a blocking read so it runs on a worker thread and can be gathered"""
+    @wraps(func)
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Worker threads keep their connections only within CONN_MAX_AGE
+            for connection in connections.all(initialized_only=True):
+                connection.close_if_unusable_or_obsolete()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+async def _render(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@conditional_page(views._home_state)
+async def home(request):
+    """Home page with featured products and search functionality"""
+    products, ordering, filters = await _concurrently(views._catalogue_results)(request)
+    # Reading the memberships also loads the session and user here, rather
+    # than lazily inside the event loop
+    products_page, categories, featured_products, memberships = await asyncio.gather(
+        _concurrently(paginate)(request, products, 9, ordering),
+        _concurrently(get_categories)(),
+        _concurrently(get_featured_products)(6),
+        _concurrently(views._membership_context)(request),
+    )
+
+    context = {
+        'products': products_page,
+        'categories': categories,
+        'featured_products': featured_products,
+        **filters,
+        **memberships,
+    }
+    return await _render(request, 'marketplace/home.html', context)
+
+
+async def product_list(request):
+    """Display all available products with filtering options"""
+    return await home(request)
+
+
+@conditional_page(views._product_detail_state)
+async def product_detail(request, product_id):
+    """Display detailed information about a specific product"""
+    product = await _concurrently(get_object_or_404)(Product.objects.select_related('category'), id=product_id)
+
+    reviews, related_products, (in_wishlist, available_quantity) = await asyncio.gather(
+        _concurrently(views._review_page)(request, product),
+        _concurrently(get_related_products)(product, 4),
+        _concurrently(views._shopper_state)(request, product),
+    )
+
+    context = views._product_detail_context(product, reviews, related_products, in_wishlist, available_quantity)
+    return await _render(request, 'marketplace/product_detail.html', context)
+
+
+async def search_products(request):
+    """Advanced product search with filters"""
+    # Validating the form can hit the database (category choices)
+    form, products, ordering = await _concurrently(views._search_results)(request)
+
+    products_page, facets, memberships = await asyncio.gather(
+        _concurrently(paginate)(request, products, 12, ordering),
+        _concurrently(compute_facets)(products),
+        _concurrently(views._membership_context)(request),
+    )
+
+    context = {
+        'form': form,
+        'products': products_page,
+        'facets': facets,
+        'search_performed': bool(request.GET),
+        **memberships,
+    }
+    return await _render(request, 'marketplace/search_results.html', context)
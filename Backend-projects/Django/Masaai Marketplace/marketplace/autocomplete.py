@@ -0,0 +1,406 @@
+"""
+Search-as-you-type suggestions for the Masaai marketplace.
+
+Suggestions are the names of available products and the artisan names,
+materials and origin regions that appear on them. `PrefixIndex` stores each
+suggestion once, with the number of products it covers, and a sorted array
+of lookup keys with a parallel array of suggestion ids. The keys of a
+suggestion are its normalised text from each word onwards, so "bea" finds
+"Glass beads" and "red bea" finds "Red beaded collar". A lookup is a bisect
+into the keys plus a bounded scan forward; it takes no locks and runs no
+queries.
+
+One index is shared by all threads of a process (`get_index()`). It is
+copy-on-write: a lookup reads a single immutable state object, and writers
+build the next state under a lock and swap it in. Product saves and deletes
+in this process update it after commit (see the signal handlers in
+models.py). Saves in other processes and writes that send no signals are
+picked up by `refresh()`, which lookups start in the background at most
+every REFRESH_INTERVAL seconds. It re-reads the products changed since the
+index's `as_of` and drops deleted ones.
+
+`save_snapshot()` writes the state to the JSON file named by the
+MARKETPLACE_AUTOCOMPLETE_SNAPSHOT setting (`manage.py
+build_autocomplete_index` does this). A new worker loads that file and
+refreshes from it rather than reading every product.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import Product
+
+SNAPSHOT_VERSION = 1
+
+KINDS = ['product', 'artisan', 'material', 'region']
+
+MIN_PREFIX_LENGTH = 2
+DEFAULT_LIMIT = 8
+
+# Matching keys looked at per lookup; very short prefixes are ranked among these only
+MAX_SCAN = 400
+
+# Seconds between background catch-ups with the database
+REFRESH_INTERVAL = 30
+
+# Re-read products changed this long before `as_of`, for late commits
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+# Above this many suggestions gained or lost in one update, re-sort instead of inserting
+RESORT_THRESHOLD = 2000
+
+QUERY_CHUNK_SIZE = 2000
+
+FIELDS = ['pk', 'name', 'artisan_name', 'materials', 'origin_region']
+
+_NON_WORD = re.compile(r'[\W_]+')
+_MATERIAL_SEPARATORS = re.compile(r'[,;/]|\band\b')
+
+
+def normalize(text):
+    """Lower-case, accent-free words separated by single spaces"""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def suggestions_for(name, artisan_name, materials, origin_region):
+    """(kind, label) pairs a product contributes, product name first"""
+    found = [('product', name.strip())]
+    if artisan_name.strip():
+        found.append(('artisan', artisan_name.strip()))
+    for material in _MATERIAL_SEPARATORS.split(materials):
+        if material.strip():
+            found.append(('material', material.strip().capitalize()))
+    if origin_region.strip():
+        found.append(('region', origin_region.strip()))
+    return found
+
+
+def _identity(kind, label, product_id):
+    """What makes two suggestions the same; product names are never merged"""
+    return (kind, normalize(label), product_id if kind == 'product' else None)
+
+
+def _keys(label):
+    """Lookup keys of a label, flagged True for the one that starts at its first word"""
+    words = normalize(label).split()
+    return [(' '.join(words[index:]), index == 0) for index in range(len(words))]
+
+
+class _State:
+    """One immutable version of the index; replaced, never modified, once published"""
+    __slots__ = ['keys', 'refs', 'targets', 'target_ids', 'counts', 'terms', 'as_of']
+
+    def __init__(self, keys, refs, targets, target_ids, counts, terms, as_of):
+        self.keys = keys              # sorted lookup keys
+        self.refs = refs              # suggestion id * 2 + 1 if the key starts the label
+        self.targets = targets        # suggestion id -> (kind, label, product id or None)
+        self.target_ids = target_ids  # (kind, normalised label, product id) -> suggestion id
+        self.counts = counts          # suggestion id -> products it covers
+        self.terms = terms            # product id -> suggestion ids
+        self.as_of = as_of            # when the products were last read
+
+
+_EMPTY = _State([], [], [], {}, [], {}, None)
+
+
+class PrefixIndex:
+    """Prefix lookups over product suggestions, shared between threads"""
+
+    def __init__(self):
+        self._state = _EMPTY
+        self._write_lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self.refreshed_at = 0.0
+
+    def __len__(self):
+        return len(self._state.terms)
+
+    @property
+    def as_of(self):
+        return self._state.as_of
+
+    @property
+    def key_count(self):
+        return len(self._state.keys)
+
+    # Lookups
+
+    def suggest(self, text, limit=DEFAULT_LIMIT, kinds=None):
+        """Best suggestions for what has been typed so far.
+
+        Labels that start with the prefix come before ones that match at a
+        later word; then suggestions covering more products, then shorter.
+        """
+        prefix = normalize(text)
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            return []
+        state = self._state
+        keys, refs = state.keys, state.refs
+
+        found = {}
+        start = bisect_left(keys, prefix)
+        for position in range(start, min(start + MAX_SCAN, len(keys))):
+            if not keys[position].startswith(prefix):
+                break
+            target_id, leading = divmod(refs[position], 2)
+            found[target_id] = found.get(target_id, 0) | leading
+
+        results = []
+        for target_id, leading in found.items():
+            kind, label, product_id = state.targets[target_id]
+            if kinds and kind not in kinds:
+                continue
+            results.append((-leading, -state.counts[target_id], len(label), label, kind, product_id, target_id))
+        results.sort()
+        return [
+            {'kind': kind, 'label': label, 'product_id': product_id, 'products': state.counts[target_id]}
+            for _, _, _, label, kind, product_id, target_id in results[:limit]
+        ]
+
+    # Writes
+
+    def update(self, rows, removed=(), as_of=None):
+        """Re-index (pk, name, artisan_name, materials, origin_region) rows; drop `removed` products"""
+        changes = {product_id: [] for product_id in removed}
+        for pk, name, artisan_name, materials, origin_region in rows:
+            changes[pk] = suggestions_for(name, artisan_name, materials, origin_region)
+        with self._write_lock:
+            self._state = self._apply(self._state, changes, as_of)
+
+    @staticmethod
+    def _unchanged(state, product_id, suggestions):
+        """True if re-indexing a product would leave the state as it is (a stock or price edit)"""
+        current = state.terms.get(product_id)
+        if current is None:
+            return not suggestions
+        ids = []
+        for kind, label in suggestions:
+            target_id = state.target_ids.get(_identity(kind, label, product_id))
+            if target_id is None or (kind == 'product' and state.targets[target_id][1] != label):
+                return False
+            if target_id not in ids:
+                ids.append(target_id)
+        return tuple(ids) == current
+
+    def _apply(self, state, changes, as_of):
+        if as_of is None or (state.as_of and state.as_of > as_of):
+            as_of = state.as_of
+        # Copying the state is the expensive part, so skip it when nothing changes
+        changes = {
+            product_id: suggestions for product_id, suggestions in changes.items()
+            if not self._unchanged(state, product_id, suggestions)
+        }
+        if not changes:
+            return _State(state.keys, state.refs, state.targets, state.target_ids, state.counts, state.terms, as_of)
+
+        targets = list(state.targets)
+        target_ids = dict(state.target_ids)
+        counts = list(state.counts)
+        terms = dict(state.terms)
+        gained, lost = set(), set()
+
+        for product_id, suggestions in changes.items():
+            for target_id in terms.pop(product_id, ()):
+                counts[target_id] -= 1
+                if not counts[target_id]:
+                    lost.add(target_id)
+
+            ids = []
+            for kind, label in suggestions:
+                identity = _identity(kind, label, product_id)
+                target_id = target_ids.get(identity)
+                if target_id is None:
+                    target_id = target_ids[identity] = len(targets)
+                    targets.append((kind, label, identity[2]))
+                    counts.append(0)
+                elif kind == 'product':
+                    # Same words, maybe different capitalisation
+                    targets[target_id] = (kind, label, product_id)
+                if target_id in ids:
+                    continue
+                if not counts[target_id]:
+                    # Lost earlier in this update: its keys are still in place
+                    if target_id in lost:
+                        lost.discard(target_id)
+                    else:
+                        gained.add(target_id)
+                counts[target_id] += 1
+                ids.append(target_id)
+            if ids:
+                terms[product_id] = tuple(ids)
+
+        if len(gained) + len(lost) > RESORT_THRESHOLD:
+            keys, refs = self._sorted_keys(targets, counts)
+        else:
+            keys, refs = list(state.keys), list(state.refs)
+            for target_id in lost:
+                for key, leading in _keys(targets[target_id][1]):
+                    ref = target_id * 2 + leading
+                    position = bisect_left(keys, key)
+                    while refs[position] != ref:
+                        position += 1
+                    del keys[position]
+                    del refs[position]
+            for target_id in gained:
+                for key, leading in _keys(targets[target_id][1]):
+                    position = bisect_right(keys, key)
+                    keys.insert(position, key)
+                    refs.insert(position, target_id * 2 + leading)
+
+        return _State(keys, refs, targets, target_ids, counts, terms, as_of)
+
+    @staticmethod
+    def _sorted_keys(targets, counts):
+        pairs = sorted(
+            (key, target_id * 2 + leading)
+            for target_id, (kind, label, _) in enumerate(targets)
+            if counts[target_id]
+            for key, leading in _keys(label)
+        )
+        return [key for key, _ in pairs], [ref for _, ref in pairs]
+
+    # Keeping up with the database
+
+    def build(self):
+        """Index every available product from scratch"""
+        as_of = timezone.now()
+        rows = Product.objects.filter(status='AVAILABLE').order_by().values_list(*FIELDS)
+        fresh = PrefixIndex()
+        fresh.update(rows.iterator(chunk_size=QUERY_CHUNK_SIZE), as_of=as_of)
+        with self._write_lock:
+            self._state = fresh._state
+        self.refreshed_at = time.monotonic()
+
+    def refresh_products(self, product_ids):
+        """Re-read the given products, e.g. after they were saved or deleted"""
+        rows = list(
+            Product.objects.filter(pk__in=product_ids, status='AVAILABLE').order_by().values_list(*FIELDS)
+        )
+        found = {row[0] for row in rows}
+        self.update(rows, removed=[product_id for product_id in product_ids if product_id not in found])
+
+    def refresh(self):
+        """Catch up with products changed, made unavailable or deleted since `as_of`"""
+        if self.as_of is None:
+            return self.build()
+        as_of = timezone.now()
+        changed = list(
+            Product.objects.filter(updated_at__gte=self.as_of - REFRESH_OVERLAP).order_by()
+            .values_list(*FIELDS, 'status')
+        )
+        rows = [row[:-1] for row in changed if row[-1] == 'AVAILABLE']
+        self.update(rows, removed=[row[0] for row in changed if row[-1] != 'AVAILABLE'], as_of=as_of)
+
+        # Deleted products leave no updated_at behind; compare ids when the totals disagree
+        available = Product.objects.filter(status='AVAILABLE')
+        if len(self) != available.count():
+            current = set(available.values_list('pk', flat=True))
+            self.update([], removed=set(self._state.terms) - current)
+        self.refreshed_at = time.monotonic()
+
+    def refresh_in_background(self):
+        """Start a refresh() on another thread unless one is running or it isn't due"""
+        if time.monotonic() - self.refreshed_at < REFRESH_INTERVAL or not self._refreshing.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self.refreshed_at = time.monotonic()
+                self._refreshing.release()
+                connection.close()
+
+        threading.Thread(target=run, name='autocomplete-refresh', daemon=True).start()
+
+    # Snapshots
+
+    def save_snapshot(self, path):
+        """Write the current state to `path` atomically"""
+        state = self._state
+        data = {
+            'version': SNAPSHOT_VERSION,
+            'as_of': state.as_of.isoformat() if state.as_of else None,
+            'targets': state.targets,
+            'counts': state.counts,
+            'terms': state.terms,
+            'keys': state.keys,
+            'refs': state.refs,
+        }
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w', encoding='utf-8') as snapshot:
+                json.dump(data, snapshot, separators=(',', ':'))
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def load_snapshot(self, path):
+        """Replace the state with a snapshot; returns False if there is no usable one"""
+        try:
+            with open(path, encoding='utf-8') as snapshot:
+                data = json.load(snapshot)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != SNAPSHOT_VERSION or not data.get('as_of'):
+            return False
+
+        targets = [tuple(target) for target in data['targets']]
+        target_ids = {
+            _identity(kind, label, product_id): target_id
+            for target_id, (kind, label, product_id) in enumerate(targets)
+        }
+        terms = {int(product_id): tuple(ids) for product_id, ids in data['terms'].items()}
+        state = _State(
+            data['keys'], data['refs'], targets, target_ids, data['counts'], terms,
+            datetime.fromisoformat(data['as_of']),
+        )
+        with self._write_lock:
+            self._state = state
+        return True
+
+
+def snapshot_path():
+    return getattr(
+        settings, 'MARKETPLACE_AUTOCOMPLETE_SNAPSHOT', os.path.join(settings.BASE_DIR, 'autocomplete-index.json')
+    )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """The process-wide index, loaded from the snapshot or built on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = PrefixIndex()
+                if index.load_snapshot(snapshot_path()):
+                    index.refresh()
+                else:
+                    index.build()
+                _index = index
+    _index.refresh_in_background()
+    return _index
+
+
+def loaded_index():
+    """The process-wide index if this process has loaded it, else None"""
+    return _index
@@ -0,0 +1,130 @@
+"""
+Versioned caching for hot catalogue reads.
+
+Each cached model has a generation counter stored in Django's cache. Cache
+keys embed the current generation of every model a value depends on, so
+bumping a counter makes all dependent entries unreachable at once; nothing
+has to be deleted and nothing has to know which keys exist.
+
+Counters are bumped from post_save/post_delete (see models.py) and once more
+when the surrounding transaction commits, so a reader that refilled an
+entry from pre-commit data cannot keep it alive. Code that writes with
+queryset.update() or bulk operations calls bump_generation() itself.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Category, Product, RelatedProduct
+
+# Seconds a cached value may live even if nothing is written
+DEFAULT_TIMEOUT = 300
+
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'MARKETPLACE_CACHE_ALIAS', 'default')]
+
+
+def _generation_key(model):
+    return f'marketplace:generation:{model._meta.label_lower}'
+
+
+def _generations(models):
+    cache = _cache()
+    keys = [_generation_key(model) for model in models]
+    found = cache.get_many(keys)
+    generations = []
+    for key in keys:
+        if key not in found:
+            # A lost counter restarts from the clock, never from an old value
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+        generations.append(found[key])
+    return generations
+
+
+def _bump(model):
+    cache = _cache()
+    key = _generation_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+
+def bump_generation(*models):
+    """Invalidate every cached value that depends on any of `models`"""
+    for model in models:
+        _bump(model)
+        transaction.on_commit(lambda model=model: _bump(model))
+
+
+def cached(name, models, build, *key_parts, timeout=DEFAULT_TIMEOUT):
+    """Return the cached value for `name`, calling `build()` on a miss.
+
+    `models` lists the models the value is derived from; a write to any of
+    them makes the entry stale.
+    """
+    cache = _cache()
+    versions = '.'.join(str(generation) for generation in _generations(models))
+    parts = ':'.join(str(part) for part in key_parts)
+    key = f'marketplace:{name}:{parts}:{versions}'
+
+    value = cache.get(key)
+    hit = value is not None
+    if not hit:
+        value = build()
+        cache.set(key, value, timeout)
+
+    with _stats_lock:
+        _stats[name]['hits' if hit else 'misses'] += 1
+    return value
+
+
+def cache_stats():
+    """Hit/miss counters per cached read for this process"""
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in _stats.items()}
+
+
+def get_categories():
+    return cached('categories', [Category], lambda: list(Category.objects.all()))
+
+
+def get_featured_products(limit=6):
+    return cached(
+        'featured_products', [Product, Category],
+        lambda: list(
+            Product.objects.filter(status='AVAILABLE', is_featured=True)
+            .select_related('category')[:limit]
+        ),
+        limit,
+    )
+
+
+def get_related_products(product, limit=4):
+    """Products most often bought or wishlisted with `product`, topped up from its category"""
+    def build():
+        related = [
+            recommendation.related
+            for recommendation in RelatedProduct.objects.filter(
+                product_id=product.id, related__status='AVAILABLE',
+            ).select_related('related__category')[:limit]
+        ]
+        if len(related) < limit:
+            related += Product.objects.filter(
+                category_id=product.category_id, status='AVAILABLE',
+            ).select_related('category').exclude(id__in=[product.id, *(item.id for item in related)])[:limit - len(related)]
+        return related
+
+    return cached(
+        'related_products', [Product, Category, RelatedProduct], build,
+        product.category_id, product.id, limit,
+    )
@@ -0,0 +1,126 @@
+"""
+Order placement for the Masaai marketplace.
+
+`place_order` turns a customer's cart into an Order in one transaction:
+the products are locked in id order (so concurrent checkouts cannot
+deadlock), all order lines are written with a single bulk_create, and stock
+is decremented with conditional UPDATEs that can never take it below zero.
+Stock held by other customers' live cart reservations is not available.
+If any line is short of stock nothing is written.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .cache import bump_generation
+from .models import CartItem, Order, OrderItem, Product
+from .reservations import held_quantities
+
+FREE_SHIPPING_THRESHOLD = Decimal('100')
+STANDARD_SHIPPING_COST = Decimal('15.00')
+
+
+class CheckoutError(Exception):
+    """The cart could not be turned into an order"""
+
+
+class EmptyCart(CheckoutError):
+    def __init__(self):
+        super().__init__('Your cart is empty.')
+
+
+class InsufficientStock(CheckoutError):
+    def __init__(self, product, requested, available):
+        self.product = product
+        self.requested = requested
+        self.available = available
+        super().__init__(
+            f'Only {available} of "{product.name}" left in stock '
+            f'(you asked for {requested}). Please update your cart.'
+        )
+
+
+def shipping_cost_for(subtotal):
+    return STANDARD_SHIPPING_COST if subtotal < FREE_SHIPPING_THRESHOLD else Decimal('0.00')
+
+
+def decrement_stock(product, quantity):
+    """Take `quantity` off a product's stock unless that would oversell it.
+
+    The stock check, the decrement and the switch to OUT_OF_STOCK happen in a
+    single UPDATE, so concurrent writers cannot interleave between them.
+    Returns True if the stock was taken.
+    """
+    return Product.objects.filter(
+        pk=product.pk,
+        status='AVAILABLE',
+        stock_quantity__gte=quantity,
+    ).update(
+        stock_quantity=F('stock_quantity') - quantity,
+        # Right-hand sides see the pre-update row, so this tests the old stock
+        status=Case(
+            When(stock_quantity__lte=quantity, then=Value('OUT_OF_STOCK')),
+            default=F('status'),
+        ),
+        updated_at=timezone.now(),
+    ) == 1
+
+
+def place_order(customer, notes=''):
+    """Create an Order from the customer's cart, or raise CheckoutError"""
+    with transaction.atomic():
+        cart_items = list(CartItem.objects.filter(customer=customer).order_by('product_id'))
+        if not cart_items:
+            raise EmptyCart()
+
+        # Lock the products in a stable order and work from the locked rows
+        products = Product.objects.select_for_update().filter(
+            pk__in=[item.product_id for item in cart_items]
+        ).order_by('pk').in_bulk()
+
+        # Other carts' live holds are promised away; the buyer's own hold is
+        # simply converted into the stock decrement below
+        held = held_quantities(products, exclude_customer=customer)
+        for item in cart_items:
+            product = products[item.product_id]
+            available = product.stock_quantity - held.get(product.pk, 0) if product.is_available else 0
+            if available < item.quantity:
+                raise InsufficientStock(product, item.quantity, max(available, 0))
+
+        subtotal = sum(item.quantity * products[item.product_id].price for item in cart_items)
+        shipping_cost = shipping_cost_for(subtotal)
+
+        order = Order.objects.create(
+            customer=customer,
+            shipping_address=customer.shipping_address or 'Address not provided',
+            billing_address=customer.billing_address or customer.shipping_address or 'Address not provided',
+            shipping_method='STANDARD',
+            subtotal=subtotal,
+            shipping_cost=shipping_cost,
+            total_amount=subtotal + shipping_cost,
+            notes=notes,
+        )
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=item.product_id,
+                quantity=item.quantity,
+                price=products[item.product_id].price,
+            )
+            for item in cart_items
+        ])
+
+        for item in cart_items:
+            product = products[item.product_id]
+            if not decrement_stock(product, item.quantity):
+                product.refresh_from_db(fields=['stock_quantity', 'status'])
+                raise InsufficientStock(product, item.quantity, product.stock_quantity)
+
+        CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+        # Stock and status changed through update(), which sends no signals
+        bump_generation(Product)
+
+    return order
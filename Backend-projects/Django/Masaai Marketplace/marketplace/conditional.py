@@ -0,0 +1,119 @@
+"""
+Conditional GET for catalogue pages.
+
+`conditional_page(state)` wraps a view so that a GET or HEAD is answered
+with 304 Not Modified when nothing the page shows has changed since the
+client's copy. `state(request, *args, **kwargs)` runs before the view, and
+should be a cheap aggregate query. It returns `(last_modified, fingerprint)`,
+where `last_modified` is the newest `updated_at` on the page and
+`fingerprint` is anything else that changes when the page would (row
+counts, ids). If it returns None the view runs unconditionally.
+
+The ETag also covers the user and the full path (the query string selects
+filters and the page), and responses carry `Vary: Cookie`. Pages for
+signed-in users are marked private so shared caches don't store them.
+Works for both sync and async views.
+
+`last_modified` alone misses changes that remove rows, such as a product
+leaving a listing or being deleted, and clients that send only
+If-Modified-Since would get a 304 for them. So the Last-Modified served for
+a page is remembered in the cache per user and path, and moved forward
+whenever the page's ETag changes.
+"""
+import asyncio
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+# Seconds the Last-Modified served for a page is remembered
+LAST_MODIFIED_TIMEOUT = 24 * 60 * 60
+
+
+def _cache():
+    return caches[getattr(settings, 'MARKETPLACE_CACHE_ALIAS', 'default')]
+
+
+def _last_modified(page, etag, last_modified):
+    """Last-Modified timestamp for `page`, later than any served before with another ETag"""
+    cache = _cache()
+    key = f'marketplace:last-modified:{page}'
+    served = cache.get(key)
+    if served is not None and served[0] == etag:
+        return served[1]
+    # A forgotten page restarts from the clock, never from an older time
+    timestamp = max(
+        int(last_modified.timestamp()) if last_modified else 0,
+        served[1] + 1 if served else int(time.time()),
+    )
+    cache.set(key, (etag, timestamp), LAST_MODIFIED_TIMEOUT)
+    return timestamp
+
+
+def _validators(request, state, args, kwargs):
+    """(etag, last_modified timestamp) for the request, or (None, None)"""
+    if request.method not in ('GET', 'HEAD'):
+        return None, None
+    # A 304 would leave pending flash messages unshown
+    if len(get_messages(request)):
+        return None, None
+
+    result = state(request, *args, **kwargs)
+    if result is None:
+        return None, None
+    last_modified, fingerprint = result
+
+    page = repr((request.user.pk, request.get_full_path()))
+    key = repr((fingerprint, last_modified, page))
+    etag = quote_etag(hashlib.sha1(key.encode()).hexdigest())
+    return etag, _last_modified(hashlib.sha1(page.encode()).hexdigest(), etag, last_modified)
+
+
+def _not_modified(request, state, args, kwargs):
+    etag, last_modified = _validators(request, state, args, kwargs)
+    if etag is None:
+        return None, None, None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified), etag, last_modified
+
+
+def _finish(request, response, etag, last_modified):
+    if etag is not None and response.status_code in (200, 304):
+        response.headers.setdefault('ETag', etag)
+        if last_modified:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+        # Revalidate every time; the check is cheaper than the render
+        patch_cache_control(response, max_age=0, must_revalidate=True)
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def conditional_page(state):
+    """Decorator: serve 304s for a view whose page content is summarised by `state`"""
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                not_modified, etag, last_modified = await sync_to_async(_not_modified)(request, state, args, kwargs)
+                if not_modified is not None:
+                    return _finish(request, not_modified, etag, last_modified)
+                response = await view(request, *args, **kwargs)
+                return _finish(request, response, etag, last_modified)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            not_modified, etag, last_modified = _not_modified(request, state, args, kwargs)
+            if not_modified is not None:
+                return _finish(request, not_modified, etag, last_modified)
+            response = view(request, *args, **kwargs)
+            return _finish(request, response, etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,103 @@
+"""
+Facet counts for product search results.
+
+`compute_facets(queryset)` counts the products of an already-filtered
+queryset by category, origin region, price bucket and boolean flag. All of
+it comes from one GROUP BY query over the combination of those columns,
+which is then folded into the individual facets in Python, so the number of
+queries does not grow with the number of categories, regions or buckets.
+"""
+from collections import Counter
+
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .cache import get_categories
+
+# (lower, upper) price bounds; the last bucket is open-ended
+PRICE_BUCKETS = [
+    (0, 25),
+    (25, 50),
+    (50, 100),
+    (100, 250),
+    (250, None),
+]
+
+FLAG_FIELDS = [
+    ('is_featured', 'Featured'),
+    ('is_handmade', 'Handmade'),
+    ('is_traditional_design', 'Traditional design'),
+]
+
+
+def price_bucket_label(lower, upper):
+    if upper is None:
+        return f'${lower}+'
+    if not lower:
+        return f'Under ${upper}'
+    return f'${lower} - ${upper}'
+
+
+def price_bucket():
+    """Index into PRICE_BUCKETS of a product's price, as a query expression"""
+    return Case(
+        *[
+            When(price__lt=upper, then=Value(index))
+            for index, (_, upper) in enumerate(PRICE_BUCKETS)
+            if upper is not None
+        ],
+        default=Value(len(PRICE_BUCKETS) - 1),
+        output_field=IntegerField(),
+    )
+
+
+def compute_facets(queryset):
+    """Facet counts for the products in `queryset`, which may already be filtered"""
+    group_fields = ['category_id', 'origin_region', 'bucket', *(field for field, _ in FLAG_FIELDS)]
+    rows = (
+        # Clear the ordering: ORDER BY columns would be added to the GROUP BY
+        queryset.order_by()
+        .annotate(bucket=price_bucket())
+        .values(*group_fields)
+        .annotate(total=Count('id'))
+    )
+
+    categories, regions, buckets, flags = Counter(), Counter(), Counter(), Counter()
+    total = 0
+    for row in rows:
+        count = row['total']
+        total += count
+        categories[row['category_id']] += count
+        buckets[row['bucket']] += count
+        if row['origin_region']:
+            regions[row['origin_region']] += count
+        for field, _ in FLAG_FIELDS:
+            if row[field]:
+                flags[field] += count
+
+    category_names = {category.id: category.name for category in get_categories()}
+    return {
+        'total': total,
+        'category': [
+            {'value': category_id, 'label': category_names.get(category_id, ''), 'count': count}
+            for category_id, count in categories.most_common()
+        ],
+        'origin_region': [
+            {'value': region, 'label': region, 'count': count}
+            for region, count in regions.most_common()
+        ],
+        'price': [
+            {
+                'value': index,
+                'label': price_bucket_label(lower, upper),
+                'min_price': lower,
+                'max_price': upper,
+                'count': buckets[index],
+            }
+            for index, (lower, upper) in enumerate(PRICE_BUCKETS)
+            if buckets[index]
+        ],
+        'flags': [
+            {'value': field, 'label': label, 'count': flags[field]}
+            for field, label in FLAG_FIELDS
+        ],
+    }
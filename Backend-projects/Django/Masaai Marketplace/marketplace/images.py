@@ -0,0 +1,166 @@
+"""
+Upload-time rendition pipeline for product images.
+
+Once a product saved with a new image has committed, the file is read
+through its storage, hashed (SHA-256) and its size recorded in
+`Product.image_info`, and the resized WebP/JPEG renditions are rendered in a
+process pool. A missing or corrupt upload is logged and skipped; it never
+fails the save. Renditions
+live under a directory named after the content hash, so re-uploading the
+same picture reuses the existing set. Templates switch from the original
+upload to the renditions once a worker has marked them ready (see the
+`marketplace_images` template tags).
+"""
+import hashlib
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image
+
+from .renditions import rendition_path, render_renditions
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FIELDS = ('main_image', 'image_2', 'image_3', 'image_4')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process pool shared by every upload in this server process"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'MARKETPLACE_IMAGE_WORKERS', 2),
+                # Don't fork a threaded web server; workers only need Pillow
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+    return _executor
+
+
+# Errors reading an upload that mean it is unusable, not that the code is wrong
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+def describe_image(field_file):
+    """Content hash and pixel size of a stored image"""
+    digest = hashlib.sha256()
+    with field_file.storage.open(field_file.name, 'rb') as source:
+        for chunk in iter(partial(source.read, 1024 * 1024), b''):
+            digest.update(chunk)
+        source.seek(0)
+        with Image.open(source) as image:
+            width, height = image.size
+    return {
+        'name': field_file.name,
+        'sha256': digest.hexdigest(),
+        'width': width,
+        'height': height,
+        'ready': False,
+    }
+
+
+def renditions_exist(content_hash):
+    # 'detail.jpg' is the last rendition a worker writes
+    return default_storage.exists(rendition_path(content_hash, 'detail', 'jpg'))
+
+
+def collect_image_info(product):
+    """Return (image_info, pending): the refreshed info and the fields still to render"""
+    info = {field: dict(entry) for field, entry in (product.image_info or {}).items()}
+    pending = []
+    for field in IMAGE_FIELDS:
+        field_file = getattr(product, field)
+        if not field_file:
+            info.pop(field, None)
+            continue
+        entry = info.get(field)
+        if entry is None or entry['name'] != field_file.name:
+            try:
+                entry = describe_image(field_file)
+            except IMAGE_ERRORS:
+                logger.warning('Could not read %s of product %s', field, product.pk, exc_info=True)
+                info.pop(field, None)
+                continue
+            entry['ready'] = renditions_exist(entry['sha256'])
+            info[field] = entry
+        if not entry['ready']:
+            pending.append(field)
+    return info, pending
+
+
+def update_image_renditions(product_id):
+    """Record hashes of a product's new uploads and queue their renditions.
+
+    Product.save() runs this once the save has committed, so reading the
+    files neither holds the transaction open nor can fail the save.
+    """
+    from .cache import bump_generation
+    from .models import Product
+
+    product = Product.objects.only('id', 'image_info', *IMAGE_FIELDS).filter(pk=product_id).first()
+    if product is None:
+        return
+    info, pending = collect_image_info(product)
+    if info != product.image_info:
+        Product.objects.filter(pk=product.pk).update(image_info=info, updated_at=timezone.now())
+        bump_generation(Product)
+
+    jobs = []
+    for field in pending:
+        try:
+            path = getattr(product, field).path
+        except NotImplementedError:
+            # Workers render from and into the local filesystem
+            logger.warning('Storage of %s has no local files; renditions are not rendered', field)
+            continue
+        jobs.append((field, path, info[field]['sha256']))
+    if jobs:
+        _submit(product.pk, jobs)
+
+
+def _submit(product_id, jobs):
+    for field, path, content_hash in jobs:
+        future = get_executor().submit(render_renditions, path, str(settings.MEDIA_ROOT), content_hash)
+        future.add_done_callback(partial(_rendered, product_id, field, content_hash))
+
+
+def _rendered(product_id, field, content_hash, future):
+    # Runs on the pool's result thread, which has its own DB connection
+    if future.exception() is not None:
+        logger.error('Rendering %s of product %s failed', field, product_id, exc_info=future.exception())
+        return
+    try:
+        mark_ready(product_id, {field: content_hash})
+    finally:
+        connection.close()
+
+
+def mark_ready(product_id, rendered):
+    """Flag fields whose renditions exist, if they still hold the rendered content"""
+    from .cache import bump_generation
+    from .models import Product
+
+    with transaction.atomic():
+        product = Product.objects.select_for_update().only('id', 'image_info').filter(pk=product_id).first()
+        if product is None:
+            return
+        info = product.image_info
+        changed = False
+        for field, content_hash in rendered.items():
+            entry = info.get(field)
+            if entry and entry['sha256'] == content_hash and not entry['ready']:
+                entry['ready'] = True
+                changed = True
+        if changed:
+            Product.objects.filter(pk=product_id).update(image_info=info, updated_at=timezone.now())
+            bump_generation(Product)
@@ -0,0 +1,224 @@
+"""
+Streaming catalogue import for the Masaai marketplace.
+
+`CatalogImporter` reads product rows one at a time (from CSV or JSON Lines,
+see `read_rows`) and writes them in chunks: every chunk is a multi-row
+INSERT ... ON CONFLICT (sku) DO UPDATE per set of columns its rows have,
+so new products are created and existing ones updated in place. A column a
+row leaves out or empty is not written to an existing product, so a partial
+feed (prices alone, say) keeps its stock, status and flags. Categories are
+resolved from one query up front, memory use does not grow with the file,
+and the search index and catalogue cache are refreshed per chunk because
+bulk writes send no model signals. Rows that can't be read or turned into
+a product are rejected and counted, and the import carries on.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .cache import bump_generation
+from .models import Category, Product
+from .search import get_search_backend
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# Only the first rejected rows are kept for the report
+MAX_REPORTED_ERRORS = 100
+
+# Columns an import row may set; `category` is given by name
+TEXT_FIELDS = [
+    'name', 'short_description', 'description', 'artisan_name', 'artisan_story',
+    'origin_region', 'materials', 'cultural_meaning', 'status', 'dimensions',
+]
+BOOLEAN_FIELDS = ['is_handmade', 'is_traditional_design', 'is_featured']
+REQUIRED_FIELDS = [
+    'sku', 'name', 'category', 'price', 'short_description', 'description', 'materials',
+]
+
+# Always written on conflict; created_at and the review/image bookkeeping are kept
+UPDATE_FIELDS = [
+    'category', 'price', 'updated_at',
+    *(field for field in REQUIRED_FIELDS if field in TEXT_FIELDS),
+]
+
+# Written on conflict only when the row has a value for them
+OPTIONAL_FIELDS = [
+    'stock_quantity', 'weight_grams',
+    *(field for field in TEXT_FIELDS if field not in REQUIRED_FIELDS), *BOOLEAN_FIELDS,
+]
+
+# Validation data taken from the model once, instead of full_clean() per row
+MAX_LENGTHS = {
+    field.name: field.max_length
+    for field in Product._meta.get_fields()
+    if getattr(field, 'max_length', None) and field.name in ['sku', *TEXT_FIELDS]
+}
+STATUSES = {value for value, _ in Product.STATUS_CHOICES}
+
+
+class CatalogImportError(Exception):
+    """A row could not be turned into a product"""
+
+
+def read_rows(path, file_format=None):
+    """Yield one dict per product row from a .csv or .jsonl file.
+
+    A JSON Lines line that isn't valid JSON is yielded as a CatalogImportError,
+    so that the importer rejects that row and carries on.
+    """
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as source:
+        if file_format == 'csv':
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as error:
+                        yield CatalogImportError(f'Invalid JSON: {error}')
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def _parse_int(value, field):
+    if value in (None, ''):
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise CatalogImportError(f'{field} must be a whole number, got {value!r}')
+    if number < 0:
+        raise CatalogImportError(f'{field} cannot be negative')
+    return number
+
+
+class CatalogImporter:
+    """Upsert product rows on SKU in fixed-size chunks"""
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, create_categories=True, progress=None):
+        self.chunk_size = chunk_size
+        self.create_categories = create_categories
+        self.progress = progress
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.search_backend = get_search_backend()
+
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = []
+        self.started = None
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started if self.started else 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def category_id(self, name):
+        name = name.strip()
+        if name not in self.categories:
+            if not self.create_categories:
+                raise CatalogImportError(f'Unknown category {name!r}')
+            category, _ = Category.objects.get_or_create(name=name)
+            self.categories[name] = category.id
+            bump_generation(Category)
+        return self.categories[name]
+
+    def build_product(self, row):
+        """Turn one import row into (unsaved Product, fields to write on conflict), or raise CatalogImportError"""
+        if isinstance(row, CatalogImportError):
+            raise row
+        if not isinstance(row, dict):
+            raise CatalogImportError('Each row must be an object')
+        missing = [field for field in REQUIRED_FIELDS if not str(row.get(field) or '').strip()]
+        if missing:
+            raise CatalogImportError(f'Missing {", ".join(missing)}')
+
+        try:
+            price = Decimal(str(row['price']))
+        except InvalidOperation:
+            raise CatalogImportError(f'price must be a number, got {row["price"]!r}')
+        if not price.is_finite() or price < 0 or price.as_tuple().exponent < -2 or price >= 10 ** 8:
+            raise CatalogImportError(f'price must be between 0 and 99999999.99, got {row["price"]!r}')
+
+        values = {field: str(row.get(field) or '').strip() for field in TEXT_FIELDS}
+        values['sku'] = str(row['sku']).strip()
+        values['status'] = values['status'].upper() or 'AVAILABLE'
+        if values['status'] not in STATUSES:
+            raise CatalogImportError(f'Unknown status {values["status"]!r}')
+        for field, max_length in MAX_LENGTHS.items():
+            if len(values[field]) > max_length:
+                raise CatalogImportError(f'{field} is longer than {max_length} characters')
+        for field in BOOLEAN_FIELDS:
+            if row.get(field) not in (None, ''):
+                values[field] = _parse_bool(row[field])
+
+        product = Product(
+            category_id=self.category_id(str(row['category'])),
+            price=price,
+            stock_quantity=_parse_int(row.get('stock_quantity'), 'stock_quantity') or 0,
+            weight_grams=_parse_int(row.get('weight_grams'), 'weight_grams'),
+            **values,
+        )
+        # A missing or empty column keeps the existing product's value
+        update_fields = UPDATE_FIELDS + [field for field in OPTIONAL_FIELDS if row.get(field) not in (None, '')]
+        return product, tuple(update_fields)
+
+    def run(self, rows):
+        """Import every row of an iterable; bad rows are skipped and the first few kept in `errors`"""
+        self.started = time.monotonic()
+        chunk = {}
+        for row_number, row in enumerate(rows, start=1):
+            try:
+                product, update_fields = self.build_product(row)
+            except CatalogImportError as error:
+                self.skipped += 1
+                if len(self.errors) < MAX_REPORTED_ERRORS:
+                    self.errors.append((row_number, str(error)))
+                continue
+            # A SKU repeated inside one statement is an error on Postgres; the last row wins
+            chunk[product.sku] = (product, update_fields)
+            if len(chunk) >= self.chunk_size:
+                self.write_chunk(list(chunk.values()))
+                chunk = {}
+        if chunk:
+            self.write_chunk(list(chunk.values()))
+        return self
+
+    def write_chunk(self, rows):
+        """Upsert (product, update_fields) pairs, one statement per set of columns"""
+        by_fields = {}
+        for product, update_fields in rows:
+            by_fields.setdefault(update_fields, []).append(product)
+        products = [product for product, _ in rows]
+        skus = [product.sku for product in products]
+        with transaction.atomic():
+            existing = Product.objects.filter(sku__in=skus).count()
+            for update_fields, group in by_fields.items():
+                Product.objects.bulk_create(
+                    group,
+                    update_conflicts=True,
+                    unique_fields=['sku'],
+                    update_fields=list(update_fields),
+                )
+            # Upserted rows don't reliably come back with their ids
+            product_ids = list(Product.objects.filter(sku__in=skus).values_list('id', flat=True))
+            self.search_backend.index_products(product_ids)
+            bump_generation(Product)
+
+        self.rows += len(products)
+        self.updated += existing
+        self.created += len(products) - existing
+        if self.progress:
+            self.progress(self)
@@ -0,0 +1,130 @@
+"""
+Django management command to compare sync and async catalogue view latency on a slow database
+"""
+import asyncio
+import statistics
+import time
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+from marketplace import async_views, views
+from marketplace.cache import bump_generation
+from marketplace.models import Category, Product, RelatedProduct
+from marketplace.search import get_search_backend
+from marketplace.shoppers import Shopper
+
+BENCH_CATEGORY = 'Benchmark (async views)'
+
+
+class Command(BaseCommand):
+    help = (
+        'Time product_detail, home and search_products through the sync and async views, '
+        'with an artificial delay added to every database query'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delay', type=float, default=5.0, help='Milliseconds added to every query')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per view and path')
+        parser.add_argument(
+            '--warm-cache',
+            action='store_true',
+            help='Let cached catalogue reads hit the cache (by default every request misses it)',
+        )
+
+    def handle(self, *args, **options):
+        self.delay = options['delay'] / 1000
+        self.warm_cache = options['warm_cache']
+
+        # Test data must be committed: the async views read on other threads' connections
+        product = self.seed()
+        connection.execute_wrappers.append(self.slow_query)
+        connection_created.connect(self.slow_connection)
+        try:
+            factory = RequestFactory()
+            cases = [
+                ('product_detail', factory.get(f'/product/{product.id}/'), (product.id,)),
+                ('home', factory.get('/'), ()),
+                ('search_products', factory.get('/search/', {'query': 'necklace'}), ()),
+            ]
+            self.stdout.write(f'{"view":18} {"sync p50":>10} {"async p50":>10} {"speedup":>8}')
+            for name, request, args in cases:
+                request.user = AnonymousUser()
+                # Normally set by shopper_middleware
+                request.shopper = Shopper(request)
+                sync_timings = self.time_sync(getattr(views, name), request, args, options['repeat'])
+                async_timings = asyncio.run(
+                    self.time_async(getattr(async_views, name), request, args, options['repeat'])
+                )
+                sync_p50, async_p50 = statistics.median(sync_timings), statistics.median(async_timings)
+                self.stdout.write(
+                    f'{name:18} {sync_p50:8.1f}ms {async_p50:8.1f}ms {sync_p50 / async_p50:7.2f}x'
+                )
+        finally:
+            connection_created.disconnect(self.slow_connection)
+            for wrapper in connections.all(initialized_only=True):
+                if self.slow_query in wrapper.execute_wrappers:
+                    wrapper.execute_wrappers.remove(self.slow_query)
+            if self.slow_query in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self.slow_query)
+            Category.objects.filter(name=BENCH_CATEGORY).delete()
+
+        self.stdout.write(self.style.SUCCESS(f'Benchmarked with {options["delay"]}ms per query; data removed'))
+
+    def slow_query(self, execute, sql, params, many, context):
+        time.sleep(self.delay)
+        return execute(sql, params, many, context)
+
+    def slow_connection(self, sender, connection, **kwargs):
+        # Fires again whenever a worker thread reconnects on the same wrapper
+        if self.slow_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self.slow_query)
+
+    def before_request(self):
+        if not self.warm_cache:
+            bump_generation(Product, Category, RelatedProduct)
+
+    def time_sync(self, view, request, args, repeat):
+        view(request, *args)  # warm up
+        timings = []
+        for _ in range(repeat):
+            self.before_request()
+            started = time.perf_counter()
+            view(request, *args)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    async def time_async(self, view, request, args, repeat):
+        await view(request, *args)  # warm up
+        timings = []
+        for _ in range(repeat):
+            await sync_to_async(self.before_request)()
+            started = time.perf_counter()
+            await view(request, *args)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def seed(self):
+        Category.objects.filter(name=BENCH_CATEGORY).delete()
+        category = Category.objects.create(name=BENCH_CATEGORY)
+        Product.objects.bulk_create([
+            Product(
+                name=f'Beaded benchmark necklace {i}',
+                category=category,
+                short_description='Beaded necklace',
+                description='Layered glass bead necklace',
+                price=Decimal(20 + i),
+                materials='Glass beads',
+                stock_quantity=10,
+                is_featured=i < 6,
+                sku=f'BENCH-ASYNC-{i:04d}',
+            )
+            for i in range(50)
+        ])
+        # bulk_create skips the post_save handler that indexes products for search
+        products = Product.objects.filter(category=category).order_by('pk')
+        get_search_backend().index_products(list(products.values_list('id', flat=True)))
+        return products.first()
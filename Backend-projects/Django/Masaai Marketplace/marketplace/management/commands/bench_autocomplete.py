@@ -0,0 +1,80 @@
+"""
+Django management command to benchmark the autocomplete prefix index
+"""
+import os
+import random
+import statistics
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from marketplace.autocomplete import PrefixIndex
+from marketplace.management.commands.bench_search import ADJECTIVES, ARTISANS, FILLER, ITEMS, MATERIALS, REGIONS
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the autocomplete index over synthetic products in memory and time lookups, '
+        'incremental updates and snapshot save/load; the database is not touched'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000, help='Number of synthetic products')
+        parser.add_argument('--lookups', type=int, default=20000, help='Timed lookups')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        rows = [self.row(pk, rng) for pk in range(1, options['products'] + 1)]
+
+        index = PrefixIndex()
+        started = time.perf_counter()
+        index.update(rows, as_of=timezone.now())
+        self.stdout.write(f'Built {len(index)} products, {index.key_count} keys in {time.perf_counter() - started:.2f}s')
+
+        # What people type: the first few letters of a word in a real label
+        labels = [row[rng.randrange(1, 5)] or row[1] for row in rng.sample(rows, 2000)]
+        prefixes = []
+        for _ in range(options['lookups']):
+            words = rng.choice(labels).split()
+            start = rng.randrange(len(words))
+            text = ' '.join(words[start:])
+            prefixes.append(text[:rng.randint(2, min(len(text), 12))])
+
+        timings = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.suggest(prefix)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f'{len(timings)} lookups: p50 {statistics.median(timings):.3f}ms, '
+            f'p99 {timings[int(len(timings) * 0.99)]:.3f}ms, max {timings[-1]:.3f}ms'
+        )
+
+        # Saves that leave the suggestions alone (stock, price) and ones that rename
+        for label, updates in [
+            ('unchanged', rng.sample(rows, 100)),
+            ('renamed', [self.row(pk, rng) for pk in rng.sample(range(1, options['products'] + 1), 100)]),
+        ]:
+            started = time.perf_counter()
+            for row in updates:
+                index.update([row])
+            self.stdout.write(f'100 single-product updates, {label}: {(time.perf_counter() - started) * 10:.2f}ms each')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'autocomplete-index.json')
+            started = time.perf_counter()
+            index.save_snapshot(path)
+            saved = time.perf_counter() - started
+            started = time.perf_counter()
+            PrefixIndex().load_snapshot(path)
+            loaded = time.perf_counter() - started
+            self.stdout.write(
+                f'Snapshot: {os.path.getsize(path) / 1e6:.1f} MB, saved in {saved:.2f}s, loaded in {loaded:.2f}s'
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Benchmarked {options["products"]} products'))
+
+    def row(self, pk, rng):
+        name = f'{rng.choice(ADJECTIVES).title()} {rng.choice(FILLER)} {rng.choice(ITEMS)}'
+        return (pk, name, rng.choice(ARTISANS), ', '.join(rng.sample(MATERIALS, 2)), rng.choice(REGIONS))
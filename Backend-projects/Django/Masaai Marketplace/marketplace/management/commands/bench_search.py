@@ -0,0 +1,88 @@
+"""
+Django management command to benchmark product search latency per backend
+"""
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from marketplace.models import Category, Product
+from marketplace.search import LikeSearchBackend, get_search_backend
+
+ADJECTIVES = ['beaded', 'woven', 'carved', 'traditional', 'bright', 'ceremonial', 'layered', 'handmade']
+ITEMS = ['necklace', 'collar', 'bracelet', 'earrings', 'basket', 'sandals', 'belt', 'anklet', 'headband']
+MATERIALS = ['glass beads', 'leather', 'silver wire', 'brass', 'sisal', 'cowrie shells', 'bone', 'copper']
+REGIONS = ['Kenya', 'Tanzania', 'Narok', 'Kajiado', 'Arusha', 'Samburu', 'Laikipia']
+ARTISANS = ['Naserian', 'Nkirote', 'Sintamei', 'Lemayian', 'Kakuta', 'Resian', 'Saitoti']
+
+# Filler vocabulary for descriptions, so common query words are not in every row
+SYLLABLES = ['ka', 'ni', 'so', 'ma', 'le', 'tu', 'ra', 'shi', 'mo', 'en', 'ki', 'ya']
+FILLER = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+
+QUERIES = ['beaded necklace', 'leather', 'samburu collar', 'silver wire bracelet', 'kanima', 'naserian anklet']
+
+
+class Command(BaseCommand):
+    help = 'Seed synthetic products in a rolled-back transaction and time searches on each backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000, help='Number of synthetic products')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        backends = [get_search_backend()]
+        if backends[0].name != LikeSearchBackend.name:
+            backends.append(LikeSearchBackend())
+
+        with transaction.atomic():
+            self.seed(options['products'], rng)
+            backends[0].rebuild()
+
+            base = Product.objects.filter(status='AVAILABLE').select_related('category')
+            self.stdout.write(f'{"query":22} {"matches":>8} ' + ' '.join(f'{b.name + " p50/p95":>24}' for b in backends))
+            for query in QUERIES:
+                cells = []
+                for backend in backends:
+                    list(backend.search(base, query)[:12])  # warm up
+                    timings = []
+                    for _ in range(options['repeat']):
+                        started = time.perf_counter()
+                        list(backend.search(base, query)[:12])
+                        timings.append((time.perf_counter() - started) * 1000)
+                    timings.sort()
+                    p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+                    cells.append(f'{statistics.median(timings):10.2f} / {p95:8.2f}ms')
+                matches = backends[0].search(base, query).count()
+                self.stdout.write(f'{query:22} {matches:>8} ' + ' '.join(f'{cell:>24}' for cell in cells))
+
+            # Leave the database as we found it
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(f'Benchmarked {options["products"]} products; data rolled back'))
+
+    def seed(self, count, rng):
+        self.stdout.write(f'Seeding {count} products...')
+        category = Category.objects.create(name='Benchmark')
+        batch = []
+        for i in range(count):
+            item = rng.choice(ITEMS)
+            name = f'{rng.choice(ADJECTIVES).title()} {rng.choice(REGIONS)} {item}'
+            batch.append(Product(
+                name=name,
+                category=category,
+                short_description=f'{name} made with {rng.choice(MATERIALS)}',
+                description=' '.join(rng.choice(FILLER) for _ in range(40)),
+                price=Decimal(rng.randint(500, 20000)) / 100,
+                materials=', '.join(rng.sample(MATERIALS, 2)),
+                artisan_name=rng.choice(ARTISANS),
+                origin_region=rng.choice(REGIONS),
+                stock_quantity=rng.randint(0, 50),
+                sku=f'BENCH-{i:07d}',
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_create(batch)
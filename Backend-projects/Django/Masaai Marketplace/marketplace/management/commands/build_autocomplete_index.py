@@ -0,0 +1,30 @@
+"""
+Django management command to rebuild the autocomplete index and write its snapshot file
+"""
+import time
+from django.core.management.base import BaseCommand
+from marketplace.autocomplete import PrefixIndex, snapshot_path
+
+
+class Command(BaseCommand):
+    help = (
+        'Index every available product for search autocomplete and write the snapshot '
+        'that new worker processes start from'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Snapshot file (default: the MARKETPLACE_AUTOCOMPLETE_SNAPSHOT setting)')
+
+    def handle(self, *args, **options):
+        path = options['path'] or snapshot_path()
+        started = time.monotonic()
+        index = PrefixIndex()
+        index.build()
+        built = time.monotonic() - started
+        index.save_snapshot(path)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {len(index)} products ({index.key_count} keys) in {built:.1f}s; "
+                f"snapshot written to {path} in {time.monotonic() - started - built:.1f}s"
+            )
+        )
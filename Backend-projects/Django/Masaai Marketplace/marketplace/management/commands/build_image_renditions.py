@@ -0,0 +1,118 @@
+"""
+Django management command to backfill resized renditions for existing product images
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from marketplace.cache import bump_generation
+from marketplace.images import IMAGE_FIELDS, collect_image_info
+from marketplace.models import Product
+from marketplace.renditions import render_renditions, rendition_path
+
+
+class Command(BaseCommand):
+    help = 'Hash every product image and render its missing thumbnail/card/detail renditions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of worker processes rendering images',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Number of products hashed and written per batch',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        media_root = str(settings.MEDIA_ROOT)
+        rendered = set()
+        stats = {'products': 0, 'images': 0, 'renditions': 0, 'failed': 0, 'original_bytes': 0, 'card_bytes': 0}
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            batch = []
+            products = Product.objects.order_by('pk').only('id', 'image_info', *IMAGE_FIELDS)
+            for product in products.iterator(chunk_size=batch_size):
+                batch.append(product)
+                if len(batch) >= batch_size:
+                    self.process_batch(batch, executor, media_root, rendered, stats)
+                    batch = []
+            if batch:
+                self.process_batch(batch, executor, media_root, rendered, stats)
+
+        bump_generation(Product)
+
+        summary = (
+            f"Renditions built: {stats['renditions']} files for {stats['images']} images "
+            f"on {stats['products']} products ({stats['failed']} failed)"
+        )
+        if stats['card_bytes']:
+            summary += (
+                f". Card WebP renditions are {stats['card_bytes'] / stats['original_bytes']:.1%} "
+                f"of the original bytes ({stats['original_bytes']:,} -> {stats['card_bytes']:,})"
+            )
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def process_batch(self, products, executor, media_root, rendered, stats):
+        infos = {}
+        jobs = {}
+        for product in products:
+            info, pending = collect_image_info(product)
+            infos[product.pk] = info
+            for field in pending:
+                content_hash = info[field]['sha256']
+                # Identical files across products are rendered once
+                if content_hash in rendered or content_hash in jobs:
+                    continue
+                try:
+                    jobs[content_hash] = getattr(product, field).path
+                except NotImplementedError:
+                    # Workers render from and into the local filesystem
+                    self.stderr.write(f'Storage of {field} has no local files; renditions are not rendered')
+
+        futures = {
+            content_hash: executor.submit(render_renditions, path, media_root, content_hash)
+            for content_hash, path in jobs.items()
+        }
+        for content_hash, future in futures.items():
+            try:
+                stats['renditions'] += future.result()
+                rendered.add(content_hash)
+            except Exception as error:
+                stats['failed'] += 1
+                self.stderr.write(f'Could not render {jobs[content_hash]}: {error}')
+
+        changed = []
+        for product in products:
+            info = infos[product.pk]
+            for field, entry in info.items():
+                if not entry['ready'] and entry['sha256'] in rendered:
+                    entry['ready'] = True
+                if entry['ready']:
+                    try:
+                        original_bytes = getattr(product, field).size
+                        card_bytes = os.path.getsize(
+                            os.path.join(media_root, rendition_path(entry['sha256'], 'card', 'webp'))
+                        )
+                    except OSError as error:
+                        # Left out of the totals when the original or its rendition has gone missing
+                        self.stderr.write(f'Could not size {field} of product {product.pk}: {error}')
+                        continue
+                    stats['images'] += 1
+                    stats['original_bytes'] += original_bytes
+                    stats['card_bytes'] += card_bytes
+            if info != product.image_info:
+                product.image_info = info
+                changed.append(product)
+
+        now = timezone.now()
+        for product in changed:
+            product.updated_at = now
+        Product.objects.bulk_update(changed, ['image_info', 'updated_at'])
+        stats['products'] += len(products)
@@ -0,0 +1,31 @@
+"""
+Django management command to update the "customers also bought" recommendations
+"""
+import time
+from django.core.management.base import BaseCommand
+from marketplace.recommendations import update_recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Bring the product co-occurrence counts up to date with the orders and wishlist '
+        'entries added or removed since the last run, and re-rank the affected products'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Discard the stored counts and rebuild them from all orders and wishlists',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stats = update_recommendations(full=options['full'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Recommendations updated in {time.monotonic() - started:.1f}s: "
+                f"{stats['customers']} customers with changed activity, {stats['pairs']} pair counts changed, "
+                f"{stats['products']} products re-ranked ({stats['recommendations']} recommendations)"
+            )
+        )
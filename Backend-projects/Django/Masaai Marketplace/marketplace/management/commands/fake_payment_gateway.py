@@ -0,0 +1,117 @@
+"""
+Django management command to play a payment gateway firing webhooks at the marketplace, for load tests
+"""
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from marketplace.models import Order
+from marketplace.payments import SIGNATURE_HEADER, sign
+
+
+class Command(BaseCommand):
+    help = (
+        'Send signed payment events for existing pending orders to the payment webhook, '
+        'including retries and out-of-order deliveries, and report the throughput'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000/payments/webhook/',
+            help='Webhook URL (default: %(default)s)',
+        )
+        parser.add_argument('--orders', type=int, default=1000, help='Pending orders to pay for (default: 1000)')
+        parser.add_argument('--batch', type=int, default=50, help='Events per request (default: 50)')
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight (default: 8)')
+        parser.add_argument('--rate', type=float, default=0, help='Events per second to aim for; 0 for no limit')
+        parser.add_argument(
+            '--duplicates',
+            type=float,
+            default=0.1,
+            help='Fraction of events delivered twice (default: 0.1)',
+        )
+        parser.add_argument('--secret', help='Webhook secret (default: the one in settings)')
+        parser.add_argument('--seed', type=int, help='Random seed, for repeatable runs')
+
+    def lifecycle(self, order, rng):
+        """Events one transaction goes through: mostly paid, some failed or refunded"""
+        base = {
+            'transaction_id': f'txn_{uuid.UUID(int=rng.getrandbits(128)).hex}',
+            'order_number': order.order_number,
+            'amount': str(order.total_amount),
+            'payment_method': rng.choice(['CREDIT_CARD', 'MOBILE_MONEY', 'PAYPAL']),
+        }
+        roll = rng.random()
+        if roll < 0.1:
+            statuses = ['PENDING', 'FAILED']
+        elif roll < 0.15:
+            statuses = ['PENDING', 'FAILED', 'COMPLETED']
+        elif roll < 0.2:
+            statuses = ['PENDING', 'COMPLETED', 'REFUNDED']
+        else:
+            statuses = ['PENDING', 'COMPLETED']
+        return [dict(base, status=status) for status in statuses]
+
+    def build_events(self, orders, duplicates, rng):
+        events = []
+        for order in orders:
+            events.extend(self.lifecycle(order, rng))
+        events.extend(rng.sample(events, int(len(events) * duplicates)))
+        # Deliveries overlap, so events arrive roughly but not exactly in order
+        keyed = [(index + rng.uniform(0, 200), event) for index, event in enumerate(events)]
+        return [event for _, event in sorted(keyed, key=lambda pair: pair[0])]
+
+    def send(self, url, secret, events):
+        body = json.dumps(events).encode()
+        request = urllib.request.Request(
+            url,
+            data=body,
+            headers={'Content-Type': 'application/json', SIGNATURE_HEADER: sign(body, secret)},
+            method='POST',
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+        except urllib.error.URLError:
+            return 'connection error'
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        orders = list(Order.objects.filter(status='PENDING').only('order_number', 'total_amount')[:options['orders']])
+        if not orders:
+            raise CommandError('No pending orders to send payment events for')
+
+        events = self.build_events(orders, options['duplicates'], rng)
+        size = max(options['batch'], 1)
+        requests = [events[start:start + size] for start in range(0, len(events), size)]
+        self.stdout.write(
+            f"Sending {len(events)} events for {len(orders)} orders in {len(requests)} requests to {options['url']}"
+        )
+
+        statuses = Counter()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            futures = []
+            for index, batch in enumerate(requests):
+                if options['rate']:
+                    # Hold back submissions that would run ahead of the target rate
+                    due = started + index * size / options['rate']
+                    time.sleep(max(0, due - time.monotonic()))
+                futures.append(executor.submit(self.send, options['url'], options['secret'], batch))
+            for future in futures:
+                statuses[future.result()] += 1
+        elapsed = time.monotonic() - started
+
+        summary = ', '.join(f'{count} x {status}' for status, count in statuses.most_common())
+        style = self.style.SUCCESS if set(statuses) == {202} else self.style.WARNING
+        self.stdout.write(
+            style(f"{len(events)} events sent in {elapsed:.2f}s ({len(events) / elapsed:.0f} events/s); responses: {summary}")
+        )
@@ -0,0 +1,62 @@
+"""
+Django management command to import products from a CSV or JSON Lines file
+"""
+from django.core.management.base import BaseCommand, CommandError
+from marketplace.importer import DEFAULT_CHUNK_SIZE, CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream products from a CSV or JSONL file into the catalogue, creating new '
+        'products and updating existing ones matched on SKU'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file; one product per row')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help='File format (default: guessed from the file extension)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help='Number of products written per bulk upsert',
+        )
+        parser.add_argument(
+            '--no-create-categories',
+            action='store_true',
+            help='Reject rows whose category does not exist instead of creating it',
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        importer = CatalogImporter(
+            chunk_size=options['chunk_size'],
+            create_categories=not options['no_create_categories'],
+            progress=self.report_progress,
+        )
+        try:
+            importer.run(read_rows(options['path'], options['format']))
+        except OSError as error:
+            raise CommandError(f'Could not read {options["path"]}: {error}')
+        except ValueError as error:
+            raise CommandError(f'{options["path"]} is not valid {options["format"] or "input"}: {error}')
+
+        for row_number, message in importer.errors:
+            self.stderr.write(f'  Row {row_number}: {message}')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Import completed in {importer.elapsed:.1f}s '
+                f'({importer.rows_per_second:,.0f} rows/sec)\n'
+                f'Products created: {importer.created}\n'
+                f'Products updated: {importer.updated}\n'
+                f'Rows skipped: {importer.skipped}'
+            )
+        )
+
+    def report_progress(self, importer):
+        if self.verbosity >= 1:
+            self.stdout.write(f'  {importer.rows:,} rows ({importer.rows_per_second:,.0f} rows/sec)')
@@ -5,6 +5,7 @@ import os
 import sys
 from django.core.management.base import BaseCommand
 from django.core.files.base import ContentFile
+from marketplace.importer import CatalogImporter
 from marketplace.models import Category, Product
 from decimal import Decimal
 
@@ -43,40 +44,29 @@ class Command(BaseCommand):
                 categories_created += 1
                 self.stdout.write(f'  Created category: {category_name}')
 
-        # Get the Jewelry category for our products
-        jewelry_category = Category.objects.get(name='Jewelry')
-
-        # Create products
+        # Create products: one bulk upsert keyed on SKU, so re-running updates them
         self.stdout.write('Creating Masaai necklace products...')
-        products_created = 0
-        
-        for product_data in MASAAI_NECKLACES:
-            # Generate SKU
-            sku = f"{product_data['sku_prefix']}-{Product.objects.count() + 1:04d}"
-            
-            product, created = Product.objects.get_or_create(
-                name=product_data['name'],
-                defaults={
-                    'description': product_data['description'],
-                    'short_description': product_data['description'][:200],  # Shortened for short_description
-                    'price': Decimal(str(product_data['price'])),
-                    'category': jewelry_category,
-                    'sku': sku,
-                    'stock_quantity': product_data['stock_quantity'],
-                    'is_featured': product_data['is_featured'],
-                    'artisan_name': product_data['artisan_name'],
-                    'origin_region': product_data['origin_region'],
-                    'cultural_meaning': product_data['cultural_meaning'],
-                    'materials': 'Traditional glass beads, silver wire, leather cord',
-                    'status': 'AVAILABLE',
-                }
-            )
-            
-            if created:
-                products_created += 1
-                self.stdout.write(f'  Created product: {product.name} (${product.price})')
-            else:
-                self.stdout.write(f'  Product already exists: {product.name}')
+        rows = [
+            {
+                'sku': f"{product_data['sku_prefix']}-{number:04d}",
+                'name': product_data['name'],
+                'description': product_data['description'],
+                'short_description': product_data['description'][:200],  # Shortened for short_description
+                'price': product_data['price'],
+                'category': 'Jewelry',
+                'stock_quantity': product_data['stock_quantity'],
+                'is_featured': product_data['is_featured'],
+                'artisan_name': product_data['artisan_name'],
+                'origin_region': product_data['origin_region'],
+                'cultural_meaning': product_data['cultural_meaning'],
+                'materials': 'Traditional glass beads, silver wire, leather cord',
+                'status': 'AVAILABLE',
+            }
+            for number, product_data in enumerate(MASAAI_NECKLACES, start=1)
+        ]
+        importer = CatalogImporter().run(rows)
+        for row_number, message in importer.errors:
+            self.stderr.write(f'  Skipped {rows[row_number - 1]["name"]}: {message}')
 
         # Summary
         total_value = sum(Decimal(str(p['price'])) * p['stock_quantity'] for p in MASAAI_NECKLACES)
@@ -85,7 +75,8 @@ class Command(BaseCommand):
             self.style.SUCCESS(
                 f'\nDemo data creation completed!\n'
                 f'Categories created: {categories_created}\n'
-                f'Products created: {products_created}\n'
+                f'Products created: {importer.created}\n'
+                f'Products updated: {importer.updated}\n'
                 f'Total inventory value: ${total_value}\n'
                 f'Featured products: {sum(1 for p in MASAAI_NECKLACES if p["is_featured"])}\n'
             )
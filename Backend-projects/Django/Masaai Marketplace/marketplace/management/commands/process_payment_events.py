@@ -0,0 +1,54 @@
+"""
+Django management command to apply received payment gateway events to payments and orders
+"""
+import time
+from django.core.management.base import BaseCommand
+from marketplace.payments import DEFAULT_BATCH_SIZE, process_events
+
+
+class Command(BaseCommand):
+    help = (
+        'Apply the payment webhook events received since the last run to Payment and Order, '
+        'in batches, and report the processing lag'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f'Events applied per transaction (default: {DEFAULT_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--follow',
+            action='store_true',
+            help='Keep running, polling for new events',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds between polls with --follow (default: 1)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            stats = process_events(batch_size=options['batch_size'])
+            if stats['events'] or not options['follow']:
+                self.report(stats, time.monotonic() - started)
+            if not options['follow']:
+                break
+            time.sleep(options['interval'])
+
+    def report(self, stats, elapsed):
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{stats['events']} events in {stats['batches']} batches applied in {elapsed:.2f}s "
+                f"({stats['events'] / elapsed if elapsed else 0:.0f}/s): "
+                f"{stats['transactions']} transactions, {stats['payments']} payments updated, "
+                f"{stats['created']} created, {stats['orders']} orders updated, "
+                f"{stats['unmatched']} for unknown orders. "
+                f"Lag mean {stats['mean_lag']:.2f}s, p95 {stats['p95_lag']:.2f}s, max {stats['max_lag']:.2f}s"
+            )
+        )
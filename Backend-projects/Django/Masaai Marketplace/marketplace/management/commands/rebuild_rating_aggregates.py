@@ -0,0 +1,83 @@
+"""
+Django management command to rebuild the stored review aggregates on products
+"""
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from marketplace.cache import bump_generation
+from marketplace.models import Product, Review
+
+RATING_FIELDS = [
+    'rating_sum', 'rating_count',
+    'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+]
+
+
+class Command(BaseCommand):
+    help = 'Recompute rating_sum, rating_count and the star histogram for every product from its reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of products written per bulk update',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # Pages showing a changed rating must not be served as unchanged
+        now = timezone.now()
+
+        with transaction.atomic():
+            # One grouped query: review count per (product, rating)
+            histograms = defaultdict(lambda: [0] * 5)
+            rows = (
+                Review.objects.order_by()
+                .values('product_id', 'rating')
+                .annotate(total=Count('id'))
+                .values_list('product_id', 'rating', 'total')
+            )
+            for product_id, rating, total in rows:
+                histograms[product_id][rating - 1] = total
+
+            updated = 0
+            pending = []
+            products = Product.objects.order_by().only('id', 'updated_at', *RATING_FIELDS)
+            for product in products.iterator(chunk_size=batch_size):
+                counts = histograms.get(product.id, [0] * 5)
+                values = {
+                    'rating_sum': sum(stars * count for stars, count in enumerate(counts, start=1)),
+                    'rating_count': sum(counts),
+                }
+                for stars, count in enumerate(counts, start=1):
+                    values[f'rating_{stars}_count'] = count
+
+                if any(getattr(product, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(product, field, value)
+                    product.updated_at = now
+                    pending.append(product)
+
+                if len(pending) >= batch_size:
+                    Product.objects.bulk_update(pending, [*RATING_FIELDS, 'updated_at'])
+                    updated += len(pending)
+                    pending = []
+
+            if pending:
+                Product.objects.bulk_update(pending, [*RATING_FIELDS, 'updated_at'])
+                updated += len(pending)
+
+            # bulk_update sends no post_save
+            if updated:
+                bump_generation(Product)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Rating aggregates rebuilt: {updated} products updated, '
+                f'{len(histograms)} products have reviews'
+            )
+        )
@@ -0,0 +1,20 @@
+"""
+Django management command to rebuild the product full-text search index
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from marketplace.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index from the product table'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        with transaction.atomic():
+            indexed = backend.rebuild()
+
+        if backend.name == 'sqlite-fts5':
+            self.stdout.write(self.style.SUCCESS(f'Search index rebuilt: {indexed} products indexed'))
+        else:
+            self.stdout.write(f'The {backend.name} search backend has no separate index to rebuild')
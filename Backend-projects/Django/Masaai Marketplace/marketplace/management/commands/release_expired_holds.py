@@ -0,0 +1,13 @@
+"""
+Django management command to release expired cart stock holds
+"""
+from django.core.management.base import BaseCommand
+from marketplace.reservations import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Clear cart reservations whose hold time has passed (run every few minutes from cron)'
+
+    def handle(self, *args, **options):
+        released = release_expired_holds()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired cart holds'))
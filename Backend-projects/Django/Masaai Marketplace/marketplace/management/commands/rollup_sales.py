@@ -0,0 +1,31 @@
+"""
+Django management command to update the daily and weekly sales rollups
+"""
+import time
+from django.core.management.base import BaseCommand
+from marketplace.reporting import update_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the sales rollups of the days and weeks with orders placed or changed '
+        'since the last run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Discard all rollups and rebuild them from every order',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stats = update_rollups(full=options['full'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Sales rollups updated in {time.monotonic() - started:.1f}s: "
+                f"{stats['days']} days and {stats['weeks']} weeks recomputed ({stats['rows']} rows), "
+                f"orders changed up to {stats['watermark'] or 'now'} included"
+            )
+        )
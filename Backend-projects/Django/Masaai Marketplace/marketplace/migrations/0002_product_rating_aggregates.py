@@ -0,0 +1,74 @@
+# Generated by Django 4.2.18 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Product = apps.get_model('marketplace', 'Product')
+    Review = apps.get_model('marketplace', 'Review')
+
+    histograms = {}
+    rows = (
+        Review.objects.order_by()
+        .values('product_id', 'rating')
+        .annotate(total=Count('id'))
+        .values_list('product_id', 'rating', 'total')
+    )
+    for product_id, rating, total in rows:
+        histograms.setdefault(product_id, [0] * 5)[rating - 1] = total
+
+    for product_id, counts in histograms.items():
+        values = {
+            'rating_sum': sum(stars * count for stars, count in enumerate(counts, start=1)),
+            'rating_count': sum(counts),
+        }
+        for stars, count in enumerate(counts, start=1):
+            values[f'rating_{stars}_count'] = count
+        Product.objects.filter(pk=product_id).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.18 on 2026-10-18 10:40
+
+from django.db import migrations
+
+SEARCH_COLUMNS = ['name', 'short_description', 'description', 'materials', 'artisan_name', 'origin_region']
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    columns = ', '.join(SEARCH_COLUMNS)
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            options = {row[0] for row in cursor.fetchall()}
+        if 'ENABLE_FTS5' not in options:
+            # No FTS5 in this SQLite build: search falls back to LIKE
+            return
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE marketplace_product_fts USING fts5("
+            f"{columns}, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f'INSERT INTO marketplace_product_fts (rowid, {columns}) '
+            f'SELECT id, {columns} FROM marketplace_product'
+        )
+
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "ALTER TABLE marketplace_product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(short_description, '') || ' ' || coalesce(artisan_name, '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(materials, '') || ' ' || coalesce(origin_region, '')), 'C') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'D')"
+            ") STORED"
+        )
+        schema_editor.execute(
+            'CREATE INDEX marketplace_product_search_vector_gin '
+            'ON marketplace_product USING GIN (search_vector)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS marketplace_product_fts')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS marketplace_product_search_vector_gin')
+        schema_editor.execute('ALTER TABLE marketplace_product DROP COLUMN IF EXISTS search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0002_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
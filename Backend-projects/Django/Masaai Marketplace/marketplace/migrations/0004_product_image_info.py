@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_info',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
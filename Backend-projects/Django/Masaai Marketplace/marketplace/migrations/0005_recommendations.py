@@ -0,0 +1,49 @@
+# Generated by Django 4.2.18 on 2026-10-18 14:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0004_product_image_info'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductCooccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('product_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='marketplace.product')),
+                ('product_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='marketplace.product')),
+            ],
+            options={
+                'unique_together': {('product_a', 'product_b')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='marketplace.product')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='marketplace.product')),
+            ],
+            options={
+                'ordering': ['product', 'rank'],
+                'unique_together': {('product', 'rank')},
+            },
+        ),
+    ]
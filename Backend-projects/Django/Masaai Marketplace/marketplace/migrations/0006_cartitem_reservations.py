@@ -0,0 +1,27 @@
+# Generated by Django 4.2.18 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0005_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['product', 'reserved_until'], name='marketplace_cartitem_hold_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.18 on 2026-10-18 16:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0006_cartitem_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'updated_at'], name='marketplace_product_upd_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.18 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0007_conditional_get'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('DAY', 'Day'), ('WEEK', 'Week')], max_length=4)),
+                ('period_start', models.DateField()),
+                ('dimension', models.CharField(choices=[('TOTAL', 'All sales'), ('PRODUCT', 'Product'), ('CATEGORY', 'Category'), ('REGION', 'Origin region'), ('SHIPPING', 'Shipping method'), ('STATUS', 'Order status')], max_length=10)),
+                ('key', models.CharField(blank=True, max_length=100)),
+                ('label', models.CharField(blank=True, max_length=200)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='jobwatermark',
+            name='timestamp',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='marketplace_order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='marketplace_order_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salesrollup',
+            index=models.Index(fields=['period', 'dimension', 'period_start', '-revenue'], name='marketplace_rollup_top_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='salesrollup',
+            unique_together={('period', 'dimension', 'period_start', 'key')},
+        ),
+    ]
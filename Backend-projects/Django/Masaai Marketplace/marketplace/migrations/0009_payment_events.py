@@ -0,0 +1,31 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0008_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed'), ('REFUNDED', 'Refunded')], max_length=20)),
+                ('order_number', models.CharField(blank=True, max_length=20)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('payment_method', models.CharField(blank=True, max_length=20)),
+                ('payload', models.TextField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='transaction_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0009_payment_events'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='marketplace_product_list_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'status', 'created_at', 'id'], name='marketplace_product_cat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_featured', True)), fields=['status', 'created_at'], name='marketplace_product_feat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'created_at'], name='marketplace_review_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'updated_at'], name='marketplace_review_upd_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def reset_recommendations(apps, schema_editor):
+    """Counts from the pk-watermark runs can't be matched to baskets; the next run rebuilds them"""
+    apps.get_model('marketplace', 'ProductCooccurrence').objects.all().delete()
+    apps.get_model('marketplace', 'RelatedProduct').objects.all().delete()
+    apps.get_model('marketplace', 'JobWatermark').objects.filter(
+        name__in=['recommendations.orderitem', 'recommendations.wishlist'],
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0010_query_plan_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountedBasketItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customer', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='marketplace.customer')),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='marketplace.product')),
+            ],
+            options={
+                'unique_together': {('customer', 'product')},
+            },
+        ),
+        migrations.RunPython(reset_recommendations, migrations.RunPython.noop),
+    ]
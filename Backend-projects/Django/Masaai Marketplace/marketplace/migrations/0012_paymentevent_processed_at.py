@@ -0,0 +1,34 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:50
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_processed(apps, schema_editor):
+    """Stamp the events the id watermark had already passed"""
+    JobWatermark = apps.get_model('marketplace', 'JobWatermark')
+    PaymentEvent = apps.get_model('marketplace', 'PaymentEvent')
+
+    watermark = JobWatermark.objects.filter(name='payments.events').first()
+    if watermark is not None:
+        PaymentEvent.objects.filter(pk__lte=watermark.position).update(processed_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0011_recommendation_baskets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentevent',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='marketplace_event_todo_idx'),
+        ),
+        migrations.RunPython(mark_processed, migrations.RunPython.noop),
+    ]
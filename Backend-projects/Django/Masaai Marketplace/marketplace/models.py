@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.urls import reverse
+from django.utils import timezone
+from functools import partial
 import uuid
 
 
@@ -14,6 +19,7 @@ class Category(models.Model):
         help_text="Cultural meaning and significance of this category in African tradition"
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name_plural = "Categories"
@@ -86,6 +92,19 @@ class Product(models.Model):
     image_2 = models.ImageField(upload_to='products/gallery/', blank=True, null=True)
     image_3 = models.ImageField(upload_to='products/gallery/', blank=True, null=True)
     image_4 = models.ImageField(upload_to='products/gallery/', blank=True, null=True)
+    # Per image field: content hash, size and whether its resized renditions
+    # are ready; maintained by marketplace.images
+    image_info = models.JSONField(default=dict, blank=True, editable=False)
+    
+    # Review aggregates, kept current by Review.save() and the Review
+    # post_delete handler; rebuild with `manage.py rebuild_rating_aggregates`
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
     
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
@@ -93,6 +112,19 @@ class Product(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Max(updated_at)/Count of a listing for conditional GETs
+            models.Index(fields=['status', 'updated_at'], name='marketplace_product_upd_idx'),
+            # Listing pages: status = X, newest first, keyset on (created_at, id)
+            models.Index(fields=['status', 'created_at', 'id'], name='marketplace_product_list_idx'),
+            models.Index(fields=['category', 'status', 'created_at', 'id'], name='marketplace_product_cat_idx'),
+            # Featured products on the home page; only the few featured rows are indexed
+            models.Index(
+                fields=['status', 'created_at'],
+                condition=models.Q(is_featured=True),
+                name='marketplace_product_feat_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.name
@@ -102,21 +134,45 @@ class Product(models.Model):
         if not self.sku:
             self.sku = f"AFR-{self.id or uuid.uuid4().hex[:8].upper()}"
         super().save(*args, **kwargs)
+        
+        # Hash new uploads and queue their renditions once the save is committed
+        from .images import IMAGE_FIELDS, update_image_renditions
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) & set(IMAGE_FIELDS):
+            if self.image_info or any(getattr(self, field) for field in IMAGE_FIELDS):
+                transaction.on_commit(partial(update_image_renditions, self.pk))
     
     def get_absolute_url(self):
         return reverse('product_detail', kwargs={'product_id': self.id})
     
     @property
     def average_rating(self):
-        """Calculate average rating from reviews"""
-        reviews = self.reviews.all()
-        if reviews:
-            return round(sum(review.rating for review in reviews) / len(reviews), 1)
+        """Average rating from the stored review aggregates"""
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 1)
         return 0
     
     @property
     def review_count(self):
-        return self.reviews.count()
+        return self.rating_count
+    
+    @property
+    def rating_histogram(self):
+        """Review counts per star, from 5 stars down to 1"""
+        return [(stars, getattr(self, f'rating_{stars}_count')) for stars in range(5, 0, -1)]
+    
+    @classmethod
+    def apply_rating_change(cls, product_id, rating, delta):
+        """Add (delta=1) or remove (delta=-1) one rating from a product's aggregates"""
+        from .cache import bump_generation
+        cls.objects.filter(pk=product_id).update(**{
+            'rating_sum': F('rating_sum') + delta * rating,
+            'rating_count': F('rating_count') + delta,
+            f'rating_{rating}_count': F(f'rating_{rating}_count') + delta,
+            # Pages showing the rating must not be served as unchanged
+            'updated_at': timezone.now(),
+        })
+        bump_generation(cls)
     
     @property
     def is_available(self):
@@ -205,6 +261,11 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='marketplace_order_created_idx'),
+            # Orders changed since a job's watermark (see marketplace.reporting)
+            models.Index(fields=['updated_at'], name='marketplace_order_upd_idx'),
+        ]
     
     def __str__(self):
         return f"Order {self.order_number}"
@@ -242,8 +303,16 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Stock held for this cart until reserved_until (see marketplace.reservations)
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False)
+    reserved_until = models.DateTimeField(blank=True, null=True, editable=False)
+    
     class Meta:
         unique_together = ['customer', 'product']
+        indexes = [
+            # Live holds on a product: product = X AND reserved_until > now
+            models.Index(fields=['product', 'reserved_until'], name='marketplace_cartitem_hold_idx'),
+        ]
     
     def __str__(self):
         return f"{self.quantity}x {self.product.name} in cart"
@@ -287,9 +356,45 @@ class Review(models.Model):
     class Meta:
         unique_together = ['customer', 'product']
         ordering = ['-created_at']
+        indexes = [
+            # Latest reviews of a product, and the newest edit for conditional GETs
+            models.Index(fields=['product', 'created_at'], name='marketplace_review_latest_idx'),
+            models.Index(fields=['product', 'updated_at'], name='marketplace_review_upd_idx'),
+        ]
     
     def __str__(self):
         return f"{self.rating}★ review by {self.customer.user.username}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what is counted in the product aggregates for this row
+        instance._counted_rating = (instance.__dict__.get('product_id'), instance.__dict__.get('rating'))
+        return instance
+    
+    def save(self, *args, **kwargs):
+        # Save the review and move its rating between product aggregates atomically
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            counted = getattr(self, '_counted_rating', None)
+            current = (self.product_id, self.rating)
+            if counted != current:
+                if counted and None not in counted:
+                    Product.apply_rating_change(*counted, delta=-1)
+                Product.apply_rating_change(*current, delta=1)
+            self._counted_rating = current
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    """Take a deleted review out of its product's aggregates.
+
+    post_delete also fires for queryset and cascade deletes, inside the
+    deletion's transaction.
+    """
+    product_id, rating = getattr(instance, '_counted_rating', (instance.product_id, instance.rating))
+    if product_id is not None and rating is not None:
+        Product.apply_rating_change(product_id, rating, delta=-1)
 
 
 class Payment(models.Model):
@@ -315,7 +420,7 @@ class Payment(models.Model):
     status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='PENDING')
     
     # Payment gateway details
-    transaction_id = models.CharField(max_length=100, blank=True)
+    transaction_id = models.CharField(max_length=100, blank=True, db_index=True)
     gateway_response = models.TextField(blank=True)
     
     # Timestamps
@@ -324,3 +429,196 @@ class Payment(models.Model):
     
     def __str__(self):
         return f"Payment {self.transaction_id or self.id} - {self.status}"
+
+
+class PaymentEvent(models.Model):
+    """A payment gateway webhook event, stored as received.
+    
+    Rows are only ever inserted; `manage.py process_payment_events` applies
+    the ones without `processed_at` to Payment and Order in id order and then
+    stamps them (see marketplace.payments).
+    """
+    transaction_id = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, choices=Payment.PAYMENT_STATUS_CHOICES)
+    order_number = models.CharField(max_length=20, blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    payment_method = models.CharField(max_length=20, blank=True)
+    payload = models.TextField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        indexes = [
+            # Events waiting for the payment worker; processed rows drop out of the index
+            models.Index(
+                fields=['id'],
+                condition=models.Q(processed_at__isnull=True),
+                name='marketplace_event_todo_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.transaction_id} {self.status} (event {self.id})"
+
+
+class JobWatermark(models.Model):
+    """How far an incremental background job has got through its input.
+    
+    Jobs that walk a table by primary key keep `position`; jobs that pick up
+    rows by modification time keep `timestamp`.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    timestamp = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class ProductCooccurrence(models.Model):
+    """Number of customers who bought or wishlisted both products.
+    
+    Each pair is stored once with product_a <= product_b; the row with
+    product_a == product_b counts the customers of that one product.
+    Maintained by `manage.py build_recommendations`.
+    """
+    product_a = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    product_b = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['product_a', 'product_b']
+    
+    def __str__(self):
+        return f"{self.product_a_id} & {self.product_b_id}: {self.count}"
+
+
+class CountedBasketItem(models.Model):
+    """A product a customer is counted for in ProductCooccurrence.
+    
+    Compared with the customer's current orders and wishlist to find what
+    `manage.py build_recommendations` has to add or take away.
+    """
+    # Unconstrained: the rows of a deleted customer must stay until a run takes its pairs away
+    customer = models.ForeignKey(Customer, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    
+    class Meta:
+        unique_together = ['customer', 'product']
+    
+    def __str__(self):
+        return f"{self.customer_id} counted for {self.product_id}"
+
+
+class RelatedProduct(models.Model):
+    """Top-K products most often bought or wishlisted together with a product"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    
+    class Meta:
+        unique_together = ['product', 'rank']
+        ordering = ['product', 'rank']
+    
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} (#{self.rank})"
+
+
+class SalesRollup(models.Model):
+    """Order totals for one day or week and one value of a reporting dimension.
+    
+    Derived from orders by `manage.py rollup_sales` (see marketplace.reporting);
+    the sales dashboard reads nothing else. `key` is the dimension value (a
+    product or category id, a region, a shipping method or an order status)
+    and `label` its display name when the row was written.
+    """
+    PERIOD_CHOICES = [
+        ('DAY', 'Day'),
+        ('WEEK', 'Week'),
+    ]
+    
+    DIMENSION_CHOICES = [
+        ('TOTAL', 'All sales'),
+        ('PRODUCT', 'Product'),
+        ('CATEGORY', 'Category'),
+        ('REGION', 'Origin region'),
+        ('SHIPPING', 'Shipping method'),
+        ('STATUS', 'Order status'),
+    ]
+    
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    key = models.CharField(max_length=100, blank=True)
+    label = models.CharField(max_length=200, blank=True)
+    
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        unique_together = ['period', 'dimension', 'period_start', 'key']
+        indexes = [
+            # Top values of a dimension within one period
+            models.Index(
+                fields=['period', 'dimension', 'period_start', '-revenue'],
+                name='marketplace_rollup_top_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_period_display()} {self.period_start} {self.dimension} {self.key}: {self.revenue}"
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, update_fields=None, **kwargs):
+    """Keep the full-text search index in step with product edits"""
+    from .search import SEARCH_FIELDS, get_search_backend
+    if update_fields is not None and not set(update_fields) & {field for field, _ in SEARCH_FIELDS}:
+        return
+    get_search_backend().index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    from .search import get_search_backend
+    get_search_backend().remove_products([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Product)
+def update_autocomplete_index(sender, instance, update_fields=None, **kwargs):
+    """Re-index a saved or deleted product once committed, if this process serves autocomplete"""
+    from .autocomplete import FIELDS, loaded_index
+    index = loaded_index()
+    if index is None:
+        return
+    if update_fields is not None and not set(update_fields) & {*FIELDS, 'status'}:
+        return
+    # The pk is cleared on the instance once a delete completes
+    product_id = instance.pk
+    transaction.on_commit(lambda: index.refresh_products([product_id]))
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_catalogue_cache(sender, **kwargs):
+    """Make cached catalogue reads that depend on this model stale"""
+    from .cache import bump_generation
+    bump_generation(sender)
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def invalidate_shopper_session(sender, instance, **kwargs):
+    """Make sessions look this user's Customer up again (see marketplace.shoppers)"""
+    from .shoppers import invalidate_shopper
+    invalidate_shopper(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Wishlist)
+@receiver([post_save, post_delete], sender=CartItem)
+def invalidate_shopper_memberships(sender, instance, **kwargs):
+    """Make the customer's cached wishlist and cart sets stale (see marketplace.shoppers)"""
+    from .shoppers import invalidate_memberships
+    invalidate_memberships(instance.customer_id)
@@ -0,0 +1,188 @@
+"""
+Keyset (cursor) pagination for catalogue listings.
+
+Instead of OFFSET/LIMIT plus a COUNT(*), each page is fetched with a
+WHERE clause that continues from the last row of the previous page, so
+page 1,000 costs the same as page 1. Cursors are signed, opaque tokens
+holding the ordering values of the boundary row.
+
+The ordering must be strict (end in a unique column such as `id`) and its
+columns must be non-null.
+"""
+import hashlib
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import Q
+
+DEFAULT_ORDERING = ('-created_at', '-id')
+CURSOR_PARAM = 'cursor'
+CURSOR_SALT = 'marketplace.pagination.cursor'
+
+# How long an exact count stands in for an estimate where the database has none
+APPROXIMATE_COUNT_TIMEOUT = 300
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class CursorPage:
+    """One page of results; iterates like the object list of a Django Page"""
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor, base_query=''):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.base_query = base_query
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def approximate_total(self):
+        return self.paginator.approximate_count()
+
+    def _link(self, cursor):
+        query = f'{CURSOR_PARAM}={cursor}'
+        return f'?{self.base_query}&{query}' if self.base_query else f'?{query}'
+
+    @property
+    def next_link(self):
+        return self._link(self.next_cursor) if self.next_cursor else None
+
+    @property
+    def previous_link(self):
+        return self._link(self.previous_cursor) if self.previous_cursor else None
+
+
+class CursorPaginator:
+    """Paginate a queryset by keyset over `ordering` without counting rows"""
+
+    def __init__(self, queryset, per_page, ordering=DEFAULT_ORDERING):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = [
+            (field.lstrip('-'), field.startswith('-')) for field in ordering
+        ]
+
+    def _ordered(self, reverse=False):
+        return self.queryset.order_by(*[
+            f'-{name}' if descending != reverse else name for name, descending in self.ordering
+        ])
+
+    def _keyset_filter(self, values, reverse=False):
+        """Rows strictly after `values` in the ordering (before it if reverse)"""
+        condition = Q()
+        for position, (name, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            branch = Q(**{f'{name}__{lookup}': values[position]})
+            for (earlier, _), earlier_value in zip(self.ordering[:position], values):
+                branch &= Q(**{earlier: earlier_value})
+            condition |= branch
+        return condition
+
+    def _cursor_for(self, obj, direction):
+        values = [_encode_value(getattr(obj, name)) for name, _ in self.ordering]
+        return signing.dumps({'v': values, 'd': direction}, salt=CURSOR_SALT, compress=True)
+
+    def _decode(self, cursor):
+        try:
+            payload = signing.loads(cursor, salt=CURSOR_SALT)
+            raw_values, direction = payload['v'], payload['d']
+        except (signing.BadSignature, KeyError, TypeError):
+            return None, None
+        if direction not in ('n', 'p') or len(raw_values) != len(self.ordering):
+            return None, None
+
+        values = []
+        for (name, _), value in zip(self.ordering, raw_values):
+            try:
+                field = self.queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                # Annotations such as search_rank are stored as plain JSON numbers
+                values.append(value)
+            else:
+                values.append(field.to_python(value))
+        return values, direction
+
+    def get_page(self, cursor=None, base_query=''):
+        """Return the page starting at `cursor`; a missing or bad cursor gives the first page"""
+        values, direction = self._decode(cursor) if cursor else (None, None)
+
+        if direction == 'p':
+            rows = list(self._ordered(reverse=True).filter(self._keyset_filter(values, reverse=True))[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            queryset = self._ordered()
+            if values is not None:
+                queryset = queryset.filter(self._keyset_filter(values))
+            rows = list(queryset[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = values is not None
+
+        next_cursor = self._cursor_for(rows[-1], 'n') if rows and has_next else None
+        previous_cursor = self._cursor_for(rows[0], 'p') if rows and has_previous else None
+        return CursorPage(rows, self, next_cursor, previous_cursor, base_query)
+
+    def approximate_count(self):
+        """Estimated number of rows, without a COUNT(*) per request.
+
+        Postgres answers from the planner's row estimate; other databases
+        fall back to an exact count cached for a few minutes.
+        """
+        queryset = self.queryset.order_by()
+        connection = connections[queryset.db]
+        sql, params = queryset.query.sql_with_params()
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+
+        key = 'marketplace:approx-count:' + hashlib.md5((sql + repr(params)).encode()).hexdigest()
+        return cache.get_or_set(key, queryset.count, APPROXIMATE_COUNT_TIMEOUT)
+
+
+def paginate(request, queryset, per_page, ordering=DEFAULT_ORDERING):
+    """Cursor-paginate `queryset` from the request's ?cursor= parameter.
+
+    The page's next_link/previous_link keep the request's other query
+    parameters, so the pager works on filtered and searched listings.
+    """
+    params = request.GET.copy()
+    cursor = params.pop(CURSOR_PARAM, [None])[-1]
+    params.pop('page', None)
+    paginator = CursorPaginator(queryset, per_page, ordering)
+    return paginator.get_page(cursor, base_query=params.urlencode())
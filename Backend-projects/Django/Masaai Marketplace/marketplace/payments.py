@@ -0,0 +1,239 @@
+"""
+Payment gateway webhooks for the Masaai marketplace.
+
+Ingestion and processing are split. The webhook view only checks the
+HMAC-SHA256 signature of the request body, appends one PaymentEvent row per
+event (a request may carry a single event object or a list of them) and
+answers 202, so the gateway is acknowledged within one INSERT.
+
+`process_events()` then works through the events not yet processed, in id
+order and in batches, and stamps each with `processed_at`. Selecting on the
+stamp rather than an id watermark picks up an event whose transaction
+committed after events with higher ids were processed. Within a batch the
+events are deduplicated on transaction_id, keeping the furthest state
+reached: a payment only moves forward (PENDING -> FAILED -> COMPLETED ->
+REFUNDED), so retried and out-of-order deliveries are harmless. The
+affected Payment rows, created from the event when the gateway reports a
+transaction we have not seen, and their orders are written with one
+bulk_update each. A JobWatermark row is locked for each batch, so
+concurrent workers don't process the same events. The time between an
+event's arrival and its processing is reported as the lag.
+
+Event format, as sent by `manage.py fake_payment_gateway`:
+
+    {"transaction_id": "txn_...", "status": "COMPLETED", "order_number": "AFR-...",
+     "amount": "42.00", "payment_method": "MOBILE_MONEY"}
+"""
+import hashlib
+import hmac
+import json
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import JobWatermark, Order, Payment, PaymentEvent
+
+logger = logging.getLogger(__name__)
+
+# Locked for each batch, so concurrent workers don't apply an event twice
+LOCK_NAME = 'payments.events'
+SIGNATURE_HEADER = 'X-Gateway-Signature'
+
+DEFAULT_BATCH_SIZE = 5000
+QUERY_CHUNK_SIZE = 500
+
+# How far along its lifecycle each payment status is
+STATUS_RANK = {'PENDING': 0, 'FAILED': 1, 'COMPLETED': 2, 'REFUNDED': 3}
+
+# Payment status -> (order statuses it moves on from, new order status)
+ORDER_TRANSITIONS = {
+    'COMPLETED': (['PENDING'], 'CONFIRMED'),
+    'REFUNDED': (['PENDING', 'CONFIRMED', 'PROCESSING', 'SHIPPED', 'DELIVERED'], 'REFUNDED'),
+}
+
+PAYMENT_METHODS = {value for value, _ in Payment.PAYMENT_METHOD_CHOICES}
+
+
+class PaymentEventError(Exception):
+    """A webhook request could not be turned into payment events"""
+
+
+def webhook_secret():
+    return getattr(settings, 'MARKETPLACE_PAYMENT_WEBHOOK_SECRET', settings.SECRET_KEY)
+
+
+def sign(body, secret=None):
+    """Hex HMAC-SHA256 of a request body, as sent in SIGNATURE_HEADER"""
+    return hmac.new((secret or webhook_secret()).encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body, signature):
+    return bool(signature) and hmac.compare_digest(sign(body), signature)
+
+
+def _parse_amount(value):
+    """The event amount as a Decimal that fits PaymentEvent.amount, or None"""
+    if value in (None, ''):
+        return None
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise PaymentEventError(f'amount must be a number, got {value!r}')
+    field = PaymentEvent._meta.get_field('amount')
+    if not amount.is_finite() or abs(amount) >= Decimal(10) ** (field.max_digits - field.decimal_places):
+        raise PaymentEventError(f'amount is out of range, got {value!r}')
+    return amount
+
+
+def _parse_event(data):
+    if not isinstance(data, dict):
+        raise PaymentEventError('Each event must be a JSON object')
+    transaction_id = str(data.get('transaction_id') or '').strip()
+    status = str(data.get('status') or '').upper()
+    if not transaction_id or len(transaction_id) > 100:
+        raise PaymentEventError('transaction_id is missing or too long')
+    if status not in STATUS_RANK:
+        raise PaymentEventError(f'Unknown status {status!r}')
+    return PaymentEvent(
+        transaction_id=transaction_id,
+        status=status,
+        order_number=str(data.get('order_number') or '')[:20],
+        amount=_parse_amount(data.get('amount')),
+        payment_method=str(data.get('payment_method') or '')[:20],
+        payload=json.dumps(data, separators=(',', ':')),
+    )
+
+
+def ingest(body):
+    """Store the events of a webhook body; returns how many were stored"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise PaymentEventError('Body is not valid JSON')
+    events = [_parse_event(item) for item in (data if isinstance(data, list) else [data])]
+    PaymentEvent.objects.bulk_create(events)
+    return len(events)
+
+
+def _latest_states(events):
+    """One event per transaction_id: the one furthest along the payment lifecycle"""
+    latest = {}
+    for event in events:
+        current = latest.get(event.transaction_id)
+        if current is None or STATUS_RANK[event.status] >= STATUS_RANK[current.status]:
+            latest[event.transaction_id] = event
+    return latest
+
+
+def _in_chunks(queryset, field, values):
+    values = list(values)
+    for start in range(0, len(values), QUERY_CHUNK_SIZE):
+        yield from queryset.filter(**{f'{field}__in': values[start:start + QUERY_CHUNK_SIZE]})
+
+
+def _apply(events, now):
+    """Move payments and orders on to the states in `events`; returns counters"""
+    latest = _latest_states(events)
+    payments = {
+        payment.transaction_id: payment
+        for payment in _in_chunks(Payment.objects.all(), 'transaction_id', latest)
+    }
+
+    # Transactions the gateway started without a Payment row on our side
+    unknown = [event for transaction_id, event in latest.items() if transaction_id not in payments]
+    orders_by_number = {
+        order.order_number: order
+        for order in _in_chunks(Order.objects.all(), 'order_number', {event.order_number for event in unknown})
+    }
+    created = []
+    for event in unknown:
+        order = orders_by_number.get(event.order_number)
+        if order is None:
+            logger.warning('Payment event %s for unknown order %r ignored', event.pk, event.order_number)
+            continue
+        created.append(Payment(
+            order=order,
+            transaction_id=event.transaction_id,
+            amount=event.amount if event.amount is not None else order.total_amount,
+            payment_method=event.payment_method if event.payment_method in PAYMENT_METHODS else 'CREDIT_CARD',
+            status=event.status,
+            gateway_response=event.payload,
+            processed_at=now,
+        ))
+
+    changed = []
+    for transaction_id, payment in payments.items():
+        event = latest[transaction_id]
+        if STATUS_RANK[event.status] > STATUS_RANK[payment.status]:
+            payment.status = event.status
+            payment.gateway_response = event.payload
+            payment.processed_at = now
+            changed.append(payment)
+    Payment.objects.bulk_update(changed, ['status', 'gateway_response', 'processed_at'], batch_size=QUERY_CHUNK_SIZE)
+    Payment.objects.bulk_create(created, batch_size=QUERY_CHUNK_SIZE)
+    changed += created
+
+    orders = {
+        order.pk: order
+        for order in _in_chunks(Order.objects.only('status'), 'pk', {payment.order_id for payment in changed})
+    }
+    updated_orders = {}
+    for payment in changed:
+        if payment.status not in ORDER_TRANSITIONS:
+            continue
+        order = orders[payment.order_id]
+        from_statuses, to_status = ORDER_TRANSITIONS[payment.status]
+        if order.status in from_statuses:
+            order.status = to_status
+            # bulk_update() skips auto_now; the sales rollups rely on it
+            order.updated_at = now
+            updated_orders[order.pk] = order
+    Order.objects.bulk_update(updated_orders.values(), ['status', 'updated_at'], batch_size=QUERY_CHUNK_SIZE)
+
+    return {
+        'transactions': len(latest),
+        'created': len(created),
+        'payments': len(changed) - len(created),
+        'orders': len(updated_orders),
+        'unmatched': len(unknown) - len(created),
+    }
+
+
+def process_events(batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """Apply every event received since the last run, `batch_size` events per transaction.
+
+    Returns a dict of counters and the processing lag in seconds.
+    """
+    stats = {'events': 0, 'transactions': 0, 'created': 0, 'payments': 0, 'orders': 0, 'unmatched': 0}
+    lags = []
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            JobWatermark.objects.select_for_update().get_or_create(name=LOCK_NAME)
+            events = list(PaymentEvent.objects.filter(processed_at__isnull=True).order_by('pk')[:batch_size])
+            if not events:
+                break
+            now = timezone.now()
+            for name, count in _apply(events, now).items():
+                stats[name] += count
+            event_ids = [event.pk for event in events]
+            for start in range(0, len(event_ids), QUERY_CHUNK_SIZE):
+                PaymentEvent.objects.filter(pk__in=event_ids[start:start + QUERY_CHUNK_SIZE]).update(processed_at=now)
+
+        stats['events'] += len(events)
+        lags.extend((now - event.received_at).total_seconds() for event in events)
+        batches += 1
+        logger.info(
+            'Processed %d payment events up to %d, max lag %.3fs',
+            len(events), events[-1].pk, max(lags[-len(events):]),
+        )
+
+    lags.sort()
+    stats['batches'] = batches
+    stats['max_lag'] = lags[-1] if lags else 0.0
+    stats['mean_lag'] = sum(lags) / len(lags) if lags else 0.0
+    stats['p95_lag'] = lags[int(len(lags) * 0.95)] if lags else 0.0
+    return stats
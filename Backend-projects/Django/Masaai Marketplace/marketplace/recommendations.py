@@ -0,0 +1,280 @@
+"""
+Item-to-item recommendations ("customers who bought this also liked").
+
+A product's customers are everyone who ordered or wishlisted it.
+`ProductCooccurrence` stores, for every pair of products, how many customers
+they share, and `RelatedProduct` keeps each product's top-K neighbours
+ranked by cosine similarity: shared(a, b) / sqrt(customers(a) * customers(b)).
+
+`update_recommendations()` is incremental. `CountedBasketItem` records which
+products each customer is counted for; the customers whose orders and
+wishlist now differ from that record are found with two anti-joins, and
+only their baskets are read. Products added to a basket add pairs and
+products that left it (a removed wishlist entry, a deleted order) take
+theirs away, so the stored counts always equal a full rebuild. The
+products whose counts changed are re-ranked, together with the neighbours
+of every product whose number of customers changed, since their scores
+depend on it. Pair generation, aggregation and ranking are done on NumPy
+arrays rather than per-row Python.
+"""
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .cache import bump_generation
+from .models import (
+    CountedBasketItem, JobWatermark, OrderItem, Product, ProductCooccurrence, RelatedProduct, Wishlist,
+)
+
+TOP_K = 12
+
+# Ids per IN (...) clause, and rows per bulk write
+QUERY_CHUNK_SIZE = 500
+WRITE_BATCH_SIZE = 2000
+
+# (activity model, path to the customer id)
+SOURCES = [
+    (OrderItem, 'order__customer_id'),
+    (Wishlist, 'customer_id'),
+]
+
+# Locked for the length of a run, so concurrent runs don't count a change twice
+LOCK_NAME = 'recommendations'
+
+
+def _chunks(items, size=QUERY_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _changed_customers():
+    """Customers whose orders and wishlist differ from their counted basket"""
+    changed = set()
+    for model, customer_field in SOURCES:
+        uncounted = model.objects.filter(~Exists(
+            CountedBasketItem.objects.filter(customer_id=OuterRef(customer_field), product_id=OuterRef('product_id'))
+        ))
+        changed.update(uncounted.order_by().values_list(customer_field, flat=True).distinct())
+
+    gone = CountedBasketItem.objects.all()
+    for model, customer_field in SOURCES:
+        gone = gone.filter(~Exists(
+            model.objects.filter(**{customer_field: OuterRef('customer_id')}, product_id=OuterRef('product_id'))
+        ))
+    changed.update(gone.order_by().values_list('customer_id', flat=True).distinct())
+    return changed
+
+
+def _baskets(customer_ids):
+    """({customer: products now}, {customer: products counted}, deleted products counted) for `customer_ids`"""
+    current, counted = defaultdict(set), defaultdict(set)
+    for chunk in _chunks(customer_ids):
+        for model, customer_field in SOURCES:
+            rows = (
+                model.objects.filter(**{f'{customer_field}__in': chunk})
+                .order_by().values_list(customer_field, 'product_id').distinct()
+            )
+            for customer_id, product_id in rows:
+                current[customer_id].add(product_id)
+        rows = CountedBasketItem.objects.filter(customer_id__in=chunk).values_list('customer_id', 'product_id')
+        for customer_id, product_id in rows:
+            counted[customer_id].add(product_id)
+
+    # A deleted product's pairs went with it; only its basket rows are left to drop
+    counted_products = set().union(*counted.values())
+    existing = set()
+    for chunk in _chunks(counted_products):
+        existing.update(Product.objects.filter(id__in=chunk).values_list('id', flat=True))
+    deleted = counted_products - existing
+    if deleted:
+        for products in counted.values():
+            products -= deleted
+    return current, counted, deleted
+
+
+def _pairs(products, others=None):
+    """Ordered (a <= b) pairs within `products`, self pairs included, or between `products` and `others`"""
+    if others is None:
+        products = np.sort(np.fromiter(products, dtype=np.int64))
+        i, j = np.triu_indices(len(products))
+        return products[i], products[j]
+    products = np.fromiter(products, dtype=np.int64)
+    others = np.fromiter(others, dtype=np.int64)
+    a, b = np.repeat(products, len(others)), np.tile(others, len(products))
+    return np.minimum(a, b), np.maximum(a, b)
+
+
+def _pair_changes(current, counted):
+    """Return (product_a, product_b, change) arrays: how each pair count moves.
+
+    For every customer, products new to the basket pair with each other
+    (and themselves) and with the products kept; products that left it take
+    the same pairs away.
+    """
+    firsts, seconds, signs = [], [], []
+    for customer_id in current.keys() | counted.keys():
+        now, before = current.get(customer_id, set()), counted.get(customer_id, set())
+        kept = now & before
+        for products, sign in ((now - before, 1), (before - now, -1)):
+            if not products:
+                continue
+            for a, b in (_pairs(products), _pairs(products, kept)):
+                firsts.append(a)
+                seconds.append(b)
+                signs.append(np.full(len(a), sign, dtype=np.int64))
+
+    if not firsts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    a, b, sign = np.concatenate(firsts), np.concatenate(seconds), np.concatenate(signs)
+    width = int(b.max()) + 1
+    keys, inverse = np.unique(a * width + b, return_inverse=True)
+    change = np.bincount(inverse, weights=sign).astype(np.int64)
+    moved = change != 0
+    keys, change = keys[moved], change[moved]
+    return keys // width, keys % width, change
+
+
+def _apply_changes(a, b, change):
+    by_first = defaultdict(dict)
+    for product_a, product_b, count in zip(a.tolist(), b.tolist(), change.tolist()):
+        by_first[product_a][product_b] = count
+
+    for chunk in _chunks(by_first):
+        seconds = {product_b for product_a in chunk for product_b in by_first[product_a]}
+        existing = ProductCooccurrence.objects.filter(product_a_id__in=chunk, product_b_id__in=seconds)
+        for product_a, product_b, count in existing.values_list('product_a_id', 'product_b_id', 'count'):
+            if product_b in by_first[product_a]:
+                by_first[product_a][product_b] += count
+
+        ProductCooccurrence.objects.bulk_create(
+            [
+                ProductCooccurrence(product_a_id=product_a, product_b_id=product_b, count=count)
+                for product_a in chunk
+                for product_b, count in by_first[product_a].items()
+            ],
+            update_conflicts=True,
+            unique_fields=['product_a', 'product_b'],
+            update_fields=['count'],
+            batch_size=WRITE_BATCH_SIZE,
+        )
+        # Pairs no customer shares any more
+        ProductCooccurrence.objects.filter(product_a_id__in=chunk, count=0).delete()
+
+
+def _record_baskets(current, counted, deleted):
+    """Make CountedBasketItem match the baskets just counted"""
+    CountedBasketItem.objects.filter(product_id__in=deleted).delete()
+    added, removed = [], defaultdict(list)
+    for customer_id in current.keys() | counted.keys():
+        now, before = current.get(customer_id, set()), counted.get(customer_id, set())
+        added += [CountedBasketItem(customer_id=customer_id, product_id=product_id) for product_id in now - before]
+        if before - now:
+            removed[customer_id] = list(before - now)
+    for customer_id, product_ids in removed.items():
+        CountedBasketItem.objects.filter(customer_id=customer_id, product_id__in=product_ids).delete()
+    CountedBasketItem.objects.bulk_create(added, batch_size=WRITE_BATCH_SIZE)
+
+
+def _neighbours(product_ids):
+    """Products sharing a customer with any of `product_ids`"""
+    neighbours = set()
+    for chunk in _chunks(product_ids):
+        rows = ProductCooccurrence.objects.filter(Q(product_a_id__in=chunk) | Q(product_b_id__in=chunk))
+        for product_a, product_b in rows.values_list('product_a_id', 'product_b_id'):
+            neighbours.update((product_a, product_b))
+    return neighbours
+
+
+def _customer_counts(product_ids):
+    counts = {}
+    for chunk in _chunks(product_ids):
+        rows = ProductCooccurrence.objects.filter(product_a_id__in=chunk, product_b_id=F('product_a_id'))
+        counts.update(rows.values_list('product_a_id', 'count'))
+    return counts
+
+
+def _rank(product_ids):
+    """Rebuild the RelatedProduct rows of `product_ids` from the stored counts"""
+    written = 0
+    for chunk in _chunks(sorted(product_ids)):
+        rows = ProductCooccurrence.objects.filter(
+            Q(product_a_id__in=chunk) | Q(product_b_id__in=chunk)
+        ).exclude(product_a_id=F('product_b_id'))
+        pairs = np.array(list(rows.values_list('product_a_id', 'product_b_id', 'count')), dtype=np.int64)
+        RelatedProduct.objects.filter(product_id__in=chunk).delete()
+        if not len(pairs):
+            continue
+
+        # Both directions of every pair, keeping only sources in this chunk
+        source = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        target = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        shared = np.concatenate([pairs[:, 2], pairs[:, 2]])
+        keep = np.isin(source, chunk)
+        source, target, shared = source[keep], target[keep], shared[keep]
+
+        ids = np.unique(np.concatenate([source, target]))
+        customers = _customer_counts(ids.tolist())
+        popularity = np.array([customers.get(product_id, 1) for product_id in ids.tolist()], dtype=np.float64)
+        score = shared / np.sqrt(
+            popularity[np.searchsorted(ids, source)] * popularity[np.searchsorted(ids, target)]
+        )
+
+        # Best first within each source product; ties go to the lower id
+        order = np.lexsort((target, -score, source))
+        source, target, score = source[order], target[order], score[order]
+        starts = np.flatnonzero(np.r_[True, source[1:] != source[:-1]])
+        rank = np.arange(len(source)) - np.repeat(starts, np.diff(np.r_[starts, len(source)]))
+        top = rank < TOP_K
+
+        RelatedProduct.objects.bulk_create(
+            [
+                RelatedProduct(product_id=product_id, related_id=related_id, rank=position, score=value)
+                for product_id, related_id, position, value in zip(
+                    source[top].tolist(), target[top].tolist(), rank[top].tolist(), score[top].tolist()
+                )
+            ],
+            batch_size=WRITE_BATCH_SIZE,
+        )
+        written += int(top.sum())
+    return written
+
+
+def update_recommendations(full=False):
+    """Fold changed orders and wishlists into the recommendations.
+
+    With `full=True` the stored counts are discarded and rebuilt from all
+    activity. Returns a dict of what was processed.
+    """
+    with transaction.atomic():
+        run = JobWatermark.objects.select_for_update().get_or_create(name=LOCK_NAME)[0]
+        if full:
+            ProductCooccurrence.objects.all().delete()
+            RelatedProduct.objects.all().delete()
+            CountedBasketItem.objects.all().delete()
+
+        customers = _changed_customers()
+        current, counted, deleted = _baskets(customers)
+        a, b, change = _pair_changes(current, counted)
+
+        _apply_changes(a, b, change)
+        _record_baskets(current, counted, deleted)
+        # A product's customer count is its self pair; every score it is part of moves with it
+        touched = set(np.unique(np.concatenate([a, b])).tolist()) | _neighbours(a[a == b].tolist())
+        recommendations = _rank(touched)
+
+        run.timestamp = timezone.now()
+        run.save()
+        bump_generation(RelatedProduct)
+
+    return {
+        'customers': len(customers),
+        'pairs': len(change),
+        'products': len(touched),
+        'recommendations': recommendations,
+    }
@@ -0,0 +1,86 @@
+"""
+Resized image renditions for product galleries.
+
+This module only depends on Pillow so that process-pool workers can import
+it without setting up Django. Renditions live under a directory named after
+the SHA-256 of the source image, so identical uploads share one set.
+"""
+import os
+import tempfile
+
+from PIL import Image, ImageOps
+
+# name -> maximum width in pixels; images are never upscaled
+RENDITIONS = {
+    'thumbnail': 160,
+    'card': 480,
+    'detail': 1200,
+}
+
+# file extension -> (Pillow format, save options)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+RENDITIONS_DIR = 'renditions'
+
+
+def rendition_path(content_hash, rendition, extension):
+    """Storage-relative path of one rendition"""
+    return f'{RENDITIONS_DIR}/{content_hash[:2]}/{content_hash}/{rendition}.{extension}'
+
+
+def rendition_width(source_width, rendition):
+    return min(source_width, RENDITIONS[rendition])
+
+
+def _save_atomically(image, path, image_format, options):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            image.save(output, image_format, **options)
+        # mkstemp creates owner-only files; renditions are served publicly
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def render_renditions(source_path, media_root, content_hash):
+    """Write every missing rendition of `source_path`; return how many were written.
+
+    Runs in a worker process. Renditions that already exist (from an earlier
+    upload of the same content) are left alone.
+    """
+    targets = [
+        (rendition, extension, os.path.join(media_root, rendition_path(content_hash, rendition, extension)))
+        for rendition in RENDITIONS
+        for extension in FORMATS
+    ]
+    missing = [target for target in targets if not os.path.exists(target[2])]
+    if not missing:
+        return 0
+
+    with Image.open(source_path) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+        resized = {}
+        for rendition, extension, path in missing:
+            if rendition not in resized:
+                width = rendition_width(source.width, rendition)
+                height = max(1, round(source.height * width / source.width))
+                resized[rendition] = source.resize((width, height), Image.LANCZOS)
+            image = resized[rendition]
+
+            image_format, options = FORMATS[extension]
+            if image_format == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            _save_atomically(image, path, image_format, options)
+
+    return len(missing)
@@ -0,0 +1,267 @@
+"""
+Sales rollups for the staff dashboard.
+
+`SalesRollup` holds order counts, units and revenue per day and per week
+(weeks start on Monday) for each value of a handful of dimensions: product,
+category, origin region, shipping method and order status, plus a TOTAL
+row. The dashboard reads only these rows, so its cost depends on the number
+of periods and dimension values shown, not on the number of orders.
+
+`update_rollups()` is incremental. It finds the orders whose `updated_at` is
+past the watermark kept in JobWatermark and recomputes the days those
+orders were placed on, from all orders of those days, and then the weeks
+containing them from the day rows. Recomputing whole buckets keeps reruns
+idempotent, so the watermark is read back with an overlap that catches
+orders committed late by slow transactions. Deleted orders are only
+dropped from the rollups by a full rebuild.
+
+Cancelled and refunded orders are left out of every dimension except
+STATUS, which counts all orders.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Category, JobWatermark, Order, OrderItem, Product, SalesRollup
+
+WATERMARK_NAME = 'reporting.sales'
+
+# Re-read orders changed this long before the watermark
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+NOT_SALES_STATUSES = ['CANCELLED', 'REFUNDED']
+
+# Consecutive days recomputed per query, and rows per bulk write
+DAYS_PER_BATCH = 31
+QUERY_CHUNK_SIZE = 500
+WRITE_BATCH_SIZE = 2000
+
+SHIPPING_LABELS = dict(Order.SHIPPING_CHOICES)
+STATUS_LABELS = dict(Order.STATUS_CHOICES)
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _day_bounds(first, last):
+    """Aware datetimes [start, end) covering the days first..last in the current time zone"""
+    start = timezone.make_aware(datetime.combine(first, time.min))
+    end = timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min))
+    return start, end
+
+
+def _day_runs(days):
+    """Split sorted dates into (first, last) runs of consecutive days, at most DAYS_PER_BATCH long"""
+    runs = []
+    for day in sorted(days):
+        if runs and day - runs[-1][1] == timedelta(days=1) and (day - runs[-1][0]).days < DAYS_PER_BATCH:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def _changed_days(since):
+    """Days on which orders changed after `since` were placed, and the newest change seen"""
+    orders = Order.objects.order_by()
+    if since is not None:
+        orders = orders.filter(updated_at__gt=since - WATERMARK_OVERLAP)
+    latest = orders.aggregate(latest=Max('updated_at'))['latest']
+    days = set(orders.annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct())
+    return days, latest
+
+
+def _product_names(product_ids):
+    names = {}
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), QUERY_CHUNK_SIZE):
+        chunk = product_ids[start:start + QUERY_CHUNK_SIZE]
+        names.update(Product.objects.filter(pk__in=chunk).values_list('pk', 'name'))
+    return names
+
+
+def _day_rows(first, last):
+    """Unsaved DAY rollups for every order placed on the days first..last"""
+    start, end = _day_bounds(first, last)
+    # bucket (day, dimension, key) -> [orders, units, revenue]
+    totals = defaultdict(lambda: [0, 0, Decimal('0')])
+
+    orders = (
+        Order.objects.filter(created_at__gte=start, created_at__lt=end).order_by()
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'status', 'shipping_method')
+        .annotate(orders=Count('id'), revenue=Sum('total_amount'))
+    )
+    for row in orders:
+        dimensions = [('STATUS', row['status'])]
+        if row['status'] not in NOT_SALES_STATUSES:
+            dimensions += [('TOTAL', ''), ('SHIPPING', row['shipping_method'])]
+        for dimension, key in dimensions:
+            bucket = totals[row['day'], dimension, key]
+            bucket[0] += row['orders']
+            bucket[2] += row['revenue'] or 0
+
+    items = OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end).order_by()
+    units = (
+        items.annotate(day=TruncDate('order__created_at'))
+        .values('day', 'order__status', 'order__shipping_method')
+        .annotate(units=Sum('quantity'))
+    )
+    for row in units:
+        dimensions = [('STATUS', row['order__status'])]
+        if row['order__status'] not in NOT_SALES_STATUSES:
+            dimensions += [('TOTAL', ''), ('SHIPPING', row['order__shipping_method'])]
+        for dimension, key in dimensions:
+            totals[row['day'], dimension, key][1] += row['units'] or 0
+
+    # Distinct orders per category or region can't be summed from the
+    # per-product counts, so each dimension gets its own grouped query
+    sales = items.exclude(order__status__in=NOT_SALES_STATUSES).annotate(day=TruncDate('order__created_at'))
+    product_ids = set()
+    for dimension, field in [
+        ('PRODUCT', 'product_id'),
+        ('CATEGORY', 'product__category_id'),
+        ('REGION', 'product__origin_region'),
+    ]:
+        rows = sales.values('day', field).annotate(
+            orders=Count('order_id', distinct=True),
+            units=Sum('quantity'),
+            revenue=Sum(F('quantity') * F('price')),
+        )
+        for row in rows:
+            totals[row['day'], dimension, str(row[field] or '')] = [row['orders'], row['units'], row['revenue']]
+            if dimension == 'PRODUCT':
+                product_ids.add(row[field])
+
+    products = _product_names(product_ids)
+    categories = dict(Category.objects.values_list('pk', 'name'))
+    labels = {
+        'TOTAL': lambda key: 'All sales',
+        'PRODUCT': lambda key: products.get(int(key), ''),
+        'CATEGORY': lambda key: categories.get(int(key), '') if key else '',
+        'REGION': lambda key: key or 'Unknown',
+        'SHIPPING': lambda key: SHIPPING_LABELS.get(key, key),
+        'STATUS': lambda key: STATUS_LABELS.get(key, key),
+    }
+    return [
+        SalesRollup(
+            period='DAY', period_start=day, dimension=dimension, key=key,
+            label=labels[dimension](key)[:200], orders=orders, units=units, revenue=revenue,
+        )
+        for (day, dimension, key), (orders, units, revenue) in totals.items()
+    ]
+
+
+def _week_rows(weeks):
+    """Unsaved WEEK rollups for the given week starts, summed from the DAY rollups"""
+    totals = defaultdict(lambda: [0, 0, Decimal('0'), ''])
+    for first in sorted(weeks):
+        days = SalesRollup.objects.filter(
+            period='DAY', period_start__gte=first, period_start__lt=first + timedelta(days=7)
+        ).order_by('period_start')
+        for row in days.values_list('dimension', 'key', 'label', 'orders', 'units', 'revenue'):
+            dimension, key, label, orders, units, revenue = row
+            bucket = totals[first, dimension, key]
+            # An order belongs to exactly one day, so daily order counts add up
+            bucket[0] += orders
+            bucket[1] += units
+            bucket[2] += revenue
+            bucket[3] = label
+    return [
+        SalesRollup(
+            period='WEEK', period_start=first, dimension=dimension, key=key,
+            label=label, orders=orders, units=units, revenue=revenue,
+        )
+        for (first, dimension, key), (orders, units, revenue, label) in totals.items()
+    ]
+
+
+def update_rollups(full=False):
+    """Recompute the rollups of every day and week with changed orders.
+
+    With `full=True` all rollups are discarded and rebuilt from every order.
+    Returns a dict of what was processed.
+    """
+    with transaction.atomic():
+        if full:
+            SalesRollup.objects.all().delete()
+            JobWatermark.objects.filter(name=WATERMARK_NAME).delete()
+
+        # Locking the watermark keeps concurrent runs from interleaving
+        watermark = JobWatermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)[0]
+        days, latest = _changed_days(watermark.timestamp)
+
+        rows = 0
+        for first, last in _day_runs(days):
+            SalesRollup.objects.filter(period='DAY', period_start__gte=first, period_start__lte=last).delete()
+            rows += len(SalesRollup.objects.bulk_create(_day_rows(first, last), batch_size=WRITE_BATCH_SIZE))
+
+        weeks = {week_start(day) for day in days}
+        SalesRollup.objects.filter(period='WEEK', period_start__in=weeks).delete()
+        rows += len(SalesRollup.objects.bulk_create(_week_rows(weeks), batch_size=WRITE_BATCH_SIZE))
+
+        if latest is not None:
+            watermark.timestamp = max(latest, watermark.timestamp or latest)
+            watermark.save()
+
+    return {
+        'days': len(days),
+        'weeks': len(weeks),
+        'rows': rows,
+        'watermark': watermark.timestamp,
+    }
+
+
+def dashboard_data(period='DAY', periods=30, period_start=None, top=10):
+    """Everything the sales dashboard shows, read from SalesRollup alone.
+
+    `periods` trailing days or weeks of totals up to and including
+    `period_start` (the current one by default), and the top values of each
+    dimension within `period_start`.
+    """
+    step = timedelta(days=7 if period == 'WEEK' else 1)
+    if period_start is None:
+        period_start = timezone.localdate()
+    if period == 'WEEK':
+        period_start = week_start(period_start)
+    first = period_start - step * (periods - 1)
+
+    rollups = SalesRollup.objects.filter(period=period)
+    totals = {
+        row['period_start']: row
+        for row in rollups.filter(dimension='TOTAL', period_start__gte=first, period_start__lte=period_start)
+        .values('period_start', 'orders', 'units', 'revenue')
+    }
+    series = [
+        totals.get(first + step * index, {'period_start': first + step * index, 'orders': 0, 'units': 0, 'revenue': 0})
+        for index in range(periods)
+    ]
+
+    breakdowns = {}
+    for dimension, label in SalesRollup.DIMENSION_CHOICES:
+        if dimension == 'TOTAL':
+            continue
+        breakdowns[dimension] = {
+            'label': label,
+            'rows': list(
+                rollups.filter(dimension=dimension, period_start=period_start)
+                .order_by('-revenue')
+                .values('key', 'label', 'orders', 'units', 'revenue')[:top]
+            ),
+        }
+
+    return {
+        'period': period,
+        'period_start': period_start,
+        'previous': period_start - step,
+        'next': period_start + step if period_start + step <= timezone.localdate() else None,
+        'current': series[-1],
+        'series': series,
+        'breakdowns': breakdowns,
+    }
@@ -0,0 +1,92 @@
+"""
+Stock reservations for shopping carts.
+
+Adding a product to the cart places a hold on it: the CartItem records how
+many units it holds and until when. A product's available-to-promise
+quantity is its stock minus the live (unexpired) holds of everyone else, so
+the last item cannot be promised to twenty carts at once. Expired holds
+stop counting immediately; `release_expired_holds()` (run by the
+`release_expired_holds` command) clears them in one UPDATE so the hold index
+stays small. Checkout turns the buyer's own hold into a stock decrement.
+
+Each reservation locks only the product's row and reads the live holds
+through the (product, reserved_until) index, so it costs a few indexed
+queries whatever the size of the cart table.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import CartItem, Product
+
+# How long an add-to-cart holds stock
+HOLD_DURATION = timedelta(seconds=getattr(settings, 'MARKETPLACE_CART_HOLD_SECONDS', 15 * 60))
+
+
+class ReservationError(Exception):
+    def __init__(self, product, requested, available):
+        self.product = product
+        self.requested = requested
+        self.available = available
+        if available:
+            message = f'Only {available} items available in stock.'
+        else:
+            message = f'"{product.name}" is sold out or held in other carts.'
+        super().__init__(message)
+
+
+def held_quantities(product_ids, exclude_customer=None, now=None):
+    """Units of each product held by live cart reservations"""
+    holds = CartItem.objects.filter(product_id__in=product_ids, reserved_until__gt=now or timezone.now())
+    if exclude_customer is not None:
+        holds = holds.exclude(customer=exclude_customer)
+    rows = holds.order_by().values('product_id').annotate(held=Sum('reserved_quantity'))
+    return {row['product_id']: row['held'] for row in rows}
+
+
+def available_to_promise(product, customer=None, now=None):
+    """Stock that can still be promised to `customer` (or to a new cart)"""
+    if product.status != 'AVAILABLE':
+        return 0
+    held = held_quantities([product.id], exclude_customer=customer, now=now).get(product.id, 0)
+    return max(product.stock_quantity - held, 0)
+
+
+def reserve(customer_id, product_id, quantity, now=None):
+    """Add `quantity` units to the customer's cart and hold the whole line.
+
+    A new line must fit in the available-to-promise quantity; adding to an
+    existing line is capped at it. Raises ReservationError if nothing can be
+    held. Returns the saved CartItem.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Serialises reservations of this product
+        product = Product.objects.select_for_update().get(pk=product_id)
+        available = available_to_promise(product, customer_id, now)
+
+        item = CartItem.objects.filter(customer_id=customer_id, product=product).first()
+        if item is None:
+            if quantity > available:
+                raise ReservationError(product, quantity, available)
+            item = CartItem(customer_id=customer_id, product=product, quantity=quantity)
+        else:
+            if not available:
+                raise ReservationError(product, quantity, available)
+            item.quantity = min(item.quantity + quantity, available)
+
+        item.reserved_quantity = item.quantity
+        item.reserved_until = now + HOLD_DURATION
+        item.save()
+    return item
+
+
+def release_expired_holds(now=None):
+    """Clear every hold that has run out; returns how many were released"""
+    return CartItem.objects.filter(reserved_until__lte=now or timezone.now()).update(
+        reserved_quantity=0,
+        reserved_until=None,
+    )
@@ -0,0 +1,199 @@
+"""
+Full-text product search for the Masaai marketplace.
+
+Three interchangeable backends sit behind `get_search_backend()`:
+
+* SQLite   - an FTS5 virtual table ranked with bm25()
+* Postgres - a generated tsvector column with a GIN index, ranked with ts_rank()
+* anything else (or a SQLite build without FTS5) - LIKE matching
+
+Every backend exposes the same `search(queryset, query)` call, which narrows
+the queryset to matching products, annotates a `search_rank` (higher is more
+relevant) and orders by it.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+# Columns searched, in FTS5 column order, with their relevance weights
+SEARCH_FIELDS = [
+    ('name', 10.0),
+    ('short_description', 4.0),
+    ('description', 1.0),
+    ('materials', 3.0),
+    ('artisan_name', 5.0),
+    ('origin_region', 3.0),
+]
+
+FTS_TABLE = 'marketplace_product_fts'
+TSVECTOR_COLUMN = 'search_vector'
+TS_CONFIG = 'english'
+
+RELEVANCE_ORDERING = ('-search_rank', '-created_at', '-id')
+
+# How many product ids are written per index statement
+INDEX_BATCH_SIZE = 500
+
+
+def tokenize(query):
+    """Split a free-text query into lower-cased word tokens"""
+    return re.findall(r'\w+', query.lower())
+
+
+class LikeSearchBackend:
+    """Fallback backend: OR of icontains lookups, ranked by which field matched"""
+    name = 'like'
+
+    def search(self, queryset, query):
+        query = query.strip()
+        if not query:
+            return queryset.none()
+
+        matches = Q()
+        for field, _ in SEARCH_FIELDS:
+            matches |= Q(**{f'{field}__icontains': query})
+
+        return queryset.filter(matches).annotate(
+            search_rank=Case(
+                When(name__icontains=query, then=Value(3.0)),
+                When(Q(short_description__icontains=query) | Q(artisan_name__icontains=query), then=Value(2.0)),
+                default=Value(1.0),
+                output_field=FloatField(),
+            )
+        ).order_by(*RELEVANCE_ORDERING)
+
+    def index_products(self, product_ids):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class SQLiteFTSSearchBackend:
+    """SQLite FTS5 index kept in sync from Product saves and deletes"""
+    name = 'sqlite-fts5'
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+
+        qn = connection.ops.quote_name
+        fts = qn(FTS_TABLE)
+        product_table = qn(Product._meta.db_table)
+        # Every token must match, each as a prefix ("bead" finds "beads")
+        match = ' '.join('"%s"*' % token for token in tokens)
+        weights = ', '.join(str(weight) for _, weight in SEARCH_FIELDS)
+
+        return queryset.annotate(
+            # bm25() is lower-is-better; negate it so every backend sorts descending
+            search_rank=RawSQL(f'-bm25({fts}, {weights})', (), output_field=FloatField()),
+        ).extra(
+            tables=[FTS_TABLE],
+            where=[f'{fts}.rowid = {product_table}.id', f'{fts} MATCH %s'],
+            params=[match],
+        ).order_by(*RELEVANCE_ORDERING)
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        columns = ', '.join(field for field, _ in SEARCH_FIELDS)
+        with connection.cursor() as cursor:
+            for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+                batch = product_ids[start:start + INDEX_BATCH_SIZE]
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', batch)
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE} (rowid, {columns}) '
+                    f'SELECT id, {columns} FROM {Product._meta.db_table} WHERE id IN ({placeholders})',
+                    batch,
+                )
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        with connection.cursor() as cursor:
+            for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+                batch = product_ids[start:start + INDEX_BATCH_SIZE]
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', batch)
+
+    def rebuild(self):
+        columns = ', '.join(field for field, _ in SEARCH_FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, {columns}) '
+                f'SELECT id, {columns} FROM {Product._meta.db_table}'
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        return Product.objects.count()
+
+
+class PostgresSearchBackend:
+    """Postgres generated tsvector column; the database keeps it in sync"""
+    name = 'postgres'
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+
+        qn = connection.ops.quote_name
+        vector = f'{qn(Product._meta.db_table)}.{qn(TSVECTOR_COLUMN)}'
+        ts_query = ' & '.join(f'{token}:*' for token in tokens)
+
+        return queryset.annotate(
+            search_rank=RawSQL(
+                f'ts_rank({vector}, to_tsquery(%s, %s))', (TS_CONFIG, ts_query), output_field=FloatField()
+            ),
+        ).extra(
+            where=[f'{vector} @@ to_tsquery(%s, %s)'],
+            params=[TS_CONFIG, ts_query],
+        ).order_by(*RELEVANCE_ORDERING)
+
+    def index_products(self, product_ids):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (LikeSearchBackend, SQLiteFTSSearchBackend, PostgresSearchBackend)
+}
+
+_detected_backend = None
+
+
+def _detect_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+        return SQLiteFTSSearchBackend()
+    return LikeSearchBackend()
+
+
+def get_search_backend():
+    """Return the configured backend, or pick one from the database in use.
+
+    Set MARKETPLACE_SEARCH_BACKEND to 'like', 'sqlite-fts5' or 'postgres'
+    to force a backend.
+    """
+    global _detected_backend
+    configured = getattr(settings, 'MARKETPLACE_SEARCH_BACKEND', None)
+    if configured:
+        return BACKENDS[configured]()
+    if _detected_backend is None:
+        _detected_backend = _detect_backend()
+    return _detected_backend
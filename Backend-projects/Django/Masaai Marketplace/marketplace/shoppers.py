@@ -0,0 +1,226 @@
+"""
+The signed-in shopper's Customer, resolved once per session.
+
+Nearly every view of a signed-in user needs their Customer row, and pages
+show how many lines their cart has. `shopper_middleware` puts a `Shopper`
+on `request.shopper`, which looks both up on first use, in one query, and
+keeps them in the session so that later requests need no query at all.
+Nothing is looked up until a view asks, so pages that don't need the
+Customer don't pay for it.
+
+Saving or deleting a Customer (the profile page, the admin) stamps that
+user's entry in the cache, and a session copy made before the stamp is
+looked up again; see `invalidate_shopper()`, called from models.py. The
+views that change the cart re-read the cart count with
+`Shopper.cart_changed()`.
+
+`Shopper.wishlist_ids` and `Shopper.cart_ids` are the sets of product ids
+in the customer's wishlist and cart, so a product grid can mark every card
+without a query per card. They are read in one query and kept in the cache
+for all of the customer's sessions, tagged with the customer's membership
+stamp. Saving or deleting a Wishlist or CartItem row moves the stamp, again
+once committed (see `invalidate_memberships()`), and sets tagged with an
+older stamp are read again. The cached sets are never patched in place, so
+concurrent requests changing the same customer's lists can't lose each
+other's changes.
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Value
+from django.utils.decorators import sync_and_async_middleware
+
+from .models import CartItem, Customer, Wishlist
+
+SESSION_KEY = '_marketplace_shopper'
+
+# Seconds a customer's wishlist and cart sets are kept
+MEMBERSHIP_TIMEOUT = 15 * 60
+
+_NO_MEMBERSHIPS = {'wishlist': frozenset(), 'cart': frozenset(), 'version': None}
+
+
+def _cache():
+    return caches[getattr(settings, 'MARKETPLACE_CACHE_ALIAS', 'default')]
+
+
+def _stamp_key(user_id):
+    return f'marketplace:shopper:{user_id}'
+
+
+def _current_stamp(key, stamp=None):
+    cache = _cache()
+    if stamp is None:
+        stamp = cache.get(key)
+    if stamp is None:
+        # A lost stamp restarts from the clock, so no copy made before matches it
+        cache.add(key, time.time_ns(), None)
+        stamp = cache.get(key)
+    return stamp
+
+
+def _restamp(key):
+    def stamp():
+        _cache().set(key, time.time_ns(), None)
+    stamp()
+    # Again once committed, so a request that re-read the old rows can't keep them
+    transaction.on_commit(stamp)
+
+
+def _stamp(user_id):
+    return _current_stamp(_stamp_key(user_id))
+
+
+def invalidate_shopper(user_id):
+    """Make every session's copy of this user's Customer stale"""
+    _restamp(_stamp_key(user_id))
+
+
+def _memberships_key(customer_id):
+    return f'marketplace:memberships:{customer_id}'
+
+
+def _memberships_stamp_key(customer_id):
+    return f'marketplace:memberships-stamp:{customer_id}'
+
+
+def invalidate_memberships(customer_id):
+    """Make the cached wishlist and cart sets of this customer stale"""
+    _restamp(_memberships_stamp_key(customer_id))
+
+
+def _read_memberships(customer_id, stamp):
+    wishlist = Wishlist.objects.filter(customer_id=customer_id).annotate(kind=Value('wishlist'))
+    cart = CartItem.objects.filter(customer_id=customer_id).annotate(kind=Value('cart'))
+    rows = wishlist.values_list('product_id', 'kind').union(cart.values_list('product_id', 'kind'), all=True)
+    ids = {'wishlist': set(), 'cart': set()}
+    for product_id, kind in rows:
+        ids[kind].add(product_id)
+    return {
+        'wishlist': frozenset(ids['wishlist']),
+        'cart': frozenset(ids['cart']),
+        'version': stamp,
+    }
+
+
+class Shopper:
+    """The Customer id and cart count of the request's user"""
+
+    def __init__(self, request):
+        self._request = request
+        self._state = None
+        self._customer = None
+        self._memberships = None
+
+    def _load(self):
+        if self._state is not None:
+            return self._state
+        user = self._request.user
+        if not user.is_authenticated:
+            self._state = {'customer': None, 'cart_count': 0}
+            return self._state
+
+        stamp = _stamp(user.pk)
+        state = self._request.session.get(SESSION_KEY)
+        if not state or state['user'] != user.pk or state['stamp'] != stamp:
+            row = Customer.objects.filter(user=user).values('id').annotate(
+                cart_count=Count('cart_items'),
+            ).order_by().first()
+            state = {
+                'user': user.pk,
+                'stamp': stamp,
+                'customer': row['id'] if row else None,
+                'cart_count': row['cart_count'] if row else 0,
+            }
+            self._save(state)
+        self._state = state
+        return state
+
+    def _save(self, state):
+        self._state = state
+        self._request.session[SESSION_KEY] = state
+
+    @property
+    def customer_id(self):
+        """The user's Customer id, or None if they have no profile (or aren't signed in)"""
+        return self._load()['customer']
+
+    @property
+    def cart_count(self):
+        """Lines in the user's cart"""
+        return self._load()['cart_count']
+
+    @property
+    def customer(self):
+        """The user's full Customer row, read once per request; None if they have none"""
+        if self._customer is None and self.customer_id is not None:
+            self._customer = Customer.objects.get(pk=self.customer_id)
+            self._customer.user = self._request.user
+        return self._customer
+
+    def get_or_create_customer_id(self):
+        """The user's Customer id, creating an empty profile if they have none"""
+        if self.customer_id is None:
+            self._customer, _ = Customer.objects.get_or_create(user=self._request.user)
+            self._customer.user = self._request.user
+            # Creating the profile stamped the cache; this copy is current
+            self._save(dict(self._load(), customer=self._customer.pk, stamp=_stamp(self._request.user.pk)))
+        return self.customer_id
+
+    def set_cart_count(self, count):
+        """Record the cart count after the cart changed"""
+        state = self._load()
+        if state['cart_count'] != count and self._request.user.is_authenticated:
+            self._save(dict(state, cart_count=count))
+
+    def memberships(self):
+        """{'wishlist': product ids, 'cart': product ids, 'version': changes when either does}"""
+        if self._memberships is None:
+            customer_id = self.customer_id
+            if customer_id is None:
+                self._memberships = _NO_MEMBERSHIPS
+            else:
+                cache = _cache()
+                key, stamp_key = _memberships_key(customer_id), _memberships_stamp_key(customer_id)
+                cached = cache.get_many([key, stamp_key])
+                # Read before the rows, so sets that miss a change are tagged with an old stamp
+                stamp = _current_stamp(stamp_key, cached.get(stamp_key))
+                memberships = cached.get(key)
+                if memberships is None or memberships['version'] != stamp:
+                    memberships = _read_memberships(customer_id, stamp)
+                    cache.set(key, memberships, MEMBERSHIP_TIMEOUT)
+                self._memberships = memberships
+        return self._memberships
+
+    @property
+    def wishlist_ids(self):
+        """Ids of the products in the customer's wishlist"""
+        return self.memberships()['wishlist']
+
+    @property
+    def cart_ids(self):
+        """Ids of the products in the customer's cart"""
+        return self.memberships()['cart']
+
+    def cart_changed(self):
+        """Re-read the cart after this request changed it, and record its count"""
+        self._memberships = None
+        self.set_cart_count(len(self.cart_ids))
+
+
+@sync_and_async_middleware
+def shopper_middleware(get_response):
+    """Set `request.shopper`; must come after AuthenticationMiddleware"""
+    # Building a Shopper runs no queries, so both paths can do it in place
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            request.shopper = Shopper(request)
+            return await get_response(request)
+    else:
+        def middleware(request):
+            request.shopper = Shopper(request)
+            return get_response(request)
+    return middleware
@@ -0,0 +1,68 @@
+"""
+Template tags that serve product images through their resized renditions.
+
+    {% load marketplace_images %}
+    {% product_picture product 'card' alt=product.name css_class='card-img-top' %}
+
+Until a product's renditions are ready the original upload is used.
+"""
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+from ..renditions import RENDITIONS, rendition_path, rendition_width
+
+register = template.Library()
+
+
+def _ready_entry(product, field):
+    entry = (product.image_info or {}).get(field)
+    field_file = getattr(product, field)
+    if entry and entry['ready'] and field_file and entry['name'] == field_file.name:
+        return entry
+    return None
+
+
+def _srcset(entry, extension):
+    candidates = {}
+    for rendition in RENDITIONS:
+        width = rendition_width(entry['width'], rendition)
+        # Small originals collapse several renditions onto one width
+        candidates.setdefault(width, rendition_path(entry['sha256'], rendition, extension))
+    return ', '.join(f'{default_storage.url(path)} {width}w' for width, path in sorted(candidates.items()))
+
+
+@register.simple_tag
+def product_image_srcset(product, field='main_image', extension='webp'):
+    """srcset attribute value for one of the product's images, or ''"""
+    entry = _ready_entry(product, field)
+    return _srcset(entry, extension) if entry else ''
+
+
+@register.simple_tag
+def product_picture(product, rendition='card', field='main_image', alt='', css_class='', sizes=None):
+    """<picture> for a product image: WebP renditions with a JPEG fallback"""
+    field_file = getattr(product, field)
+    if not field_file:
+        return ''
+
+    entry = _ready_entry(product, field)
+    if entry is None:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="lazy" decoding="async">',
+            field_file.url, alt, css_class,
+        )
+
+    width = rendition_width(entry['width'], rendition)
+    height = max(1, round(entry['height'] * width / entry['width']))
+    sizes = sizes or f'(max-width: {width}px) 100vw, {width}px'
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" '
+        'loading="lazy" decoding="async">'
+        '</picture>',
+        _srcset(entry, 'webp'), sizes,
+        default_storage.url(rendition_path(entry['sha256'], rendition, 'jpg')),
+        _srcset(entry, 'jpg'), sizes, width, height, alt, css_class,
+    )
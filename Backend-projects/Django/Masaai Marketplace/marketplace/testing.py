@@ -0,0 +1,69 @@
+"""
+Test helpers for the Masaai marketplace.
+
+`QueryBudgetMixin.assertQueryBudget()` requests a URL with the test client
+and fails if it runs more SQL queries than its budget. The failure message
+lists the repeated query shapes first, since those are usually an N+1 loop.
+Budgets should be set for pages with several rows of everything, so that a
+per-row query blows them.
+
+`QueryPlanMixin.assertUsesIndexes()` asks the database for the plan of a
+queryset and fails if it reads a whole table or sorts rows that an index
+could have returned in order. Test tables are tiny, so on PostgreSQL
+sequential scans are switched off for the EXPLAIN: the question is whether
+an index can serve the query, not whether the planner prefers it today.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .middleware import QueryStats, fingerprint
+
+
+class QueryBudgetMixin:
+    """Mix into a TestCase to get assertQueryBudget()"""
+
+    def assertQueryBudget(self, budget, url, method='get', data=None, using=DEFAULT_DB_ALIAS, **extra):
+        """Request `url` and fail if it ran more than `budget` queries; returns the response"""
+        with CaptureQueriesContext(connections[using]) as context:
+            response = getattr(self.client, method)(url, data, **extra)
+
+        queries = [query['sql'] for query in context.captured_queries]
+        if len(queries) > budget:
+            stats = QueryStats()
+            stats.fingerprints.update(fingerprint(sql) for sql in queries)
+            lines = [f'{method.upper()} {url} ran {len(queries)} queries, over its budget of {budget}.']
+            lines += [f'Repeated {count}x: {shape}' for shape, count in stats.duplicates]
+            lines += ['Queries:'] + [f'{index}. {sql}' for index, sql in enumerate(queries, start=1)]
+            self.fail('\n'.join(lines))
+        return response
+
+
+# Plan lines that mean a full table (or full index) read or a separate sort
+_SQLITE_REGRESSIONS = re.compile(r'\bSCAN \S+|USE TEMP B-TREE FOR ORDER BY')
+_POSTGRESQL_REGRESSIONS = re.compile(r'Seq Scan on \S+')
+
+
+class QueryPlanMixin:
+    """Mix into a TestCase to get assertUsesIndexes()"""
+
+    def assertUsesIndexes(self, queryset, using=DEFAULT_DB_ALIAS):
+        """Fail if the plan of `queryset` scans a table or sorts instead of reading an index; returns the plan"""
+        connection = connections[using]
+        queryset = queryset.using(using)
+        if connection.vendor == 'sqlite':
+            plan = queryset.explain()
+            regressions = _SQLITE_REGRESSIONS.findall(plan)
+        elif connection.vendor == 'postgresql':
+            with transaction.atomic(using=using):
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+            regressions = _POSTGRESQL_REGRESSIONS.findall(plan)
+        else:
+            self.skipTest(f'No query plan checks for {connection.vendor}')
+
+        if regressions:
+            self.fail(f'{", ".join(regressions)} in the plan of:\n{queryset.query}\nPlan:\n{plan}')
+        return plan
@@ -0,0 +1,1174 @@
+import csv
+import inspect
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models.fields.files import FieldFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from PIL import Image
+
+from .autocomplete import PrefixIndex
+from .cache import bump_generation, get_categories, get_featured_products
+from .checkout import InsufficientStock, place_order
+from .facets import compute_facets
+from .models import (
+    CartItem, Category, Customer, JobWatermark, Order, OrderItem, Payment, PaymentEvent, Product,
+    ProductCooccurrence, RelatedProduct, Review, SalesRollup, Wishlist,
+)
+from .pagination import DEFAULT_ORDERING, CursorPaginator
+from .recommendations import update_recommendations
+from .payments import process_events, sign
+from .reporting import update_rollups, week_start
+from .reservations import HOLD_DURATION, ReservationError, available_to_promise, release_expired_holds, reserve
+from .search import LikeSearchBackend, get_search_backend
+from .shoppers import SESSION_KEY, Shopper
+from .testing import QueryBudgetMixin, QueryPlanMixin
+
+
+def make_product(category, **kwargs):
+    defaults = {
+        'name': 'Maasai collar',
+        'short_description': 'Beaded collar',
+        'description': 'Layered glass bead collar',
+        'price': Decimal('40.00'),
+        'materials': 'Glass beads',
+        'stock_quantity': 10,
+    }
+    defaults.update(kwargs)
+    return Product.objects.create(category=category, **defaults)
+
+
+def make_customer(username):
+    return Customer.objects.create(user=User.objects.create(username=username))
+
+
+class RatingAggregateTests(TestCase):
+    """Product rating aggregates follow review saves and deletes"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Jewelry')
+        self.collar = make_product(category, is_featured=True)
+        self.bracelet = make_product(category, name='Bracelet')
+
+    def aggregates(self, product):
+        product.refresh_from_db()
+        return product.rating_sum, product.rating_count, [count for _, count in product.rating_histogram]
+
+    def test_saves_and_deletes_move_ratings(self):
+        first = Review.objects.create(customer=make_customer('a'), product=self.collar, rating=5, title='A', comment='A')
+        second = Review.objects.create(customer=make_customer('b'), product=self.collar, rating=3, title='B', comment='B')
+        self.assertEqual(self.aggregates(self.collar), (8, 2, [1, 0, 1, 0, 0]))
+
+        second.rating = 4
+        second.save()
+        self.assertEqual(self.aggregates(self.collar), (9, 2, [1, 1, 0, 0, 0]))
+
+        first.product = self.bracelet
+        first.save()
+        self.assertEqual(self.aggregates(self.collar), (4, 1, [0, 1, 0, 0, 0]))
+        self.assertEqual(self.aggregates(self.bracelet), (5, 1, [1, 0, 0, 0, 0]))
+
+        second.delete()
+        Review.objects.filter(product=self.bracelet).delete()
+        self.assertEqual(self.aggregates(self.collar), (0, 0, [0, 0, 0, 0, 0]))
+        self.assertEqual(self.aggregates(self.bracelet), (0, 0, [0, 0, 0, 0, 0]))
+
+    def test_rebuild_repairs_drift_and_invalidates_cached_pages(self):
+        Review.objects.create(customer=make_customer('a'), product=self.collar, rating=2, title='A', comment='A')
+        # Drift the aggregates without a signal, and cache the drifted product
+        Product.objects.filter(pk=self.collar.pk).update(rating_sum=40, rating_count=9)
+        cache.clear()
+        self.assertEqual(get_featured_products()[0].rating_count, 9)
+        before = Product.objects.get(pk=self.collar.pk).updated_at
+
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+
+        self.assertEqual(self.aggregates(self.collar), (2, 1, [0, 0, 0, 1, 0]))
+        self.assertGreater(self.collar.updated_at, before)
+        self.assertEqual(get_featured_products()[0].rating_count, 1)
+
+
+class SearchTests(TestCase):
+    """Every search backend finds products by any searched field, name matches first"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Jewelry')
+        plain = {'short_description': 'Handmade', 'materials': 'Mixed'}
+        self.described = make_product(category, name='Collar', description='Strung with glass beads', **plain)
+        self.named = make_product(category, name='Beaded bracelet', description='Bracelet', **plain)
+        self.other = make_product(category, name='Carved bowl', description='Olive wood', **plain)
+
+    def backends(self):
+        return [get_search_backend(), LikeSearchBackend()]
+
+    def test_name_matches_rank_first(self):
+        for backend in self.backends():
+            with self.subTest(backend.name):
+                results = list(backend.search(Product.objects.all(), 'bead'))
+                self.assertEqual(results, [self.named, self.described])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.other.name = 'Carved spoon'
+        self.other.save()
+        self.named.delete()
+        for backend in self.backends():
+            with self.subTest(backend.name):
+                self.assertEqual(list(backend.search(Product.objects.all(), 'spoon')), [self.other])
+                self.assertEqual(list(backend.search(Product.objects.all(), 'bowl')), [])
+                self.assertEqual(list(backend.search(Product.objects.all(), 'bracelet')), [])
+                self.assertEqual(list(backend.search(Product.objects.all(), '  ')), [])
+
+
+class CursorPaginationTests(TestCase):
+    """Keyset pages cover every row once, in order, with ties broken by id"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Jewelry')
+        for index in range(8):
+            make_product(category, name=f'Collar {index}')
+        # Half the rows share a timestamp, so the cursor must carry the id too
+        Product.objects.filter(name__in=['Collar 2', 'Collar 3', 'Collar 4', 'Collar 5']).update(
+            created_at=timezone.now(),
+        )
+        self.expected = list(Product.objects.order_by(*DEFAULT_ORDERING))
+        self.paginator = CursorPaginator(Product.objects.all(), per_page=3)
+
+    def test_next_and_previous_walk_every_row(self):
+        pages = [self.paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(self.paginator.get_page(pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertEqual([product for page in pages for product in page], self.expected)
+        self.assertFalse(pages[0].has_previous())
+
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous():
+            backwards.append(self.paginator.get_page(backwards[-1].previous_cursor))
+        self.assertEqual([list(page) for page in backwards], [list(page) for page in reversed(pages)])
+
+    def test_tampered_cursor_gives_the_first_page(self):
+        cursor = self.paginator.get_page().next_cursor
+        page = self.paginator.get_page(cursor[:-2] + 'xx')
+        self.assertEqual(list(page), self.expected[:3])
+        self.assertFalse(page.has_previous())
+
+
+def png_bytes(size=(64, 48)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'orange').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ImageInfoTests(TestCase):
+    """Uploads are described after the save commits; bad files never fail the save"""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.submit = self.enterContext(mock.patch('marketplace.images._submit'))
+        self.category = Category.objects.create(name='Jewelry')
+
+    def save_with_image(self, content, name='collar.png'):
+        product = Product(category=self.category, name='Collar', short_description='Collar',
+                          description='Collar', price=Decimal('40.00'), materials='Beads')
+        product.main_image.save(name, ContentFile(content), save=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        return product
+
+    def test_upload_is_hashed_and_queued(self):
+        product = self.save_with_image(png_bytes())
+        entry = product.image_info['main_image']
+        self.assertEqual((entry['width'], entry['height'], entry['ready']), (64, 48, False))
+        self.assertEqual(entry['name'], product.main_image.name)
+        (product_id, jobs), _ = self.submit.call_args
+        self.assertEqual((product_id, [(field, content_hash) for field, _, content_hash in jobs]),
+                         (product.pk, [('main_image', entry['sha256'])]))
+
+    def test_unreadable_uploads_are_skipped(self):
+        cases = {'not an image': (b'not an image', 1000), 'decompression bomb': (png_bytes((100, 100)), 100)}
+        for name, (content, max_pixels) in cases.items():
+            with self.subTest(name), mock.patch.object(Image, 'MAX_IMAGE_PIXELS', max_pixels):
+                with self.assertLogs('marketplace.images', 'WARNING'):
+                    product = self.save_with_image(content)
+                self.assertEqual(product.image_info, {})
+
+    def test_storage_without_local_files(self):
+        # As with object storage, files have no local path
+        no_path = mock.PropertyMock(side_effect=NotImplementedError)
+        with mock.patch.object(FieldFile, 'path', new_callable=lambda: no_path), self.assertLogs('marketplace.images'):
+            product = self.save_with_image(png_bytes())
+        self.assertEqual(product.image_info['main_image']['width'], 64)
+        # Nothing to hand the rendering workers
+        self.submit.assert_not_called()
+
+    def test_backfill_command(self):
+        product = self.save_with_image(png_bytes())
+
+        def build():
+            stdout, stderr = StringIO(), StringIO()
+            call_command('build_image_renditions', workers=1, stdout=stdout, stderr=stderr)
+            product.refresh_from_db()
+            return stdout.getvalue(), stderr.getvalue()
+
+        no_path = mock.PropertyMock(side_effect=NotImplementedError)
+        with mock.patch.object(FieldFile, 'path', new_callable=lambda: no_path):
+            stdout, stderr = build()
+        self.assertIn('Storage of main_image has no local files', stderr)
+        self.assertFalse(product.image_info['main_image']['ready'])
+
+        saved_at = product.updated_at
+        stdout, stderr = build()
+        self.assertIn('Renditions built: 6 files for 1 images on 1 products', stdout)
+        self.assertTrue(product.image_info['main_image']['ready'])
+        self.assertGreater(product.updated_at, saved_at)
+
+        # A ready image whose original has gone missing is left out of the totals
+        os.remove(product.main_image.path)
+        stdout, stderr = build()
+        self.assertIn('for 0 images on 1 products', stdout)
+        self.assertIn(f'Could not size main_image of product {product.pk}', stderr)
+
+
+class GenerationCacheTests(TestCase):
+    """Cached catalogue reads are served until a model they depend on is written"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Jewelry')
+
+    def test_writes_make_dependent_reads_stale(self):
+        self.assertEqual([category.name for category in get_categories()], ['Jewelry'])
+        with self.assertNumQueries(0):
+            get_categories()
+
+        self.category.name = 'Beadwork'
+        self.category.save()
+        self.assertEqual([category.name for category in get_categories()], ['Beadwork'])
+
+        # Writes that send no signals bump the generation themselves
+        Category.objects.update(name='Jewellery')
+        with self.assertNumQueries(0):
+            get_categories()
+        bump_generation(Category)
+        self.assertEqual([category.name for category in get_categories()], ['Jewellery'])
+
+    def test_commit_drops_values_read_inside_the_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Crafts')
+            # Another reader could cache this before the commit
+            get_categories()
+        with self.assertNumQueries(1):
+            get_categories()
+
+
+class ImportCatalogTests(TestCase):
+    """import_catalog creates and updates products on SKU, skipping bad rows"""
+    columns = ['sku', 'name', 'category', 'price', 'short_description', 'description', 'materials', 'stock_quantity']
+
+    def import_rows(self, rows):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as source:
+            self.addCleanup(os.unlink, source.name)
+            writer = csv.writer(source)
+            writer.writerow(self.columns)
+            writer.writerows(rows)
+        output = StringIO()
+        call_command('import_catalog', source.name, chunk_size=2, stdout=output, stderr=StringIO())
+        return output.getvalue()
+
+    def test_upserts_on_sku(self):
+        existing = make_product(Category.objects.create(name='Jewelry'), sku='SKU-1', stock_quantity=1)
+        Review.objects.create(customer=make_customer('a'), product=existing, rating=5, title='A', comment='A')
+
+        output = self.import_rows([
+            ['SKU-1', 'Beaded collar', 'Jewelry', '55.00', 'Collar', 'Collar', 'Beads', '7'],
+            ['SKU-2', 'Carved bowl', 'Woodwork', '20.00', 'Bowl', 'Bowl', 'Olive wood', '3'],
+            ['SKU-3', 'Bad price', 'Woodwork', 'free', 'Bowl', 'Bowl', 'Wood', '1'],
+            ['SKU-4', 'Spoon', 'Woodwork', '5.00', 'Spoon', 'Spoon', 'Wood', '1'],
+            # A repeated SKU in one chunk: the last row wins
+            ['SKU-4', 'Carved spoon', 'Woodwork', '6.00', 'Spoon', 'Spoon', 'Wood', '2'],
+        ])
+
+        self.assertIn('Products created: 2', output)
+        self.assertIn('Products updated: 1', output)
+        self.assertIn('Rows skipped: 1', output)
+        updated = Product.objects.get(sku='SKU-1')
+        self.assertEqual((updated.pk, updated.name, updated.price, updated.stock_quantity),
+                         (existing.pk, 'Beaded collar', Decimal('55.00'), 7))
+        self.assertEqual((updated.created_at, updated.rating_count), (existing.created_at, 1))
+        spoon = Product.objects.get(sku='SKU-4')
+        self.assertEqual((spoon.name, spoon.price, spoon.category.name), ('Carved spoon', Decimal('6.00'), 'Woodwork'))
+        self.assertFalse(Product.objects.filter(sku='SKU-3').exists())
+        # Bulk writes send no signals; the importer indexes the rows itself
+        self.assertEqual(list(get_search_backend().search(Product.objects.all(), 'olive')),
+                         [Product.objects.get(sku='SKU-2')])
+
+    def test_partial_rows_keep_the_other_columns(self):
+        existing = make_product(Category.objects.create(name='Jewelry'), sku='SKU-1', stock_quantity=4,
+                                status='OUT_OF_STOCK', is_featured=True, is_handmade=False, artisan_name='Naserian')
+        self.columns = self.columns[:-1]
+        self.import_rows([['SKU-1', 'Beaded collar', 'Jewelry', '55.00', 'Collar', 'Collar', 'Beads']])
+
+        updated = Product.objects.get(pk=existing.pk)
+        self.assertEqual((updated.name, updated.price), ('Beaded collar', Decimal('55.00')))
+        self.assertEqual(
+            (updated.stock_quantity, updated.status, updated.is_featured, updated.is_handmade, updated.artisan_name),
+            (4, 'OUT_OF_STOCK', True, False, 'Naserian'),
+        )
+
+    def test_bad_json_lines_are_rejected(self):
+        lines = [
+            {'sku': 'SKU-1', 'name': 'Collar', 'category': 'Jewelry', 'price': '5.00', 'short_description': 'Collar',
+             'description': 'Collar', 'materials': 'Beads'},
+            '{"sku": "SKU-2", "name": ',
+            ['not', 'an', 'object'],
+            {'sku': 'SKU-3', 'name': 'Bowl', 'category': 'Woodwork', 'price': '9.00', 'short_description': 'Bowl',
+             'description': 'Bowl', 'materials': 'Wood', 'stock_quantity': 2},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as source:
+            self.addCleanup(os.unlink, source.name)
+            for line in lines:
+                source.write((line if isinstance(line, str) else json.dumps(line)) + '\n')
+        output = StringIO()
+        call_command('import_catalog', source.name, stdout=output, stderr=StringIO())
+
+        self.assertIn('Products created: 2', output.getvalue())
+        self.assertIn('Rows skipped: 2', output.getvalue())
+        self.assertEqual(Product.objects.get(sku='SKU-3').stock_quantity, 2)
+
+
+class RecommendationTests(TestCase):
+    """Incremental recommendation runs store the same counts as a full rebuild"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Jewelry')
+        self.products = [make_product(category, name=f'Collar {index}') for index in range(4)]
+        self.customers = [make_customer(f'buyer{index}') for index in range(3)]
+
+    def order(self, customer, *products):
+        order = Order.objects.create(customer=customer, subtotal=Decimal('40.00'), total_amount=Decimal('40.00'),
+                                     shipping_address='Nairobi', billing_address='Nairobi')
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+        return order
+
+    def assertMatchesRebuild(self):
+        update_recommendations()
+        incremental = set(ProductCooccurrence.objects.values_list('product_a', 'product_b', 'count'))
+        scores = set(RelatedProduct.objects.values_list('product', 'related', 'score'))
+        update_recommendations(full=True)
+        self.assertEqual(incremental, set(ProductCooccurrence.objects.values_list('product_a', 'product_b', 'count')))
+        self.assertEqual(scores, set(RelatedProduct.objects.values_list('product', 'related', 'score')))
+        self.assertTrue(all(0 < score <= 1 for _, _, score in scores))
+
+    def test_adds_removes_and_re_adds(self):
+        p1, p2, p3, p4 = self.products
+        first, second, third = self.customers
+        Wishlist.objects.create(customer=first, product=p1)
+        self.order(first, p2)
+        gift = self.order(second, p1, p2, p3)
+        self.assertMatchesRebuild()
+
+        steps = {
+            'wishlist removed': lambda: Wishlist.objects.filter(customer=first, product=p1).delete(),
+            'wishlist re-added': lambda: Wishlist.objects.create(customer=first, product=p1),
+            'removed and re-added between runs': lambda: (
+                Wishlist.objects.filter(customer=first, product=p1).delete(),
+                Wishlist.objects.create(customer=first, product=p1),
+            ),
+            'also ordered': lambda: self.order(first, p1, p4),
+            'order deleted': gift.delete,
+            'product deleted': p4.delete,
+            'customer deleted': lambda: first.user.delete(),
+            'new customer': lambda: self.order(third, p2, p3),
+        }
+        for name, step in steps.items():
+            with self.subTest(name):
+                step()
+                self.assertMatchesRebuild()
+
+        self.assertEqual(set(ProductCooccurrence.objects.values_list('product_a', 'product_b', 'count')),
+                         {(p2.pk, p2.pk, 1), (p2.pk, p3.pk, 1), (p3.pk, p3.pk, 1)})
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Jewelry')
+        self.customer = make_customer('buyer')
+
+    def test_place_order_writes_items_and_decrements_stock(self):
+        collar = make_product(self.category, stock_quantity=3)
+        bracelet = make_product(self.category, name='Bracelet', price=Decimal('10.00'), stock_quantity=5)
+        CartItem.objects.create(customer=self.customer, product=collar, quantity=3)
+        CartItem.objects.create(customer=self.customer, product=bracelet, quantity=2)
+
+        order = place_order(self.customer)
+
+        self.assertEqual(order.subtotal, Decimal('140.00'))
+        self.assertEqual(order.items.count(), 2)
+        collar.refresh_from_db()
+        bracelet.refresh_from_db()
+        self.assertEqual((collar.stock_quantity, collar.status), (0, 'OUT_OF_STOCK'))
+        self.assertEqual((bracelet.stock_quantity, bracelet.status), (3, 'AVAILABLE'))
+        self.assertFalse(CartItem.objects.filter(customer=self.customer).exists())
+
+    def test_short_stock_leaves_nothing_behind(self):
+        collar = make_product(self.category, stock_quantity=5)
+        bracelet = make_product(self.category, name='Bracelet', stock_quantity=1)
+        CartItem.objects.create(customer=self.customer, product=collar, quantity=2)
+        CartItem.objects.create(customer=self.customer, product=bracelet, quantity=2)
+
+        with self.assertRaises(InsufficientStock):
+            place_order(self.customer)
+
+        collar.refresh_from_db()
+        self.assertEqual(collar.stock_quantity, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(customer=self.customer).count(), 2)
+
+
+class FacetTests(TestCase):
+    def facets(self):
+        get_categories()  # category names are served from the cache
+        with self.assertNumQueries(1):
+            return compute_facets(Product.objects.filter(status='AVAILABLE'))
+
+    def test_counts_follow_filters(self):
+        jewelry = Category.objects.create(name='Jewelry')
+        crafts = Category.objects.create(name='Crafts')
+        make_product(jewelry, price=Decimal('20.00'), origin_region='Kenya', is_featured=True)
+        make_product(jewelry, price=Decimal('60.00'), origin_region='Kenya')
+        make_product(crafts, price=Decimal('300.00'), origin_region='Tanzania', is_handmade=False)
+
+        facets = compute_facets(Product.objects.filter(origin_region='Kenya'))
+
+        self.assertEqual(facets['total'], 2)
+        self.assertEqual(facets['category'], [{'value': jewelry.id, 'label': 'Jewelry', 'count': 2}])
+        self.assertEqual([(bucket['label'], bucket['count']) for bucket in facets['price']],
+                         [('Under $25', 1), ('$50 - $100', 1)])
+        self.assertEqual({flag['value']: flag['count'] for flag in facets['flags']},
+                         {'is_featured': 1, 'is_handmade': 2, 'is_traditional_design': 2})
+
+    def test_query_count_is_constant_as_facets_grow(self):
+        category = Category.objects.create(name='Jewelry')
+        make_product(category, origin_region='Kenya')
+        self.assertEqual(len(self.facets()['category']), 1)
+
+        for index in range(10):
+            category = Category.objects.create(name=f'Category {index}')
+            make_product(category, origin_region=f'Region {index}', price=Decimal(index * 40))
+        facets = self.facets()
+
+        self.assertEqual(len(facets['category']), 11)
+        self.assertEqual(len(facets['origin_region']), 11)
+        self.assertEqual(len(facets['price']), 5)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """N customers race to buy the same product; stock must never oversell"""
+    threads = 12
+    stock = 5
+
+    def test_concurrent_checkouts_never_oversell(self):
+        category = Category.objects.create(name='Jewelry')
+        product = make_product(category, stock_quantity=self.stock)
+        customers = [make_customer(f'buyer{i}') for i in range(self.threads)]
+        for customer in customers:
+            CartItem.objects.create(customer=customer, product=product, quantity=1)
+
+        barrier = threading.Barrier(self.threads)
+        outcomes = []
+
+        def buy(customer):
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        place_order(customer)
+                        outcomes.append('ordered')
+                        return
+                    except InsufficientStock:
+                        outcomes.append('sold out')
+                        return
+                    except OperationalError:
+                        # SQLite reports a locked database instead of waiting; back off and retry
+                        time.sleep(random.uniform(0.001, 0.01))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=buy, args=(customer,)) for customer in customers]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        product.refresh_from_db()
+        self.assertEqual(outcomes.count('ordered'), self.stock)
+        self.assertEqual(outcomes.count('sold out'), self.threads - self.stock)
+        self.assertEqual(product.stock_quantity, 0)
+        self.assertEqual(product.status, 'OUT_OF_STOCK')
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual(OrderItem.objects.filter(product=product).count(), self.stock)
+
+
+class ReservationTests(TestCase):
+    """Cart holds keep stock from other carts until they run out"""
+
+    def test_hold_is_released_after_its_ttl(self):
+        product = make_product(Category.objects.create(name='Jewelry'), stock_quantity=1)
+        first, second = make_customer('first'), make_customer('second')
+        now = timezone.now()
+
+        reserve(first.pk, product.pk, 1, now=now)
+        self.assertEqual(available_to_promise(product, first.pk, now=now), 1)
+        with self.assertRaises(ReservationError):
+            reserve(second.pk, product.pk, 1, now=now + HOLD_DURATION - timedelta(seconds=1))
+
+        expired = now + HOLD_DURATION
+        self.assertEqual(available_to_promise(product, second.pk, now=expired), 1)
+        self.assertEqual(release_expired_holds(now=expired), 1)
+        self.assertEqual(CartItem.objects.get(customer=first).reserved_quantity, 0)
+        reserve(second.pk, product.pk, 1, now=expired)
+        with self.assertRaises(ReservationError):
+            reserve(first.pk, product.pk, 1, now=expired)
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+    """N customers race to hold the last unit; exactly one gets it"""
+    threads = 8
+
+    def test_last_unit_is_held_once(self):
+        product = make_product(Category.objects.create(name='Jewelry'), stock_quantity=1)
+        customers = [make_customer(f'buyer{i}') for i in range(self.threads)]
+
+        barrier = threading.Barrier(self.threads)
+        outcomes = []
+
+        def hold(customer):
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        reserve(customer.pk, product.pk, 1)
+                        outcomes.append('held')
+                        return
+                    except ReservationError:
+                        outcomes.append('unavailable')
+                        return
+                    except OperationalError:
+                        # SQLite reports a locked database instead of waiting; back off and retry
+                        time.sleep(random.uniform(0.001, 0.01))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=hold, args=(customer,)) for customer in customers]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(sorted(outcomes), ['held'] + ['unavailable'] * (self.threads - 1))
+        self.assertEqual(CartItem.objects.filter(product=product, reserved_quantity=1).count(), 1)
+        self.assertEqual(available_to_promise(product), 0)
+
+
+@override_settings(ROOT_URLCONF='masaai_marketplace.asgi_urls')
+class AsyncViewTests(TransactionTestCase):
+    """The async catalogue views render the same pages as the sync ones"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Jewelry')
+        self.products = [make_product(category, name=f'Beaded collar {index}', is_featured=index < 2) for index in range(4)]
+        Review.objects.create(customer=make_customer('reviewer'), product=self.products[0], rating=4, title='A', comment='A')
+        user = User.objects.create_user('buyer', password='secret')
+        Wishlist.objects.create(customer=Customer.objects.create(user=user), product=self.products[1])
+        self.client.force_login(user)
+        self.async_client.force_login(user)
+
+    def comparable(self, context):
+        return {
+            key: list(value) if key in ('products', 'reviews', 'related_products', 'featured_products') else value
+            for key, value in context.flatten().items()
+            if key in ('products', 'reviews', 'related_products', 'featured_products', 'categories',
+                       'wishlist_ids', 'cart_ids', 'in_wishlist', 'available_quantity', 'review_count', 'facets')
+        }
+
+    def test_pages_match_the_sync_views(self):
+        pages = [
+            ('home', []), ('product_list', []), ('product_detail', [self.products[0].pk]), ('search_products', []),
+        ]
+        for name, args in pages:
+            with self.subTest(name):
+                url = reverse(name, args=args) + ('?query=collar' if name == 'search_products' else '')
+                response = async_to_sync(self.async_client.get)(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(inspect.iscoroutinefunction(response.resolver_match.func))
+                with self.settings(ROOT_URLCONF='masaai_marketplace.urls'):
+                    expected = self.client.get(url)
+                self.assertEqual(self.comparable(response.context), self.comparable(expected.context))
+
+
+class ConditionalGetTests(TestCase):
+    """Catalogue pages answer 304 until what they show changes, by ETag or by date"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Jewelry')
+        self.products = [make_product(self.category, name=f'Collar {index}') for index in range(3)]
+
+    def revalidate(self, url, response, *headers):
+        names = {'etag': ('HTTP_IF_NONE_MATCH', 'ETag'), 'date': ('HTTP_IF_MODIFIED_SINCE', 'Last-Modified')}
+        return self.client.get(url, **{names[header][0]: response[names[header][1]] for header in headers})
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in [reverse('home'), reverse('category', args=[self.category.pk]),
+                    reverse('product_detail', args=[self.products[0].pk])]:
+            with self.subTest(url):
+                first = self.client.get(url)
+                self.assertEqual(first.status_code, 200)
+                for headers in (['etag'], ['date'], ['etag', 'date']):
+                    self.assertEqual(self.revalidate(url, first, *headers).status_code, 304)
+
+    def test_rows_leaving_a_listing_change_the_date(self):
+        changes = {
+            # Neither moves the newest updated_at of the available products
+            'discontinued': lambda product: Product.objects.filter(pk=product.pk).update(status='DISCONTINUED'),
+            'deleted': lambda product: product.delete(),
+        }
+        for url in [reverse('home'), reverse('category', args=[self.category.pk])]:
+            for name, change in changes.items():
+                with self.subTest(url, change=name):
+                    product = make_product(self.category, name='Leaving')
+                    Product.objects.filter(pk=product.pk).update(created_at=timezone.now() - timedelta(days=1),
+                                                                 updated_at=timezone.now() - timedelta(days=1))
+                    bump_generation(Product)
+                    first = self.client.get(url)
+                    change(product)
+                    bump_generation(Product)
+
+                    for headers in (['etag'], ['date']):
+                        response = self.revalidate(url, first, *headers)
+                        self.assertEqual(response.status_code, 200)
+                    self.assertGreater(parse_http_date(response['Last-Modified']),
+                                       parse_http_date(first['Last-Modified']))
+                    self.assertEqual(self.revalidate(url, response, 'date').status_code, 304)
+
+
+class SalesRollupTests(TestCase):
+    """Incremental rollup runs store the same rows as a full rebuild"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Jewelry')
+        self.collar = make_product(self.category, name='Collar', origin_region='Kajiado')
+        self.customer = make_customer('buyer')
+        self.today = timezone.localdate()
+
+    def order(self, days_ago, quantity, status='DELIVERED'):
+        total = self.collar.price * quantity
+        order = Order.objects.create(customer=self.customer, status=status, subtotal=total, total_amount=total,
+                                     shipping_address='Nairobi', billing_address='Nairobi')
+        OrderItem.objects.create(order=order, product=self.collar, quantity=quantity, price=self.collar.price)
+        placed = timezone.now() - timedelta(days=days_ago)
+        Order.objects.filter(pk=order.pk).update(created_at=placed)
+        return order
+
+    def rollups(self):
+        return set(SalesRollup.objects.values_list(
+            'period', 'period_start', 'dimension', 'key', 'label', 'orders', 'units', 'revenue'))
+
+    def assertMatchesRebuild(self):
+        update_rollups()
+        incremental = self.rollups()
+        update_rollups(full=True)
+        self.assertEqual(incremental, self.rollups())
+
+    def total(self, period, day):
+        return SalesRollup.objects.values_list('orders', 'units', 'revenue').get(
+            period=period, period_start=day, dimension='TOTAL')
+
+    def test_totals(self):
+        self.order(0, 2)
+        self.order(0, 1)
+        self.order(0, 5, status='CANCELLED')
+        update_rollups()
+
+        price = self.collar.price
+        self.assertEqual(self.total('DAY', self.today), (2, 3, price * 3))
+        self.assertEqual(self.total('WEEK', week_start(self.today)), (2, 3, price * 3))
+        statuses = dict(SalesRollup.objects.filter(period='DAY', dimension='STATUS').values_list('key', 'orders'))
+        self.assertEqual(statuses, {'DELIVERED': 2, 'CANCELLED': 1})
+        self.assertEqual(SalesRollup.objects.get(period='DAY', dimension='REGION').label, 'Kajiado')
+
+    def test_incremental_runs(self):
+        old = self.order(10, 2)
+        self.order(1, 1)
+        self.assertMatchesRebuild()
+
+        steps = {
+            'new order': lambda: self.order(0, 3),
+            'order cancelled': lambda: Order.objects.filter(pk=old.pk).update(
+                status='CANCELLED', updated_at=timezone.now()),
+            # Committed by a slow transaction after a later change was rolled up
+            'committed late': lambda: Order.objects.filter(pk=old.pk).update(
+                status='REFUNDED',
+                updated_at=JobWatermark.objects.get(name='reporting.sales').timestamp - timedelta(minutes=1)),
+        }
+        for name, step in steps.items():
+            with self.subTest(name):
+                update_rollups()
+                step()
+                self.assertMatchesRebuild()
+
+
+class PaymentEventTests(TestCase):
+    """Webhook events are checked on arrival and applied once, furthest state winning"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Jewelry')
+        self.collar = make_product(category, name='Collar')
+        self.order = Order.objects.create(customer=make_customer('buyer'), subtotal=Decimal('40.00'),
+                                          total_amount=Decimal('40.00'), shipping_address='Nairobi',
+                                          billing_address='Nairobi')
+
+    def event(self, status, transaction_id='txn_1', **fields):
+        return {'transaction_id': transaction_id, 'status': status, 'order_number': self.order.order_number,
+                'amount': '40.00', 'payment_method': 'MOBILE_MONEY', **fields}
+
+    def deliver(self, *events, signature=None):
+        body = json.dumps(list(events)).encode()
+        return self.client.post(reverse('payment_webhook'), body, content_type='application/json',
+                                HTTP_X_GATEWAY_SIGNATURE=signature if signature is not None else sign(body))
+
+    def assertState(self, payment_status, order_status):
+        self.assertEqual(list(Payment.objects.values_list('status', flat=True)), [payment_status])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, order_status)
+
+    def test_bad_signature(self):
+        for signature in ['', 'not-a-signature', sign(b'another body')]:
+            with self.subTest(signature=signature):
+                self.assertEqual(self.deliver(self.event('COMPLETED'), signature=signature).status_code, 403)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_malformed_amounts(self):
+        for amount in ['NaN', 'sNaN', 'Infinity', '-inf', '1e20', '100000000', 'forty']:
+            with self.subTest(amount=amount):
+                self.assertEqual(self.deliver(self.event('COMPLETED', amount=amount)).status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+        self.assertEqual(self.deliver(self.event('COMPLETED', amount='99999999.99')).status_code, 202)
+
+    def test_duplicate_delivery(self):
+        for _ in range(2):
+            self.assertEqual(self.deliver(self.event('COMPLETED')).status_code, 202)
+            process_events()
+        self.assertState('COMPLETED', 'CONFIRMED')
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_out_of_order_events(self):
+        self.deliver(self.event('REFUNDED'), self.event('COMPLETED'))
+        process_events()
+        self.assertState('REFUNDED', 'REFUNDED')
+
+        # An earlier state delivered in a later batch doesn't move the payment back
+        self.deliver(self.event('PENDING'))
+        process_events()
+        self.assertState('REFUNDED', 'REFUNDED')
+
+    def test_event_committed_after_the_watermark_advanced(self):
+        self.deliver(self.event('PENDING'))
+        first = PaymentEvent.objects.get()
+        # The next id is taken by a transaction that commits late; a later one is processed first
+        self.deliver(self.event('PENDING', transaction_id='txn_2'))
+        PaymentEvent.objects.filter(transaction_id='txn_2').update(id=first.pk + 2)
+        process_events()
+
+        PaymentEvent.objects.create(id=first.pk + 1, transaction_id='txn_1', status='COMPLETED',
+                                    order_number=self.order.order_number, payload='{}')
+        process_events()
+        self.assertEqual(Payment.objects.get(transaction_id='txn_1').status, 'COMPLETED')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'CONFIRMED')
+
+
+class AutocompleteTests(TestCase):
+    """Prefix suggestions from the in-process index, kept up with product changes"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Jewelry')
+        self.collar = make_product(self.category, name='Red beaded collar', artisan_name='Naserian Sankale',
+                                   materials='Glass beads, leather', origin_region='Kajiado')
+        self.bracelet = make_product(self.category, name='Beaded bracelet', artisan_name='Naserian Sankale',
+                                     materials='Glass beads', origin_region='Narok')
+        self.index = PrefixIndex()
+        self.index.build()
+
+    def labels(self, text, **kwargs):
+        return [suggestion['label'] for suggestion in self.index.suggest(text, **kwargs)]
+
+    def test_suggestions(self):
+        # Labels starting with the prefix first, then by products covered
+        self.assertEqual(self.labels('bea'), ['Beaded bracelet', 'Glass beads', 'Red beaded collar'])
+        self.assertEqual(self.labels('RED  Bea'), ['Red beaded collar'])
+        self.assertEqual(self.labels('nas', kinds=['artisan']), ['Naserian Sankale'])
+        self.assertEqual(self.index.suggest('glass', kinds=['material'])[0]['products'], 2)
+        self.assertEqual(self.labels('b'), [])
+
+    def test_saves_update_the_loaded_index(self):
+        with mock.patch('marketplace.autocomplete._index', self.index):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.collar.name = 'Blue choker'
+                self.collar.save()
+                self.bracelet.delete()
+        self.assertEqual(self.labels('bea'), ['Glass beads'])
+        self.assertEqual(self.labels('blu'), ['Blue choker'])
+
+    def test_refresh_catches_up_with_writes_that_send_no_signals(self):
+        Product.objects.filter(pk=self.collar.pk).update(name='Blue choker', updated_at=timezone.now())
+        Product.objects.filter(pk=self.bracelet.pk).delete()
+        self.index.refresh()
+        self.assertEqual(self.labels('bea'), ['Glass beads'])
+        self.assertEqual(self.labels('blu'), ['Blue choker'])
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'autocomplete.json')
+            self.index.save_snapshot(path)
+            loaded = PrefixIndex()
+            self.assertTrue(loaded.load_snapshot(path))
+        self.assertEqual(loaded.suggest('bea'), self.index.suggest('bea'))
+        self.assertEqual(loaded.as_of, self.index.as_of)
+
+    def test_view(self):
+        with mock.patch('marketplace.autocomplete._index', self.index):
+            response = self.client.get(reverse('search_autocomplete'), {'q': 'na', 'kind': 'region', 'limit': 1})
+        self.assertEqual(response.json()['suggestions'], [{
+            'kind': 'region', 'label': 'Narok', 'product_id': None, 'products': 1,
+            'url': reverse('search_products') + '?origin_region=Narok',
+        }])
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+
+# Stand-ins for the page templates that read what the real pages show, so that
+# lazy querysets and relations in the context are evaluated inside the budget
+PRODUCT_CARD = '{{ product.name }} {{ product.price }} {{ product.category.name }} {{ product.average_rating }}'
+PAGE_TEMPLATES = {
+    'marketplace/home.html': (
+        '{% for category in categories %}{{ category.name }}{% endfor %}'
+        '{% for product in featured_products %}' + PRODUCT_CARD + '{% endfor %}'
+        '{% for product in products %}' + PRODUCT_CARD + '{% endfor %}'
+    ),
+    'marketplace/category.html': '{{ category.name }}{% for product in products %}' + PRODUCT_CARD + '{% endfor %}',
+    'marketplace/search_results.html': '{% for product in products %}' + PRODUCT_CARD + '{% endfor %}{{ facets }}',
+    'marketplace/product_detail.html': (
+        '{% with product as product %}' + PRODUCT_CARD + '{% endwith %}'
+        '{% for review in reviews %}{{ review.customer.user.username }} {{ review.rating }}{% endfor %}'
+        '{% for product in related_products %}' + PRODUCT_CARD + '{% endfor %}'
+    ),
+    'marketplace/cart.html': '{% for item in cart_items %}{% with item.product as product %}'
+                             + PRODUCT_CARD + '{% endwith %}{{ item.quantity }}{% endfor %}{{ total }}',
+    'marketplace/wishlist.html': '{% for item in wishlist_items %}{% with item.product as product %}'
+                                 + PRODUCT_CARD + '{% endwith %}{% endfor %}',
+    'marketplace/my_orders.html': (
+        '{% for order in orders %}{{ order.order_number }} {{ order.item_count }}'
+        '{% for item in order.items.all %}{{ item.product.name }}{% endfor %}{% endfor %}'
+    ),
+    'marketplace/order_detail.html': (
+        '{{ order.order_number }} {{ order.customer.user.get_full_name }}'
+        '{% for item in order.items.all %}{{ item.product.name }} {{ item.total_price }}{% endfor %}'
+    ),
+    'marketplace/profile.html': '{{ customer.phone_number }} {{ customer.user.email }}',
+}
+RENDERING_TEMPLATES = [{
+    **settings.TEMPLATES[0],
+    'APP_DIRS': False,
+    'OPTIONS': {
+        **settings.TEMPLATES[0]['OPTIONS'],
+        'loaders': [
+            ('django.template.loaders.locmem.Loader', PAGE_TEMPLATES),
+            'django.template.loaders.app_directories.Loader',
+        ],
+    },
+}]
+
+
+@override_settings(TEMPLATES=RENDERING_TEMPLATES)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Queries per page, with enough rows of everything that a per-row query shows"""
+    # (url name, args, signed in, budget)
+    budgets = [
+        ('home', [], False, 4),
+        ('product_list', [], False, 4),
+        ('product_detail', ['product'], False, 6),
+        ('category', ['category'], False, 4),
+        ('search_products', [], False, 3),
+        ('search_facets', [], False, 2),
+        ('home', [], True, 7),
+        ('product_detail', ['product'], True, 9),
+        ('cart', [], True, 3),
+        ('wishlist', [], True, 3),
+        ('my_orders', [], True, 5),
+        ('order_detail', ['order'], True, 5),
+        ('profile', [], True, 3),
+        ('sales_dashboard', [], True, 8),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='secret', is_staff=True)
+        cls.customer = Customer.objects.create(user=cls.user)
+        reviewers = [make_customer(f'reviewer{index}') for index in range(3)]
+
+        products = []
+        for index in range(3):
+            category = Category.objects.create(name=f'Category {index}')
+            for number in range(5):
+                products.append(make_product(
+                    category, name=f'Product {index}-{number}', is_featured=number == 0,
+                    origin_region=f'Region {number}',
+                ))
+        for product in products:
+            for reviewer in reviewers:
+                Review.objects.create(customer=reviewer, product=product, rating=4, title='Good', comment='Nice')
+        for product in products[:4]:
+            CartItem.objects.create(customer=cls.customer, product=product, quantity=1)
+            Wishlist.objects.create(customer=cls.customer, product=product)
+
+        for _ in range(3):
+            order = Order.objects.create(
+                customer=cls.customer, subtotal=Decimal('120.00'), total_amount=Decimal('120.00'),
+                shipping_address='Nairobi', billing_address='Nairobi',
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, price=product.price)
+                for product in products[:3]
+            ])
+
+        cls.objects = {'product': products[0].pk, 'category': products[0].category_id, 'order': order.pk}
+
+    def test_pages_stay_within_budget(self):
+        for name, args, signed_in, budget in self.budgets:
+            with self.subTest(name, signed_in=signed_in):
+                # Budgets are for a cold catalogue cache
+                cache.clear()
+                if signed_in:
+                    self.client.force_login(self.user)
+                    # The lookup that follows a cache loss; budgets are for the requests after it
+                    self.client.get(reverse('wishlist'))
+                else:
+                    self.client.logout()
+                url = reverse(name, args=[self.objects[arg] for arg in args])
+                response = self.assertQueryBudget(budget, url)
+                self.assertEqual(response.status_code, 200)
+
+
+@override_settings(TEMPLATES=RENDERING_TEMPLATES)
+class ProductReviewPageTests(TestCase):
+    """The product page shows its reviews a cursor page at a time, newest first"""
+
+    def test_reviews_are_paginated(self):
+        product = make_product(Category.objects.create(name='Jewelry'))
+        for index in range(12):
+            Review.objects.create(customer=make_customer(f'reviewer{index}'), product=product,
+                                  rating=4, title='Good', comment='Nice')
+        expected = list(Review.objects.filter(product=product).order_by(*DEFAULT_ORDERING))
+        url = reverse('product_detail', args=[product.pk])
+
+        first = self.client.get(url).context['reviews']
+        self.assertEqual(list(first), expected[:10])
+        second = self.client.get(url + first.next_link).context['reviews']
+        self.assertEqual(list(second), expected[10:])
+        self.assertFalse(second.has_next())
+
+
+class ShopperTests(TestCase):
+    """The shopper's Customer is looked up once per session, not on every request"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.customer = Customer.objects.create(user=self.user)
+        self.product = make_product(Category.objects.create(name='Jewellery'))
+        self.client.force_login(self.user)
+
+    def customer_lookups(self, url, method='get'):
+        with CaptureQueriesContext(connection) as context:
+            getattr(self.client, method)(url)
+        return sum('FROM "marketplace_customer"' in query['sql'] for query in context.captured_queries)
+
+    def test_session_copy_is_reused_until_the_profile_is_saved(self):
+        self.assertEqual(self.customer_lookups(reverse('wishlist')), 1)
+        self.assertEqual(self.customer_lookups(reverse('cart')), 0)
+        self.customer.save()
+        self.assertEqual(self.customer_lookups(reverse('wishlist')), 1)
+
+    def test_add_to_cart_writes_the_cart_count_through(self):
+        response = self.client.post(reverse('add_to_cart', args=[self.product.pk]), {'quantity': 2})
+        self.assertEqual(response.json()['cart_count'], 1)
+        self.assertEqual(self.client.session[SESSION_KEY]['cart_count'], 1)
+        self.assertEqual(self.client.session[SESSION_KEY]['customer'], self.customer.pk)
+        self.assertEqual(self.customer_lookups(reverse('product_detail', args=[self.product.pk])), 0)
+
+
+class MembershipTests(TestCase):
+    """Product grids know the shopper's wishlist and cart without a query per card"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.customer = Customer.objects.create(user=self.user)
+        category = Category.objects.create(name='Jewellery')
+        self.products = [make_product(category, name=f'Collar {index}') for index in range(6)]
+        Wishlist.objects.create(customer=self.customer, product=self.products[0])
+        CartItem.objects.create(customer=self.customer, product=self.products[1], quantity=1)
+        # Sets are cached by customer id, which the next test reuses
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_grids_get_the_sets(self):
+        for url in [reverse('home'), reverse('category', args=[self.products[0].category_id]), reverse('search_products')]:
+            with self.subTest(url):
+                response = self.client.get(url)
+                self.assertEqual(response.context['wishlist_ids'], {self.products[0].pk})
+                self.assertEqual(response.context['cart_ids'], {self.products[1].pk})
+
+    def membership_reads(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response, sum('UNION' in query['sql'] for query in context.captured_queries)
+
+    def test_changes_invalidate_the_sets(self):
+        self.client.get(reverse('home'))
+        self.client.post(reverse('toggle_wishlist', args=[self.products[0].pk]))
+        self.client.post(reverse('toggle_wishlist', args=[self.products[2].pk]))
+        response, membership_reads = self.membership_reads(reverse('home'))
+        self.assertEqual(membership_reads, 1)
+        self.assertEqual(response.context['wishlist_ids'], {self.products[2].pk})
+
+        # Adding to the cart re-reads the sets for the cart count, so the next page needn't
+        self.client.post(reverse('add_to_cart', args=[self.products[3].pk]))
+        self.assertEqual(self.client.session[SESSION_KEY]['cart_count'], 2)
+        response, membership_reads = self.membership_reads(reverse('home'))
+        self.assertEqual(membership_reads, 0)
+        self.assertEqual(response.context['cart_ids'], {self.products[1].pk, self.products[3].pk})
+
+    def test_changes_from_other_requests_are_not_lost(self):
+        self.client.get(reverse('home'))
+        # Another tab (or the admin) adds to the wishlist while this one has the sets cached
+        Wishlist.objects.create(customer=self.customer, product=self.products[4])
+        self.client.post(reverse('toggle_wishlist', args=[self.products[5].pk]))
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['wishlist_ids'],
+                         {self.products[0].pk, self.products[4].pk, self.products[5].pk})
+
+    def test_sets_read_before_a_change_are_not_served_after_it(self):
+        shopper = Shopper(mock.Mock(user=self.user, session={}))
+        stale = shopper.memberships()
+        Wishlist.objects.create(customer=self.customer, product=self.products[4])
+        # A slow request caching what it read before the change
+        cache.set(f'marketplace:memberships:{self.customer.pk}', stale)
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['wishlist_ids'], {self.products[0].pk, self.products[4].pk})
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    """The hot catalogue, cart, wishlist and review queries are served from indexes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Jewellery')
+        cls.product = make_product(cls.category, is_featured=True)
+        cls.customer = make_customer('buyer')
+
+    def test_hot_querysets_use_indexes(self):
+        available = Product.objects.filter(status='AVAILABLE')
+        querysets = {
+            # home, product_list and search_products, first and later pages
+            'listing': available.select_related('category').order_by(*DEFAULT_ORDERING),
+            'listing page 2': available.filter(created_at__lt=timezone.now()).order_by(*DEFAULT_ORDERING),
+            'price range': available.filter(price__gte=10, price__lte=50).order_by(*DEFAULT_ORDERING),
+            'category': available.filter(category=self.category).order_by(*DEFAULT_ORDERING),
+            'featured': available.filter(is_featured=True).select_related('category'),
+            'listing state': available.order_by().values('updated_at'),
+            'cart': CartItem.objects.filter(customer=self.customer).select_related('product'),
+            'live holds': CartItem.objects.filter(product=self.product, reserved_until__gt=timezone.now()),
+            'wishlist': Wishlist.objects.filter(customer=self.customer).select_related('product'),
+            'wishlisted by': Wishlist.objects.filter(product=self.product),
+            'latest reviews': Review.objects.filter(product=self.product).select_related('customer__user')
+            .order_by('-created_at'),
+            'newest review edit': Review.objects.filter(product=self.product).order_by('-updated_at'),
+        }
+        for name, queryset in querysets.items():
+            with self.subTest(name):
+                self.assertUsesIndexes(queryset[:20])
+
+
+class AdminChangelistTests(TestCase):
+    """Admin changelists run the same number of queries however many rows they show"""
+    models = [Category, Product, Customer, Order, Review, Payment]
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.rows = 0
+
+    def add_rows(self, count):
+        for index in range(self.rows, self.rows + count):
+            category = Category.objects.create(name=f'Category {index}')
+            product = make_product(category, name=f'Product {index}')
+            customer = make_customer(f'customer{index}')
+            order = Order.objects.create(
+                customer=customer, subtotal=Decimal('80.00'), total_amount=Decimal('80.00'),
+                shipping_address='Arusha', billing_address='Arusha',
+            )
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=product.price)
+            Review.objects.create(customer=customer, product=product, rating=index % 5 + 1, title='Lovely', comment='Well made')
+            Payment.objects.create(order=order, amount=order.total_amount, payment_method='MOBILE_MONEY')
+        self.rows += count
+
+    def changelist_queries(self, **params):
+        counts = {}
+        for model in self.models:
+            url = reverse(f'admin:marketplace_{model._meta.model_name}_changelist')
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            counts[model._meta.model_name] = len(context)
+        return counts
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.add_rows(2)
+        few = self.changelist_queries()
+        self.add_rows(20)
+        self.assertEqual(self.changelist_queries(), few)
+
+    def test_computed_columns_sort(self):
+        self.add_rows(3)
+        Product.objects.create(
+            category=Category.objects.get(name='Category 1'), name='Extra', short_description='Extra',
+            description='Extra', price=Decimal('5.00'), materials='Wood',
+        )
+        # Descending on the second column, product_count
+        response = self.client.get(reverse('admin:marketplace_category_changelist'), {'o': '-2'})
+        names = [category.name for category in response.context['cl'].result_list]
+        self.assertEqual(names[0], 'Category 1')
+        self.assertEqual(response.context['cl'].result_list[0]._product_count, 2)
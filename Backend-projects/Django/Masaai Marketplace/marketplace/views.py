@@ -1,21 +1,36 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Q, Avg
+from django.db.models import Avg, Count, Max, OuterRef, Subquery, Sum
 from django.utils import timezone
 from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import urlencode
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
-from decimal import Decimal
+import os
 import uuid
-from .models import Product, Category, Order, OrderItem, Customer, Review, CartItem, Wishlist
+from datetime import date
+from .models import Product, Category, Order, Review, CartItem, Wishlist
+from .autocomplete import KINDS, get_index
+from .cache import cache_stats, get_categories, get_featured_products, get_related_products
+from .checkout import CheckoutError, place_order, shipping_cost_for
+from .conditional import conditional_page
+from .facets import compute_facets
 from .forms import ProductUploadForm, ProductSearchForm
+from .pagination import DEFAULT_ORDERING, paginate
+from .payments import SIGNATURE_HEADER, PaymentEventError, ingest, verify_signature
+from .reporting import dashboard_data
+from .reservations import ReservationError, available_to_promise, reserve
+from .search import RELEVANCE_ORDERING, get_search_backend
 
 
-def home(request):
-    """Home page with featured products and search functionality"""
+def _catalogue_results(request):
+    """Apply the home page filters; returns (products, ordering, filter values)"""
     # Get search parameters
     query = request.GET.get('q', '')
     category_id = request.GET.get('category', '')
@@ -25,15 +40,9 @@ def home(request):
     # Base queryset for available products
     products = Product.objects.filter(status='AVAILABLE').select_related('category')
     
-    # Apply filters
+    # Apply filters; a text query also switches ordering to relevance
     if query:
-        products = products.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(short_description__icontains=query) |
-            Q(materials__icontains=query) |
-            Q(artisan_name__icontains=query)
-        )
+        products = get_search_backend().search(products, query)
     
     if category_id:
         products = products.filter(category_id=category_id)
@@ -50,25 +59,95 @@ def home(request):
         except ValueError:
             pass
     
-    # Pagination
-    paginator = Paginator(products, 9)  # Show 9 products per page
-    page_number = request.GET.get('page')
-    products_page = paginator.get_page(page_number)
+    # Keyset pagination: relevance order for text searches, newest first otherwise
+    ordering = RELEVANCE_ORDERING if query else DEFAULT_ORDERING
+    filters = {
+        'query': query,
+        'selected_category': category_id,
+        'min_price': min_price,
+        'max_price': max_price,
+    }
+    return products, ordering, filters
+
+
+def _listing_state(products, categories):
+    """Conditional GET state of a product listing and the categories it shows"""
+    stats = products.order_by().aggregate(modified=Max('updated_at'), count=Count('id'))
+    categories_modified = max((category.updated_at for category in categories), default=None)
+    last_modified = max([value for value in (stats['modified'], categories_modified) if value], default=None)
+    return last_modified, (stats['modified'], stats['count'], categories_modified, len(categories))
+
+
+def _home_state(request):
+    # Search results and featured products are all drawn from available products
+    last_modified, fingerprint = _listing_state(Product.objects.filter(status='AVAILABLE'), get_categories())
+    # Product cards are marked with the shopper's wishlist and cart
+    return last_modified, (fingerprint, request.shopper.memberships()['version'])
+
+
+def _category_state(request, category_id):
+    category = next((category for category in get_categories() if category.id == category_id), None)
+    if category is None:
+        return None
+    last_modified, fingerprint = _listing_state(
+        Product.objects.filter(category_id=category_id, status='AVAILABLE'), [category],
+    )
+    return last_modified, (fingerprint, request.shopper.memberships()['version'])
+
+
+def _membership_context(request):
+    """The shopper's wishlist and cart product ids, to mark product cards with"""
+    return {
+        'wishlist_ids': request.shopper.wishlist_ids,
+        'cart_ids': request.shopper.cart_ids,
+    }
+
+
+def _product_detail_state(request, product_id):
+    """Conditional GET state of a product page, in one query plus cached related products and memberships"""
+    live_holds = CartItem.objects.filter(
+        product=OuterRef('pk'), reserved_until__gt=timezone.now(),
+    ).order_by().values('product').annotate(total=Sum('reserved_quantity')).values('total')
+    latest_review = Review.objects.filter(product=OuterRef('pk')).order_by('-updated_at').values('updated_at')[:1]
+    row = Product.objects.filter(pk=product_id).values(
+        'updated_at', 'category_id', 'stock_quantity',
+    ).annotate(
+        reviews_modified=Subquery(latest_review),
+        held=Subquery(live_holds),
+    ).first()
+    if row is None:
+        return None
+    
+    related_products = get_related_products(Product(id=product_id, category_id=row['category_id']), 4)
+    last_modified = max(
+        value for value in [row['updated_at'], row['reviews_modified'], *(p.updated_at for p in related_products)]
+        if value
+    )
+    return last_modified, (
+        sorted(row.items()),
+        [(p.id, p.updated_at) for p in related_products],
+        request.shopper.memberships()['version'],
+    )
+
+
+@conditional_page(_home_state)
+def home(request):
+    """Home page with featured products and search functionality"""
+    products, ordering, filters = _catalogue_results(request)
+    products_page = paginate(request, products, 9, ordering)  # Show 9 products per page
     
     # Get all categories for filter dropdown
-    categories = Category.objects.all()
+    categories = get_categories()
     
     # Featured products
-    featured_products = Product.objects.filter(status='AVAILABLE', is_featured=True)[:6]
+    featured_products = get_featured_products(6)
     
     context = {
         'products': products_page,
         'categories': categories,
         'featured_products': featured_products,
-        'query': query,
-        'selected_category': category_id,
-        'min_price': min_price,
-        'max_price': max_price,
+        **filters,
+        **_membership_context(request),
     }
     return render(request, 'marketplace/home.html', context)
 
@@ -78,39 +157,49 @@ def product_list(request):
     return home(request)  # Use the same logic as home
 
 
-def product_detail(request, product_id):
-    """Display detailed information about a specific product"""
-    product = get_object_or_404(Product, id=product_id)
-    
-    # Get reviews for this product
-    reviews = Review.objects.filter(product=product).select_related('customer__user').order_by('-created_at')
-    
-    # Calculate average rating
-    avg_rating = product.average_rating
-    
-    # Get related products from same category
-    related_products = Product.objects.filter(
-        category=product.category, 
-        status='AVAILABLE'
-    ).exclude(id=product.id)[:4]
-    
+def _review_page(request, product):
+    """One cursor page of a product's reviews, newest first"""
+    reviews = Review.objects.filter(product=product).select_related('customer__user')
+    return paginate(request, reviews, 10)  # Show 10 reviews per page
+
+
+def _shopper_state(request, product):
+    """(in_wishlist, available_quantity) of a product for the current user"""
     # Check if user has this in wishlist
-    in_wishlist = False
-    if request.user.is_authenticated:
-        try:
-            customer = Customer.objects.get(user=request.user)
-            in_wishlist = Wishlist.objects.filter(customer=customer, product=product).exists()
-        except Customer.DoesNotExist:
-            pass
+    in_wishlist = product.id in request.shopper.wishlist_ids
     
-    context = {
+    # Stock not held in other customers' carts
+    return in_wishlist, available_to_promise(product, request.shopper.customer_id)
+
+
+def _product_detail_context(product, reviews, related_products, in_wishlist, available_quantity):
+    return {
         'product': product,
         'reviews': reviews,
-        'avg_rating': avg_rating,
-        'review_count': reviews.count(),
+        # Rating summary comes from the stored aggregates on Product
+        'avg_rating': product.average_rating,
+        'review_count': product.review_count,
+        'rating_histogram': product.rating_histogram,
         'related_products': related_products,
         'in_wishlist': in_wishlist,
+        'available_quantity': available_quantity,
     }
+
+
+@conditional_page(_product_detail_state)
+def product_detail(request, product_id):
+    """Display detailed information about a specific product"""
+    product = get_object_or_404(Product.objects.select_related('category'), id=product_id)
+    
+    # Get a page of reviews for this product
+    reviews = _review_page(request, product)
+    
+    # Co-purchase recommendations, topped up from the same category
+    related_products = get_related_products(product, 4)
+    
+    in_wishlist, available_quantity = _shopper_state(request, product)
+    
+    context = _product_detail_context(product, reviews, related_products, in_wishlist, available_quantity)
     return render(request, 'marketplace/product_detail.html', context)
 
 
@@ -121,50 +210,41 @@ def add_to_cart(request, product_id):
     product = get_object_or_404(Product, id=product_id, status='AVAILABLE')
     quantity = int(request.POST.get('quantity', 1))
     
-    if quantity > product.stock_quantity:
+    # Get or create customer profile
+    customer_id = request.shopper.get_or_create_customer_id()
+    
+    # Add to cart and hold the stock for this customer
+    try:
+        cart_item = reserve(customer_id, product.id, quantity)
+    except ReservationError as error:
         return JsonResponse({
             'success': False, 
-            'message': f'Only {product.stock_quantity} items available in stock.'
+            'message': str(error),
+            'available': error.available,
         })
     
-    # Get or create customer profile
-    customer, created = Customer.objects.get_or_create(user=request.user)
-    
-    # Add to cart or update quantity
-    cart_item, created = CartItem.objects.get_or_create(
-        customer=customer,
-        product=product,
-        defaults={'quantity': quantity}
-    )
-    
-    if not created:
-        cart_item.quantity += quantity
-        if cart_item.quantity > product.stock_quantity:
-            cart_item.quantity = product.stock_quantity
-        cart_item.save()
-    
-    # Get cart count for response
-    cart_count = CartItem.objects.filter(customer=customer).count()
+    # The cart sets were invalidated by the save; re-read them for the count
+    request.shopper.cart_changed()
     
     return JsonResponse({
         'success': True,
         'message': f'{product.name} added to cart!',
-        'cart_count': cart_count
+        'cart_count': request.shopper.cart_count,
+        'quantity': cart_item.quantity,
+        'reserved_until': cart_item.reserved_until.isoformat(),
     })
 
 
 @login_required
 def cart_view(request):
     """Display shopping cart"""
-    try:
-        customer = Customer.objects.get(user=request.user)
-        cart_items = CartItem.objects.filter(customer=customer).select_related('product')
-    except Customer.DoesNotExist:
-        cart_items = []
+    cart_items = CartItem.objects.filter(
+        customer_id=request.shopper.customer_id,
+    ).select_related('product__category')
     
     # Calculate totals
     subtotal = sum(item.total_price for item in cart_items)
-    shipping_cost = Decimal('15.00') if subtotal < 100 else Decimal('0.00')
+    shipping_cost = shipping_cost_for(subtotal)
     total = subtotal + shipping_cost
     
     context = {
@@ -179,10 +259,8 @@ def cart_view(request):
 @login_required
 def profile(request):
     """User profile management"""
-    try:
-        customer = Customer.objects.get(user=request.user)
-    except Customer.DoesNotExist:
-        customer = Customer.objects.create(user=request.user)
+    request.shopper.get_or_create_customer_id()
+    customer = request.shopper.customer
     
     if request.method == 'POST':
         # Simple form handling - in a real app, use Django forms
@@ -197,7 +275,7 @@ def profile(request):
         request.user.last_name = request.POST.get('last_name', '')
         request.user.email = request.POST.get('email', '')
         
-        customer.save()
+        customer.save()  # also makes sessions look the customer up again
         request.user.save()
         
         messages.success(request, 'Profile updated successfully!')
@@ -212,11 +290,9 @@ def profile(request):
 @login_required
 def my_orders(request):
     """Display user's order history"""
-    try:
-        customer = Customer.objects.get(user=request.user)
-        orders = Order.objects.filter(customer=customer).prefetch_related('items__product').order_by('-created_at')
-    except Customer.DoesNotExist:
-        orders = []
+    orders = Order.objects.filter(
+        customer_id=request.shopper.customer_id,
+    ).prefetch_related('items__product').order_by('-created_at')
     
     context = {
         'orders': orders,
@@ -227,10 +303,12 @@ def my_orders(request):
 @login_required
 def order_detail(request, order_id):
     """Display detailed information about a specific order"""
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(
+        Order.objects.select_related('customer__user').prefetch_related('items__product'), id=order_id,
+    )
     
     # Check if user owns this order or is staff
-    if order.customer.user != request.user and not request.user.is_staff:
+    if order.customer.user_id != request.user.id and not request.user.is_staff:
         messages.error(request, 'You do not have permission to view this order.')
         return redirect('my_orders')
     
@@ -243,11 +321,9 @@ def order_detail(request, order_id):
 @login_required
 def wishlist_view(request):
     """Display user's wishlist"""
-    try:
-        customer = Customer.objects.get(user=request.user)
-        wishlist_items = Wishlist.objects.filter(customer=customer).select_related('product')
-    except Customer.DoesNotExist:
-        wishlist_items = []
+    wishlist_items = Wishlist.objects.filter(
+        customer_id=request.shopper.customer_id,
+    ).select_related('product__category')
     
     context = {
         'wishlist_items': wishlist_items,
@@ -260,10 +336,10 @@ def wishlist_view(request):
 def toggle_wishlist(request, product_id):
     """Add or remove product from wishlist"""
     product = get_object_or_404(Product, id=product_id)
-    customer, created = Customer.objects.get_or_create(user=request.user)
+    customer_id = request.shopper.get_or_create_customer_id()
     
     wishlist_item, created = Wishlist.objects.get_or_create(
-        customer=customer,
+        customer_id=customer_id,
         product=product
     )
     
@@ -280,19 +356,19 @@ def toggle_wishlist(request, product_id):
     })
 
 
+@conditional_page(_category_state)
 def category_view(request, category_id):
     """Display products in a specific category"""
     category = get_object_or_404(Category, id=category_id)
-    products = Product.objects.filter(category=category, status='AVAILABLE')
+    products = Product.objects.filter(category=category, status='AVAILABLE').select_related('category')
     
     # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    products_page = paginator.get_page(page_number)
+    products_page = paginate(request, products, 12)
     
     context = {
         'category': category,
         'products': products_page,
+        **_membership_context(request),
     }
     return render(request, 'marketplace/category.html', context)
 
@@ -323,58 +399,30 @@ def register(request):
 @login_required
 def checkout(request):
     """Simple checkout process"""
-    try:
-        customer = Customer.objects.get(user=request.user)
-        cart_items = CartItem.objects.filter(customer=customer).select_related('product')
-    except Customer.DoesNotExist:
+    customer = request.shopper.customer
+    if customer is None:
         messages.error(request, 'Please complete your profile before placing an order.')
         return redirect('profile')
+    cart_items = CartItem.objects.filter(customer=customer).select_related('product')
     
     if not cart_items:
         messages.error(request, 'Your cart is empty.')
         return redirect('cart')
     
     if request.method == 'POST':
-        # Calculate totals
-        subtotal = sum(item.total_price for item in cart_items)
-        shipping_cost = Decimal('15.00') if subtotal < 100 else Decimal('0.00')
-        total = subtotal + shipping_cost
-        
-        # Create order
-        order = Order.objects.create(
-            customer=customer,
-            shipping_address=customer.shipping_address or 'Address not provided',
-            billing_address=customer.billing_address or customer.shipping_address or 'Address not provided',
-            shipping_method='STANDARD',
-            subtotal=subtotal,
-            shipping_cost=shipping_cost,
-            total_amount=total,
-            notes=request.POST.get('notes', '')
-        )
-        
-        # Create order items and update stock
-        for item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.product.price
-            )
-            # Update product stock
-            item.product.stock_quantity -= item.quantity
-            if item.product.stock_quantity <= 0:
-                item.product.status = 'OUT_OF_STOCK'
-            item.product.save()
-        
-        # Clear cart
-        cart_items.delete()
+        try:
+            order = place_order(customer, notes=request.POST.get('notes', ''))
+        except CheckoutError as error:
+            messages.error(request, str(error))
+            return redirect('cart')
         
+        request.shopper.cart_changed()
         messages.success(request, f'Order #{order.order_number} placed successfully!')
         return redirect('order_detail', order_id=order.id)
     
     # Calculate totals for display
     subtotal = sum(item.total_price for item in cart_items)
-    shipping_cost = Decimal('15.00') if subtotal < 100 else Decimal('0.00')
+    shipping_cost = shipping_cost_for(subtotal)
     total = subtotal + shipping_cost
     
     context = {
@@ -410,28 +458,23 @@ def product_upload(request):
     context = {
         'form': form,
         'recent_products': recent_products,
-        'categories': Category.objects.all(),
+        'categories': get_categories(),
     }
     return render(request, 'marketplace/product_upload.html', context)
 
 
-def search_products(request):
-    """Advanced product search with filters"""
+def _search_results(request):
+    """Apply the search form's filters; returns (form, products, ordering)"""
     form = ProductSearchForm(request.GET)
     products = Product.objects.filter(status='AVAILABLE').select_related('category')
+    ordering = DEFAULT_ORDERING
     
     if form.is_valid():
         # Apply search filters
         query = form.cleaned_data.get('query')
         if query:
-            products = products.filter(
-                Q(name__icontains=query) | 
-                Q(description__icontains=query) |
-                Q(short_description__icontains=query) |
-                Q(materials__icontains=query) |
-                Q(artisan_name__icontains=query) |
-                Q(origin_region__icontains=query)
-            )
+            products = get_search_backend().search(products, query)
+            ordering = RELEVANCE_ORDERING
         
         category = form.cleaned_data.get('category')
         if category:
@@ -454,14 +497,91 @@ def search_products(request):
         if form.cleaned_data.get('traditional_only'):
             products = products.filter(is_traditional_design=True)
     
+    # Region facet links filter on this parameter
+    origin_region = request.GET.get('origin_region', '')
+    if origin_region:
+        products = products.filter(origin_region=origin_region)
+    
+    return form, products, ordering
+
+
+def search_products(request):
+    """Advanced product search with filters"""
+    form, products, ordering = _search_results(request)
+    
     # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    products_page = paginator.get_page(page_number)
+    products_page = paginate(request, products, 12, ordering)
     
     context = {
         'form': form,
         'products': products_page,
+        'facets': compute_facets(products),
         'search_performed': bool(request.GET),
+        **_membership_context(request),
     }
     return render(request, 'marketplace/search_results.html', context)
+
+
+def search_facets(request):
+    """Facet counts for the current search filters as JSON"""
+    form, products, ordering = _search_results(request)
+    return JsonResponse(compute_facets(products))
+
+
+def search_autocomplete(request):
+    """Suggestions for a partly typed search as JSON, from the in-process prefix index"""
+    query = request.GET.get('q', '')
+    kinds = [kind for kind in request.GET.getlist('kind') if kind in KINDS]
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+    
+    suggestions = get_index().suggest(query, limit=limit, kinds=kinds)
+    search_url = reverse('search_products')
+    for suggestion in suggestions:
+        if suggestion['kind'] == 'product':
+            suggestion['url'] = reverse('product_detail', args=[suggestion['product_id']])
+        elif suggestion['kind'] == 'region':
+            suggestion['url'] = f"{search_url}?{urlencode({'origin_region': suggestion['label']})}"
+        else:
+            suggestion['url'] = f"{search_url}?{urlencode({'query': suggestion['label']})}"
+    
+    response = JsonResponse({'query': query, 'suggestions': suggestions})
+    # Keystrokes repeat; a short shared cache lifetime takes most of them
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
+
+@staff_member_required
+def catalogue_cache_stats(request):
+    """Hit/miss counters of the catalogue cache in this worker process"""
+    return JsonResponse({'pid': os.getpid(), 'stats': cache_stats()})
+
+
+@staff_member_required
+def sales_dashboard(request):
+    """Sales totals and top products, categories, regions etc. from the rollup tables"""
+    period = 'WEEK' if request.GET.get('period') == 'week' else 'DAY'
+    try:
+        period_start = date.fromisoformat(request.GET['start'])
+    except (KeyError, ValueError):
+        period_start = None
+    
+    context = dashboard_data(period, 12 if period == 'WEEK' else 30, period_start)
+    context['title'] = 'Sales dashboard'
+    return render(request, 'marketplace/sales_dashboard.html', context)
+
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request):
+    """Store signed payment gateway events for the payment worker and acknowledge them"""
+    if not verify_signature(request.body, request.headers.get(SIGNATURE_HEADER, '')):
+        return JsonResponse({'error': 'Invalid signature'}, status=403)
+    
+    try:
+        received = ingest(request.body)
+    except PaymentEventError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({'received': received}, status=202)
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'masaai_marketplace.settings')
+# Serve the async catalogue views (see asgi_urls.py)
+os.environ.setdefault('MASAAI_ROOT_URLCONF', 'masaai_marketplace.asgi_urls')
 
 application = get_asgi_application()
@@ -0,0 +1,37 @@
+"""
+URL configuration used under ASGI (see asgi.py).
+
+The same routes as `masaai_marketplace.urls`, with the catalogue views
+replaced by their async versions from `marketplace.async_views`.
+"""
+from django.urls import URLPattern, URLResolver
+from marketplace import async_views
+from . import urls
+
+# URL name -> async view
+ASYNC_VIEWS = {
+    'home': async_views.home,
+    'product_list': async_views.product_list,
+    'product_detail': async_views.product_detail,
+    'search_products': async_views.search_products,
+}
+
+
+def _with_async_views(patterns):
+    swapped = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            pattern = URLResolver(
+                pattern.pattern,
+                _with_async_views(pattern.url_patterns),
+                pattern.default_kwargs,
+                pattern.app_name,
+                pattern.namespace,
+            )
+        elif isinstance(pattern, URLPattern) and pattern.name in ASYNC_VIEWS:
+            pattern = URLPattern(pattern.pattern, ASYNC_VIEWS[pattern.name], pattern.default_args, pattern.name)
+        swapped.append(pattern)
+    return swapped
+
+
+urlpatterns = _with_async_views(urls.urlpatterns)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,15 +43,19 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Early, so the queries of the middleware below are counted too
+    'marketplace.middleware.query_stats_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'marketplace.shoppers.shopper_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'masaai_marketplace.urls'
+# asgi.py switches to masaai_marketplace.asgi_urls, which serves the async catalogue views
+ROOT_URLCONF = os.environ.get('MASAAI_ROOT_URLCONF', 'masaai_marketplace.urls')
 
 TEMPLATES = [
     {
@@ -78,6 +83,26 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open between requests; the async views read on
+        # pooled worker threads, which would otherwise reconnect for every query
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Catalogue reads are cached through marketplace/cache.py. LocMemCache is
+# private to each process, so with several workers switch to a shared backend,
+# e.g. 'django.core.cache.backends.filebased.FileBasedCache' with
+# 'LOCATION': BASE_DIR / 'cache', or the database cache after
+# `manage.py createcachetable`, so that invalidations reach every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'masaai-marketplace',
     }
 }
 
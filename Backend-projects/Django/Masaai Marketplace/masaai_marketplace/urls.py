@@ -18,10 +18,16 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from marketplace import views as marketplace_views
 
 urlpatterns = [
+    path('admin/cache-stats/', marketplace_views.catalogue_cache_stats, name='catalogue_cache_stats'),
+    path('admin/sales/', marketplace_views.sales_dashboard, name='sales_dashboard'),
     path('admin/', admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')),
+    path('search/facets/', marketplace_views.search_facets, name='search_facets'),
+    path('search/autocomplete/', marketplace_views.search_autocomplete, name='search_autocomplete'),
+    path('payments/webhook/', marketplace_views.payment_webhook, name='payment_webhook'),
     path('', include('marketplace.urls')),
 ]
 
@@ -0,0 +1,150 @@
+"""
+Per-request SQL statistics: query count, SQL time and repeated query shapes,
+as X-Query-* headers with DEBUG on and otherwise as one JSON line per
+request to the `products.queries` logger.
+
+The same middleware as `Masaai Marketplace/marketplace/middleware.py`, whose
+docstring describes it; change the copies together.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger('products.queries')
+
+DUPLICATE_WARNING = 10
+
+# Duplicated query shapes listed per log line or header
+REPORTED_DUPLICATES = 5
+
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """The shape of a query: literals, parameters and IN (...) lists collapsed"""
+    sql = _IN_LIST.sub('(...)', sql)
+    sql = _LITERALS.sub('?', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryStats:
+    """Queries, SQL time and repeated query shapes of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            shape = fingerprint(sql)
+            with self._lock:
+                self.count += 1
+                self.duration += elapsed
+                self.fingerprints[shape] += 1
+
+    @property
+    def duplicates(self):
+        """[(fingerprint, times run)] of the query shapes run more than once, most repeated first"""
+        return [(shape, count) for shape, count in self.fingerprints.most_common() if count > 1]
+
+    @property
+    def duplicate_count(self):
+        """Queries that repeated the shape of an earlier one"""
+        return sum(count - 1 for _, count in self.duplicates)
+
+
+_current = ContextVar('products_query_stats', default=None)
+
+
+def _record(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def _watch(sender, connection, **kwargs):
+    # connection_created fires on every reconnect of the same wrapper
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+connection_created.connect(_watch)
+
+
+def _start():
+    # Connections opened before this module was imported
+    for connection in connections.all(initialized_only=True):
+        _watch(None, connection)
+    stats = QueryStats()
+    return stats, _current.set(stats)
+
+
+def _report(request, response, stats):
+    duplicates = stats.duplicates[:REPORTED_DUPLICATES]
+    if settings.DEBUG:
+        response.headers['X-Query-Count'] = str(stats.count)
+        response.headers['X-Query-Time'] = f'{stats.duration * 1000:.1f}ms'
+        response.headers['X-Query-Duplicates'] = str(stats.duplicate_count)
+        if duplicates:
+            shape, count = duplicates[0]
+            response.headers['X-Query-Top-Duplicate'] = f'{count}x {shape[:200]}'
+        return
+
+    match = request.resolver_match
+    top = duplicates[0][1] if duplicates else 0
+    logger.log(
+        logging.WARNING if top >= DUPLICATE_WARNING else logging.INFO,
+        json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': stats.count,
+            'sql_ms': round(stats.duration * 1000, 1),
+            'duplicate_queries': stats.duplicate_count,
+            'duplicates': [{'sql': shape, 'count': count} for shape, count in duplicates],
+        }),
+    )
+
+
+@sync_and_async_middleware
+def query_stats_middleware(get_response):
+    """Record the SQL each request runs; see the module docstring"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats, token = _start()
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            _report(request, response, stats)
+            return response
+    else:
+        def middleware(request):
+            stats, token = _start()
+            try:
+                response = get_response(request)
+            finally:
+                _current.reset(token)
+            _report(request, response, stats)
+            return response
+    return middleware
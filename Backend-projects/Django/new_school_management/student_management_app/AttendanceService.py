@@ -0,0 +1,187 @@
+"""
+Writing attendance registers in bulk.
+
+`take_attendance()` saves a whole class's register in one transaction with a
+fixed number of queries: the students are resolved in one query and every
+AttendanceReport is written by one bulk INSERT. Registers are unique per
+subject, date and session year, and reports per register and student, so a
+double submit updates the first register instead of adding a second one.
+
+`update_attendance()` edits a register the same way: its reports are read
+in one query, the posted statuses are compared in memory and only the rows
+that changed are written, by one bulk UPDATE.
+
+Both keep AttendanceSummary, the present and absent counts per student,
+subject and session year that the dashboards read, in step: the change in
+each student's counts is applied in the same transaction, with one UPDATE
+per distinct change rather than one per student. Reports written any other
+way bypass the summaries; `rebuild_attendance_summary()` (and the management
+command of the same name) recounts them all from the reports.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from student_management_app.DashboardSnapshot import invalidate_admin_home
+from student_management_app.models import Attendance, AttendanceReport, AttendanceSummary, Students
+
+
+class AttendanceError(Exception):
+    pass
+
+
+def _statuses(entries):
+    """{user id: present} from the posted rows; statuses may be 1/0, booleans or their strings"""
+    field = AttendanceReport._meta.get_field('status')
+    return {int(entry['id']): field.to_python(entry['status']) for entry in entries}
+
+
+def _student_ids(admin_ids):
+    """{user id: Students id} for the given user ids, or AttendanceError if any is not a student"""
+    students = dict(Students.objects.filter(admin_id__in=admin_ids).values_list('admin_id', 'id'))
+    missing = set(admin_ids) - set(students)
+    if missing:
+        raise AttendanceError(f'Not students: {sorted(missing)}')
+    return students
+
+
+def _count_change(old, new):
+    """(present, absent) change when a report goes from status `old` (None if new) to `new`"""
+    return int(new) - int(old is True), int(not new) - int(old is False)
+
+
+def _update_summaries(attendance, changes):
+    """Add {Students id: (present, absent)} to the summaries of the register's subject and session year"""
+    changes = {student_id: change for student_id, change in changes.items() if change != (0, 0)}
+    if not changes:
+        return
+    AttendanceSummary.objects.bulk_create(
+        [
+            AttendanceSummary(
+                student_id_id=student_id,
+                subject_id_id=attendance.subject_id_id,
+                session_year_id_id=attendance.session_year_id_id,
+            )
+            for student_id in changes
+        ],
+        ignore_conflicts=True,
+    )
+    students_by_change = defaultdict(list)
+    for student_id, change in changes.items():
+        students_by_change[change].append(student_id)
+    for (present, absent), student_ids in students_by_change.items():
+        AttendanceSummary.objects.filter(
+            student_id__in=student_ids,
+            subject_id=attendance.subject_id_id,
+            session_year_id=attendance.session_year_id_id,
+        ).update(present=F('present') + present, absent=F('absent') + absent, updated_at=timezone.now())
+
+
+def take_attendance(subject, session_year, attendance_date, entries):
+    """Save the register of `subject` on `attendance_date`.
+
+    `entries` are the posted rows, [{"id": user id, "status": bool}]. If a
+    register for the same subject, date and session year exists, it is
+    reused and the statuses of its reports are overwritten. Returns the
+    Attendance.
+    """
+    statuses = _statuses(entries)
+    with transaction.atomic():
+        students = _student_ids(statuses)
+        attendance, created = Attendance.objects.get_or_create(
+            subject_id=subject,
+            attendance_date=attendance_date,
+            session_year_id=session_year,
+        )
+        # Locked like update_attendance(), so a concurrent submit can't count the same change twice
+        previous = {} if created else dict(
+            AttendanceReport.objects.filter(attendance_id=attendance).select_for_update()
+            .values_list('student_id', 'status')
+        )
+        AttendanceReport.objects.bulk_create(
+            [
+                AttendanceReport(student_id_id=students[admin_id], attendance_id=attendance, status=status)
+                for admin_id, status in statuses.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['attendance_id', 'student_id'],
+            update_fields=['status'],
+        )
+        _update_summaries(attendance, {
+            students[admin_id]: _count_change(previous.get(students[admin_id]), status)
+            for admin_id, status in statuses.items()
+        })
+        # bulk_create sends no post_save
+        transaction.on_commit(invalidate_admin_home)
+    return attendance
+
+
+def update_attendance(attendance, entries):
+    """Apply the posted statuses to the reports of `attendance`.
+
+    `entries` are [{"id": user id, "status": bool}] as for take_attendance();
+    every student must already be on the register. Returns a summary of the
+    edit: {"changed": n, "unchanged": n, "present": [user ids now present],
+    "absent": [user ids now absent]}.
+    """
+    statuses = _statuses(entries)
+    with transaction.atomic():
+        reports = {
+            report.admin_id: report
+            for report in AttendanceReport.objects.filter(attendance_id=attendance)
+            .annotate(admin_id=F('student_id__admin_id')).select_for_update()
+        }
+        missing = set(statuses) - set(reports)
+        if missing:
+            raise AttendanceError(f'Not on the register: {sorted(missing)}')
+
+        changed = []
+        now = timezone.now()
+        for admin_id, status in statuses.items():
+            report = reports[admin_id]
+            if report.status != status:
+                report.status = status
+                report.updated_at = now
+                changed.append(report)
+        if changed:
+            AttendanceReport.objects.bulk_update(changed, ['status', 'updated_at'])
+            _update_summaries(attendance, {
+                report.student_id_id: _count_change(not report.status, report.status) for report in changed
+            })
+            # bulk_update sends no post_save
+            transaction.on_commit(invalidate_admin_home)
+
+    return {
+        'changed': len(changed),
+        'unchanged': len(statuses) - len(changed),
+        'present': sorted(report.admin_id for report in changed if report.status),
+        'absent': sorted(report.admin_id for report in changed if not report.status),
+    }
+
+
+def rebuild_attendance_summary():
+    """Recount every AttendanceSummary from the reports; returns the number of summaries"""
+    with transaction.atomic():
+        rows = AttendanceReport.objects.values(
+            'student_id', 'attendance_id__subject_id', 'attendance_id__session_year_id',
+        ).annotate(
+            present=Count('id', filter=Q(status=True)), absent=Count('id', filter=Q(status=False)),
+        ).order_by()
+        AttendanceSummary.objects.all().delete()
+        summaries = AttendanceSummary.objects.bulk_create(
+            [
+                AttendanceSummary(
+                    student_id_id=row['student_id'],
+                    subject_id_id=row['attendance_id__subject_id'],
+                    session_year_id_id=row['attendance_id__session_year_id'],
+                    present=row['present'],
+                    absent=row['absent'],
+                )
+                for row in rows
+            ],
+            batch_size=500,
+        )
+        transaction.on_commit(invalidate_admin_home)
+    return len(summaries)
@@ -0,0 +1,85 @@
+"""
+Cached figures for the HOD dashboard.
+
+`admin_home_data()` computes everything `HodViews.admin_home` shows with a
+fixed number of grouped queries, whatever the number of courses, subjects,
+staff and students, and keeps the result in the cache for SNAPSHOT_TTL
+seconds. Saving or deleting an attendance or leave row, or a course,
+subject, staff member or student the charts are drawn from, drops the
+snapshot through the receivers in models.py. Bulk writes send no signals,
+so they call `invalidate_admin_home()` themselves.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+
+from student_management_app.models import Attendance, AttendanceSummary, Courses, LeaveReportStaff, \
+    LeaveReportStudent, Staffs, Students, Subjects
+
+CACHE_KEY = 'student_management_app:admin_home'
+
+# Seconds a snapshot is served before it is recomputed, even without writes
+SNAPSHOT_TTL = getattr(settings, 'ADMIN_HOME_SNAPSHOT_TTL', 60)
+
+
+def _counts(queryset, *fields):
+    """{value of `fields` (a tuple if several): rows} in one GROUP BY"""
+    rows = queryset.values(*fields).annotate(count=Count('id')).order_by()
+    if len(fields) == 1:
+        return {row[fields[0]]: row['count'] for row in rows}
+    return {tuple(row[field] for field in fields): row['count'] for row in rows}
+
+
+def build_admin_home_data():
+    """The admin_home template context, read with ten queries"""
+    courses = list(Courses.objects.values_list('id', 'course_name').order_by('id'))
+    subjects = list(Subjects.objects.values_list('subject_name', 'course_id').order_by('id'))
+    staffs = list(Staffs.objects.values_list('id', 'admin_id', 'admin__username').order_by('id'))
+    students = list(Students.objects.values_list('id', 'admin__username').order_by('id'))
+
+    subjects_per_course = _counts(Subjects.objects.all(), 'course_id')
+    students_per_course = _counts(Students.objects.all(), 'course_id')
+    # Registers taken for the subjects each staff member teaches
+    attendance_per_staff = _counts(Attendance.objects.all(), 'subject_id__staff_id')
+    staff_leaves = _counts(LeaveReportStaff.objects.filter(leave_status=1), 'staff_id')
+    reports = {
+        row['student_id']: (row['present_count'], row['absent_count'])
+        for row in AttendanceSummary.objects.values('student_id').annotate(
+            present_count=Sum('present'), absent_count=Sum('absent'),
+        ).order_by()
+    }
+    student_leaves = _counts(LeaveReportStudent.objects.filter(leave_status=1), 'student_id')
+
+    return {
+        "student_count": len(students),
+        "staff_count": len(staffs),
+        "subject_count": len(subjects),
+        "course_count": len(courses),
+        "course_name_list": [name for _, name in courses],
+        "subject_count_list": [subjects_per_course.get(course_id, 0) for course_id, _ in courses],
+        "student_count_list_in_course": [students_per_course.get(course_id, 0) for course_id, _ in courses],
+        "subject_list": [name for name, _ in subjects],
+        "student_count_list_in_subject": [students_per_course.get(course_id, 0) for _, course_id in subjects],
+        "staff_name_list": [username for _, _, username in staffs],
+        "attendance_present_list_staff": [attendance_per_staff.get(admin_id, 0) for _, admin_id, _ in staffs],
+        "attendance_absent_list_staff": [staff_leaves.get(staff_id, 0) for staff_id, _, _ in staffs],
+        "student_name_list": [username for _, username in students],
+        "attendance_present_list_student": [reports.get(student_id, (0, 0))[0] for student_id, _ in students],
+        "attendance_absent_list_student": [
+            reports.get(student_id, (0, 0))[1] + student_leaves.get(student_id, 0) for student_id, _ in students
+        ],
+    }
+
+
+def admin_home_data():
+    """The admin_home template context, from the snapshot if there is a current one"""
+    data = cache.get(CACHE_KEY)
+    if data is None:
+        data = build_admin_home_data()
+        cache.set(CACHE_KEY, data, SNAPSHOT_TTL)
+    return data
+
+
+def invalidate_admin_home():
+    """Drop the snapshot, so the next dashboard view recomputes it"""
+    cache.delete(CACHE_KEY)
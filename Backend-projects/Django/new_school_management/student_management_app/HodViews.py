@@ -9,6 +9,7 @@ from django.shortcuts import render
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
+from student_management_app.DashboardSnapshot import admin_home_data
 from student_management_app.forms import AddStudentForm, EditStudentForm
 from student_management_app.models import CustomUser, Staffs, Courses, Subjects, Students, SessionYearModel, \
     FeedBackStudent, FeedBackStaffs, LeaveReportStudent, LeaveReportStaff, Attendance, AttendanceReport, \
@@ -16,57 +17,8 @@ from student_management_app.models import CustomUser, Staffs, Courses, Subjects,
 
 
 def admin_home(request):
-    student_count1=Students.objects.all().count()
-    staff_count=Staffs.objects.all().count()
-    subject_count=Subjects.objects.all().count()
-    course_count=Courses.objects.all().count()
-
-    course_all=Courses.objects.all()
-    course_name_list=[]
-    subject_count_list=[]
-    student_count_list_in_course=[]
-    for course in course_all:
-        subjects=Subjects.objects.filter(course_id=course.id).count()
-        students=Students.objects.filter(course_id=course.id).count()
-        course_name_list.append(course.course_name)
-        subject_count_list.append(subjects)
-        student_count_list_in_course.append(students)
-
-    subjects_all=Subjects.objects.all()
-    subject_list=[]
-    student_count_list_in_subject=[]
-    for subject in subjects_all:
-        course=Courses.objects.get(id=subject.course_id.id)
-        student_count=Students.objects.filter(course_id=course.id).count()
-        subject_list.append(subject.subject_name)
-        student_count_list_in_subject.append(student_count)
-
-    staffs=Staffs.objects.all()
-    attendance_present_list_staff=[]
-    attendance_absent_list_staff=[]
-    staff_name_list=[]
-    for staff in staffs:
-        subject_ids=Subjects.objects.filter(staff_id=staff.admin.id)
-        attendance=Attendance.objects.filter(subject_id__in=subject_ids).count()
-        leaves=LeaveReportStaff.objects.filter(staff_id=staff.id,leave_status=1).count()
-        attendance_present_list_staff.append(attendance)
-        attendance_absent_list_staff.append(leaves)
-        staff_name_list.append(staff.admin.username)
-
-    students_all=Students.objects.all()
-    attendance_present_list_student=[]
-    attendance_absent_list_student=[]
-    student_name_list=[]
-    for student in students_all:
-        attendance=AttendanceReport.objects.filter(student_id=student.id,status=True).count()
-        absent=AttendanceReport.objects.filter(student_id=student.id,status=False).count()
-        leaves=LeaveReportStudent.objects.filter(student_id=student.id,leave_status=1).count()
-        attendance_present_list_student.append(attendance)
-        attendance_absent_list_student.append(leaves+absent)
-        student_name_list.append(student.admin.username)
-
-
-    return render(request,"hod_template/home_content.html",{"student_count":student_count1,"staff_count":staff_count,"subject_count":subject_count,"course_count":course_count,"course_name_list":course_name_list,"subject_count_list":subject_count_list,"student_count_list_in_course":student_count_list_in_course,"student_count_list_in_subject":student_count_list_in_subject,"subject_list":subject_list,"staff_name_list":staff_name_list,"attendance_present_list_staff":attendance_present_list_staff,"attendance_absent_list_staff":attendance_absent_list_staff,"student_name_list":student_name_list,"attendance_present_list_student":attendance_present_list_student,"attendance_absent_list_student":attendance_absent_list_student})
+    # Grouped counts, cached as a snapshot; see DashboardSnapshot
+    return render(request,"hod_template/home_content.html",admin_home_data())
 
 def add_staff(request):
     return render(request,"hod_template/add_staff_template.html")
@@ -1,43 +1,126 @@
+"""
+Role-based access to views.
+
+Each user type may use the views of some modules; any other view sends it
+to its own home page, and anonymous users to the login page. The rules are
+declared once in ROLE_RULES and compiled at import into a frozen set of the
+allowed (user_type, view module) pairs, so checking a request is one set
+lookup. URLs are reversed once and cached.
+
+Redirects are logged as JSON lines to the `student_management_app.access`
+logger, at most once per LOG_INTERVAL seconds for each (user_type, view
+module); the next line reports how many were suppressed in between.
+"""
+import json
+import logging
+import threading
+import time
+from functools import lru_cache
+from types import MappingProxyType
+
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.utils.deprecation import MiddlewareMixin
 
+logger = logging.getLogger('student_management_app.access')
+
+# Modules every signed-in user may use
+COMMON_MODULES = ("student_management_app.views", "django.views.static")
+
+# user_type: (the view modules it may use besides COMMON_MODULES, URL name of its home page)
+ROLE_RULES = {
+    "1": (
+        ("student_management_app.HodViews", "django.contrib.auth.views", "django.contrib.admin.sites"),
+        "admin_home",
+    ),
+    "2": (("student_management_app.StaffViews", "student_management_app.EditResultVIewClass"), "staff_home"),
+    "3": (("student_management_app.StudentViews",), "student_home"),
+}
+
+# Signed out: these modules, plus the login URLs themselves
+ANONYMOUS_MODULES = ("django.contrib.auth.views", "django.contrib.admin.sites", "student_management_app.views")
+ANONYMOUS_URL_NAMES = ("show_login", "do_login")
+
+# Where anonymous users and unknown user types are sent
+LOGIN_URL_NAME = "show_login"
+
+# The user_type of anonymous users in the compiled rules
+ANONYMOUS = None
+
+LOG_INTERVAL = 60
+
+
+def compile_rules(role_rules, common_modules, anonymous_modules):
+    """(frozenset of allowed (user_type, module) pairs, read-only {user_type: home URL name})"""
+    allowed = {
+        (user_type, module)
+        for user_type, (modules, _) in role_rules.items()
+        for module in modules + common_modules
+    }
+    allowed.update((ANONYMOUS, module) for module in anonymous_modules)
+    homes = MappingProxyType({user_type: url_name for user_type, (_, url_name) in role_rules.items()})
+    return frozenset(allowed), homes
+
+
+ALLOWED, HOME_URL_NAMES = compile_rules(ROLE_RULES, COMMON_MODULES, ANONYMOUS_MODULES)
+
+
+@lru_cache(maxsize=None)
+def url_for(name):
+    return reverse(name)
+
+
+@lru_cache(maxsize=None)
+def anonymous_paths():
+    return frozenset(url_for(name) for name in ANONYMOUS_URL_NAMES)
+
+
+class RateLimitedLog:
+    """Log at most one message per `interval` seconds for each key"""
+
+    def __init__(self, logger, interval):
+        self.logger = logger
+        self.interval = interval
+        self._last = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def info(self, key, fields):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, -self.interval) < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return
+            self._last[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+        self.logger.info(json.dumps(dict(fields, suppressed=suppressed)))
+
+
+redirect_log = RateLimitedLog(logger, LOG_INTERVAL)
+
 
 class LoginCheckMiddleWare(MiddlewareMixin):
 
     def process_view(self,request,view_func,view_args,view_kwargs):
         modulename=view_func.__module__
-        print(modulename)
         user=request.user
         if user.is_authenticated:
-            if user.user_type == "1":
-                if modulename == "student_management_app.HodViews":
-                    pass
-                elif modulename == "student_management_app.views" or modulename == "django.views.static":
-                    pass
-                elif modulename == "django.contrib.auth.views" or modulename =="django.contrib.admin.sites":
-                    pass
-                else:
-                    return HttpResponseRedirect(reverse("admin_home"))
-            elif user.user_type == "2":
-                if modulename == "student_management_app.StaffViews" or modulename == "student_management_app.EditResultVIewClass":
-                    pass
-                elif modulename == "student_management_app.views" or modulename == "django.views.static":
-                    pass
-                else:
-                    return HttpResponseRedirect(reverse("staff_home"))
-            elif user.user_type == "3":
-                if modulename == "student_management_app.StudentViews" or modulename == "django.views.static":
-                    pass
-                elif modulename == "student_management_app.views":
-                    pass
-                else:
-                    return HttpResponseRedirect(reverse("student_home"))
-            else:
-                return HttpResponseRedirect(reverse("show_login"))
-
+            user_type=user.user_type
+            if (user_type,modulename) in ALLOWED:
+                return None
+            url_name=HOME_URL_NAMES.get(user_type,LOGIN_URL_NAME)
         else:
-            if request.path == reverse("show_login") or request.path == reverse("do_login") or modulename == "django.contrib.auth.views" or modulename =="django.contrib.admin.sites" or modulename=="student_management_app.views":
-                pass
-            else:
-                return HttpResponseRedirect(reverse("show_login"))
\ No newline at end of file
+            user_type=ANONYMOUS
+            if (ANONYMOUS,modulename) in ALLOWED or request.path in anonymous_paths():
+                return None
+            url_name=LOGIN_URL_NAME
+
+        redirect_log.info((user_type,modulename),{
+            "user_type":user_type,
+            "view_module":modulename,
+            "path":request.path,
+            "redirect":url_name,
+        })
+        return HttpResponseRedirect(url_for(url_name))
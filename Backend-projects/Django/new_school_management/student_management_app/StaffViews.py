@@ -4,58 +4,57 @@ from uuid import uuid4
 
 from django.contrib import messages
 from django.core import serializers
+from django.db.models import Count, Sum
 from django.forms import model_to_dict
 from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
 from django.shortcuts import render
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
+from student_management_app.AttendanceService import take_attendance, update_attendance
 from student_management_app.models import Subjects, SessionYearModel, Students, Attendance, AttendanceReport, \
-    LeaveReportStaff, Staffs, FeedBackStaffs, CustomUser, Courses, NotificationStaffs, StudentResult, OnlineClassRoom
+    AttendanceSummary, LeaveReportStaff, Staffs, FeedBackStaffs, CustomUser, NotificationStaffs, StudentResult, \
+    OnlineClassRoom
 
 
 def staff_home(request):
     #For Fetch All Student Under Staff
-    subjects=Subjects.objects.filter(staff_id=request.user.id)
-    course_id_list=[]
-    for subject in subjects:
-        course=Courses.objects.get(id=subject.course_id.id)
-        course_id_list.append(course.id)
-
+    subjects=list(Subjects.objects.filter(staff_id=request.user.id))
     final_course=[]
     #removing Duplicate Course ID
-    for course_id in course_id_list:
-        if course_id not in final_course:
-            final_course.append(course_id)
+    for subject in subjects:
+        if subject.course_id_id not in final_course:
+            final_course.append(subject.course_id_id)
 
-    students_count=Students.objects.filter(course_id__in=final_course).count()
+    students_attendance=list(Students.objects.filter(course_id__in=final_course).select_related("admin"))
+    students_count=len(students_attendance)
 
-    #Fetch All Attendance Count
-    attendance_count=Attendance.objects.filter(subject_id__in=subjects).count()
+    #Fetch Attendance Count by Subject
+    attendance_by_subject=dict(Attendance.objects.filter(subject_id__in=subjects).values("subject_id").annotate(count=Count("id")).order_by().values_list("subject_id","count"))
+    attendance_count=sum(attendance_by_subject.values())
 
     #Fetch All Approve Leave
     staff=Staffs.objects.get(admin=request.user.id)
     leave_count=LeaveReportStaff.objects.filter(staff_id=staff.id,leave_status=1).count()
-    subject_count=subjects.count()
+    subject_count=len(subjects)
 
     #Fetch Attendance Data by Subject
     subject_list=[]
     attendance_list=[]
     for subject in subjects:
-        attendance_count1=Attendance.objects.filter(subject_id=subject.id).count()
         subject_list.append(subject.subject_name)
-        attendance_list.append(attendance_count1)
+        attendance_list.append(attendance_by_subject.get(subject.id,0))
 
-    students_attendance=Students.objects.filter(course_id__in=final_course)
+    #Present and Absent Counts per Student, from the Attendance Summaries
+    attendance_by_student={row["student_id"]:row for row in AttendanceSummary.objects.filter(student_id__in=students_attendance).values("student_id").annotate(present_count=Sum("present"),absent_count=Sum("absent")).order_by()}
     student_list=[]
     student_list_attendance_present=[]
     student_list_attendance_absent=[]
     for student in students_attendance:
-        attendance_present_count=AttendanceReport.objects.filter(status=True,student_id=student.id).count()
-        attendance_absent_count=AttendanceReport.objects.filter(status=False,student_id=student.id).count()
+        summary=attendance_by_student.get(student.id,{"present_count":0,"absent_count":0})
         student_list.append(student.admin.username)
-        student_list_attendance_present.append(attendance_present_count)
-        student_list_attendance_absent.append(attendance_absent_count)
+        student_list_attendance_present.append(summary["present_count"])
+        student_list_attendance_absent.append(summary["absent_count"])
 
     return render(request,"staff_template/staff_home_template.html",{"students_count":students_count,"attendance_count":attendance_count,"leave_count":leave_count,"subject_count":subject_count,"subject_list":subject_list,"attendance_list":attendance_list,"student_list":student_list,"present_list":student_list_attendance_present,"absent_list":student_list_attendance_absent})
 
@@ -93,13 +92,8 @@ def save_attendance_data(request):
 
 
     try:
-        attendance=Attendance(subject_id=subject_model,attendance_date=attendance_date,session_year_id=session_model)
-        attendance.save()
-
-        for stud in json_sstudent:
-             student=Students.objects.get(admin=stud['id'])
-             attendance_report=AttendanceReport(student_id=student,attendance_id=attendance,status=stud['status'])
-             attendance_report.save()
+        # All or nothing, in a fixed number of queries; see AttendanceService
+        take_attendance(subject_model,session_model,attendance_date,json_sstudent)
         return HttpResponse("OK")
     except:
         return HttpResponse("ERR")
@@ -146,11 +140,8 @@ def save_updateattendance_data(request):
 
 
     try:
-        for stud in json_sstudent:
-             student=Students.objects.get(admin=stud['id'])
-             attendance_report=AttendanceReport.objects.get(student_id=student,attendance_id=attendance)
-             attendance_report.status=stud['status']
-             attendance_report.save()
+        # Writes only the changed reports; the page expects a plain "OK"
+        update_attendance(attendance,json_sstudent)
         return HttpResponse("OK")
     except:
         return HttpResponse("ERR")
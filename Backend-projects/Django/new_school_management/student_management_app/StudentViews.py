@@ -7,28 +7,29 @@ from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
 from student_management_app.models import Students, Courses, Subjects, CustomUser, Attendance, AttendanceReport, \
-    LeaveReportStudent, FeedBackStudent, NotificationStudent, StudentResult, OnlineClassRoom, SessionYearModel
+    AttendanceSummary, LeaveReportStudent, FeedBackStudent, NotificationStudent, StudentResult, OnlineClassRoom, SessionYearModel
 
 
 def student_home(request):
     student_obj=Students.objects.get(admin=request.user.id)
-    attendance_total=AttendanceReport.objects.filter(student_id=student_obj).count()
-    attendance_present=AttendanceReport.objects.filter(student_id=student_obj,status=True).count()
-    attendance_absent=AttendanceReport.objects.filter(student_id=student_obj,status=False).count()
-    course=Courses.objects.get(id=student_obj.course_id.id)
-    subjects=Subjects.objects.filter(course_id=course).count()
-    subjects_data=Subjects.objects.filter(course_id=course)
+    #Present and Absent Counts per Subject, from the Attendance Summaries of every Session Year
+    attendance_by_subject={}
+    for subject_id,present,absent in AttendanceSummary.objects.filter(student_id=student_obj).values_list("subject_id","present","absent"):
+        subject_present,subject_absent=attendance_by_subject.get(subject_id,(0,0))
+        attendance_by_subject[subject_id]=(subject_present+present,subject_absent+absent)
+    attendance_present=sum(present for present,_ in attendance_by_subject.values())
+    attendance_absent=sum(absent for _,absent in attendance_by_subject.values())
+    attendance_total=attendance_present+attendance_absent
+    subject_data=list(Subjects.objects.filter(course_id=student_obj.course_id_id))
+    subjects=len(subject_data)
     session_obj=SessionYearModel.object.get(id=student_obj.session_year_id.id)
-    class_room=OnlineClassRoom.objects.filter(subject__in=subjects_data,is_active=True,session_years=session_obj)
+    class_room=OnlineClassRoom.objects.filter(subject__in=subject_data,is_active=True,session_years=session_obj)
 
     subject_name=[]
     data_present=[]
     data_absent=[]
-    subject_data=Subjects.objects.filter(course_id=student_obj.course_id)
     for subject in subject_data:
-        attendance=Attendance.objects.filter(subject_id=subject.id)
-        attendance_present_count=AttendanceReport.objects.filter(attendance_id__in=attendance,status=True,student_id=student_obj.id).count()
-        attendance_absent_count=AttendanceReport.objects.filter(attendance_id__in=attendance,status=False,student_id=student_obj.id).count()
+        attendance_present_count,attendance_absent_count=attendance_by_subject.get(subject.id,(0,0))
         subject_name.append(subject.subject_name)
         data_present.append(attendance_present_count)
         data_absent.append(attendance_absent_count)
@@ -0,0 +1,49 @@
+"""
+Django management command to time LoginCheckMiddleWare.process_view per request
+"""
+import time
+from types import SimpleNamespace
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.urls import reverse
+from student_management_app import HodViews, StaffViews, StudentViews, views
+from student_management_app.LoginCheckMiddleWare import LoginCheckMiddleWare
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the role check of LoginCheckMiddleWare for allowed and redirected requests of each user type; '
+        'the database is not touched'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200000, help='Checks timed per case (default: 200000)')
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        middleware = LoginCheckMiddleWare(lambda request: None)
+
+        def user(user_type):
+            return SimpleNamespace(is_authenticated=True, user_type=user_type)
+
+        cases = [
+            ('HOD, own view', user("1"), HodViews.admin_home, reverse("admin_home")),
+            ('Staff, own view', user("2"), StaffViews.staff_home, reverse("staff_home")),
+            ('Student, common view', user("3"), views.logout_user, reverse("logout")),
+            ('Student, HOD view (redirect)', user("3"), HodViews.admin_home, reverse("admin_home")),
+            ('Signed out, login page', AnonymousUser(), views.ShowLoginPage, reverse("show_login")),
+            ('Signed out, student view (redirect)', AnonymousUser(), StudentViews.student_home, reverse("student_home")),
+        ]
+        for label, request_user, view, path in cases:
+            request = factory.get(path)
+            request.user = request_user
+            # The first call reverses and caches the URLs
+            middleware.process_view(request, view, (), {})
+            started = time.perf_counter()
+            for _ in range(options['requests']):
+                middleware.process_view(request, view, (), {})
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{label:<40} {elapsed / options["requests"] * 1e6:.2f}us per request')
+
+        self.stdout.write(self.style.SUCCESS(f'Timed {options["requests"]} checks per case'))
@@ -0,0 +1,16 @@
+"""
+Django management command to recount the attendance summaries from the reports
+"""
+from django.core.management.base import BaseCommand
+from student_management_app.AttendanceService import rebuild_attendance_summary
+
+
+class Command(BaseCommand):
+    help = (
+        'Replace every AttendanceSummary with counts of the present and absent AttendanceReport rows; '
+        'run it after reports were written or deleted outside AttendanceService'
+    )
+
+    def handle(self, *args, **options):
+        count = rebuild_attendance_summary()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} attendance summaries'))
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:00
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def merge_duplicate_registers(apps, schema_editor):
+    """Fold double-submitted registers into the first one and keep each student's latest report"""
+    Attendance = apps.get_model('student_management_app', 'Attendance')
+    AttendanceReport = apps.get_model('student_management_app', 'AttendanceReport')
+
+    registers = Attendance.objects.values('subject_id', 'attendance_date', 'session_year_id').annotate(
+        copies=Count('id'), first=Min('id'),
+    ).filter(copies__gt=1)
+    for register in registers:
+        duplicates = Attendance.objects.filter(
+            subject_id=register['subject_id'],
+            attendance_date=register['attendance_date'],
+            session_year_id=register['session_year_id'],
+        ).exclude(id=register['first'])
+        AttendanceReport.objects.filter(attendance_id__in=duplicates).update(attendance_id=register['first'])
+        duplicates.delete()
+
+    reports = AttendanceReport.objects.values('attendance_id', 'student_id').annotate(
+        copies=Count('id'), latest=Max('id'),
+    ).filter(copies__gt=1)
+    for report in reports:
+        AttendanceReport.objects.filter(
+            attendance_id=report['attendance_id'],
+            student_id=report['student_id'],
+        ).exclude(id=report['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('student_management_app', '0003_alter_customuser_first_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_registers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('subject_id', 'attendance_date', 'session_year_id'), name='unique_attendance_register'),
+        ),
+        migrations.AddConstraint(
+            model_name='attendancereport',
+            constraint=models.UniqueConstraint(fields=('attendance_id', 'student_id'), name='unique_attendance_report'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_attendance(apps, schema_editor):
+    """Fill the summaries from the reports already taken"""
+    AttendanceReport = apps.get_model('student_management_app', 'AttendanceReport')
+    AttendanceSummary = apps.get_model('student_management_app', 'AttendanceSummary')
+
+    rows = AttendanceReport.objects.values(
+        'student_id', 'attendance_id__subject_id', 'attendance_id__session_year_id',
+    ).annotate(
+        present=Count('id', filter=Q(status=True)), absent=Count('id', filter=Q(status=False)),
+    ).order_by()
+    AttendanceSummary.objects.bulk_create([
+        AttendanceSummary(
+            student_id_id=row['student_id'],
+            subject_id_id=row['attendance_id__subject_id'],
+            session_year_id_id=row['attendance_id__session_year_id'],
+            present=row['present'],
+            absent=row['absent'],
+        )
+        for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('student_management_app', '0004_unique_attendance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceSummary',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('present', models.IntegerField(default=0)),
+                ('absent', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('session_year_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='student_management_app.sessionyearmodel')),
+                ('student_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='student_management_app.students')),
+                ('subject_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='student_management_app.subjects')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('student_id', 'subject_id', 'session_year_id'), name='unique_attendance_summary')],
+            },
+        ),
+        migrations.RunPython(count_attendance, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 # Create your models here.
@@ -69,6 +69,12 @@ class Attendance(models.Model):
     updated_at=models.DateTimeField(auto_now_add=True)
     objects = models.Manager()
 
+    class Meta:
+        constraints=[
+            # One register per class and day; a double submit reuses it
+            models.UniqueConstraint(fields=['subject_id','attendance_date','session_year_id'],name='unique_attendance_register'),
+        ]
+
 class AttendanceReport(models.Model):
     id=models.AutoField(primary_key=True)
     student_id=models.ForeignKey(Students,on_delete=models.DO_NOTHING)
@@ -78,6 +84,28 @@ class AttendanceReport(models.Model):
     updated_at=models.DateTimeField(auto_now_add=True)
     objects=models.Manager()
 
+    class Meta:
+        constraints=[
+            models.UniqueConstraint(fields=['attendance_id','student_id'],name='unique_attendance_report'),
+        ]
+
+class AttendanceSummary(models.Model):
+    # Present and absent reports per student, subject and session year, kept
+    # by the AttendanceService write paths; rebuild_attendance_summary recounts
+    id=models.AutoField(primary_key=True)
+    student_id=models.ForeignKey(Students,on_delete=models.CASCADE)
+    subject_id=models.ForeignKey(Subjects,on_delete=models.CASCADE)
+    session_year_id=models.ForeignKey(SessionYearModel,on_delete=models.CASCADE)
+    present=models.IntegerField(default=0)
+    absent=models.IntegerField(default=0)
+    updated_at=models.DateTimeField(auto_now=True)
+    objects=models.Manager()
+
+    class Meta:
+        constraints=[
+            models.UniqueConstraint(fields=['student_id','subject_id','session_year_id'],name='unique_attendance_summary'),
+        ]
+
 class LeaveReportStudent(models.Model):
     id=models.AutoField(primary_key=True)
     student_id=models.ForeignKey(Students,on_delete=models.CASCADE)
@@ -176,3 +204,17 @@ def save_user_profile(sender,instance,**kwargs):
         instance.staffs.save()
     if instance.user_type==3:
         instance.students.save()
+
+
+@receiver([post_save,post_delete],sender=Attendance)
+@receiver([post_save,post_delete],sender=AttendanceReport)
+@receiver([post_save,post_delete],sender=LeaveReportStudent)
+@receiver([post_save,post_delete],sender=LeaveReportStaff)
+@receiver([post_save,post_delete],sender=Courses)
+@receiver([post_save,post_delete],sender=Subjects)
+@receiver([post_save,post_delete],sender=Staffs)
+@receiver([post_save,post_delete],sender=Students)
+def invalidate_admin_home_snapshot(sender,**kwargs):
+    # The HOD dashboard counts all of these
+    from student_management_app.DashboardSnapshot import invalidate_admin_home
+    invalidate_admin_home()
@@ -1,3 +1,167 @@
-from django.test import TestCase
+from datetime import date
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponseRedirect
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from student_management_app.AttendanceService import rebuild_attendance_summary, take_attendance, \
+    update_attendance
+from student_management_app.DashboardSnapshot import CACHE_KEY, admin_home_data
+from student_management_app.LoginCheckMiddleWare import ANONYMOUS_MODULES, COMMON_MODULES, ROLE_RULES, \
+    LoginCheckMiddleWare
+from student_management_app.models import Attendance, AttendanceReport, AttendanceSummary, Courses, CustomUser, \
+    SessionYearModel, Subjects
+
+
+class AttendanceTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Courses.objects.create(id=1, course_name="Science")
+        self.session_year = SessionYearModel.object.create(
+            id=1, session_start_year=date(2026, 1, 1), session_end_year=date(2026, 12, 31),
+        )
+        self.staff = CustomUser.objects.create_user("teacher", password="secret", user_type=2)
+        self.subject = Subjects.objects.create(subject_name="Physics", course_id_id=1, staff_id=self.staff)
+        # Creating a student user creates its Students row, in course 1 and session year 1
+        self.students = [
+            CustomUser.objects.create_user(f"student{index}", password="secret", user_type=3)
+            for index in range(3)
+        ]
+
+    def entries(self, *statuses):
+        return [{"id": user.id, "status": status} for user, status in zip(self.students, statuses)]
+
+    def take(self, *statuses, day=date(2026, 3, 2)):
+        return take_attendance(self.subject, self.session_year, day, self.entries(*statuses))
+
+    def summaries(self):
+        return set(AttendanceSummary.objects.values_list(
+            "student_id", "subject_id", "session_year_id", "present", "absent",
+        ))
+
+
+class TakeAttendanceTests(AttendanceTestCase):
+    """Registers are saved in bulk, once per subject and day"""
+
+    def test_double_submit_updates_the_register(self):
+        first = self.take(True, True, False)
+        second = self.take(False, True, True)
+
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(Attendance.objects.count(), 1)
+        self.assertEqual(
+            dict(AttendanceReport.objects.values_list("student_id__admin_id", "status")),
+            {self.students[0].id: False, self.students[1].id: True, self.students[2].id: True},
+        )
+
+
+class AttendanceSummaryTests(AttendanceTestCase):
+    """The summaries kept by the write paths match a recount from the reports"""
+
+    def assertMatchesRebuild(self):
+        kept = self.summaries()
+        rebuild_attendance_summary()
+        self.assertEqual(kept, self.summaries())
+
+    def test_take_and_edit(self):
+        monday = self.take(True, True, False)
+        self.take(True, False, False, day=date(2026, 3, 3))
+        self.assertMatchesRebuild()
+
+        # Submitted again, then edited
+        self.take(False, True, False)
+        self.assertMatchesRebuild()
+        result = update_attendance(monday, self.entries(True, True, True))
+        self.assertEqual(result["changed"], 2)
+        self.assertMatchesRebuild()
+
+        student = self.students[2].students
+        self.assertEqual(
+            AttendanceSummary.objects.values_list("present", "absent").get(student_id=student),
+            (1, 1),
+        )
+
+
+class AdminHomeSnapshotTests(AttendanceTestCase):
+    """Attendance writes drop the HOD dashboard snapshot once they are committed"""
+
+    def test_snapshot_is_dropped_on_commit(self):
+        stale = admin_home_data()
+        self.assertEqual(stale["attendance_present_list_student"], [0, 0, 0])
+
+        for write, present in [
+            (lambda: self.take(True, True, False), [1, 1, 0]),
+            (lambda: update_attendance(Attendance.objects.get(), self.entries(True, True, True)), [1, 1, 1]),
+        ]:
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+                # A dashboard view that read the committed rows before this write did
+                cache.set(CACHE_KEY, stale)
+            stale = admin_home_data()
+            self.assertEqual(stale["attendance_present_list_student"], present)
+
+
+def old_process_view(request, view_func):
+    """LoginCheckMiddleWare.process_view as it was before the rules were compiled"""
+    modulename = view_func.__module__
+    user = request.user
+    if user.is_authenticated:
+        if user.user_type == "1":
+            if modulename == "student_management_app.HodViews":
+                pass
+            elif modulename == "student_management_app.views" or modulename == "django.views.static":
+                pass
+            elif modulename == "django.contrib.auth.views" or modulename == "django.contrib.admin.sites":
+                pass
+            else:
+                return HttpResponseRedirect(reverse("admin_home"))
+        elif user.user_type == "2":
+            if modulename == "student_management_app.StaffViews" or modulename == "student_management_app.EditResultVIewClass":
+                pass
+            elif modulename == "student_management_app.views" or modulename == "django.views.static":
+                pass
+            else:
+                return HttpResponseRedirect(reverse("staff_home"))
+        elif user.user_type == "3":
+            if modulename == "student_management_app.StudentViews" or modulename == "django.views.static":
+                pass
+            elif modulename == "student_management_app.views":
+                pass
+            else:
+                return HttpResponseRedirect(reverse("student_home"))
+        else:
+            return HttpResponseRedirect(reverse("show_login"))
+
+    else:
+        if request.path == reverse("show_login") or request.path == reverse("do_login") or modulename == "django.contrib.auth.views" or modulename == "django.contrib.admin.sites" or modulename == "student_management_app.views":
+            pass
+        else:
+            return HttpResponseRedirect(reverse("show_login"))
+
+
+class LoginCheckMiddleWareTests(TestCase):
+    """The compiled rules send every user type and view module where the old checks did"""
+
+    def test_redirects_match_the_old_checks(self):
+        modules = {module for modules, _ in ROLE_RULES.values() for module in modules}
+        modules.update(COMMON_MODULES, ANONYMOUS_MODULES, ["django.contrib.flatpages.views", "other.views"])
+        users = [SimpleNamespace(is_authenticated=True, user_type=user_type) for user_type in ["1", "2", "3", "4"]]
+        users.append(AnonymousUser())
+        paths = [reverse("show_login"), reverse("do_login"), reverse("admin_home"), "/unknown/"]
+        middleware = LoginCheckMiddleWare(lambda request: None)
+        factory = RequestFactory()
+
+        for user in users:
+            for module in sorted(modules):
+                for path in paths:
+                    with self.subTest(user_type=getattr(user, "user_type", None), module=module, path=path):
+                        request = factory.get(path)
+                        request.user = user
+                        view = SimpleNamespace(__module__=module)
+                        old = old_process_view(request, view)
+                        new = middleware.process_view(request, view, (), {})
+                        self.assertEqual(old and old.url, new and new.url)
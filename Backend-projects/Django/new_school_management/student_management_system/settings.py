@@ -51,6 +51,8 @@ MIDDLEWARE = [
     #===Enable Only Making Project Live on Heroku==
      #'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Early, so the queries of the middleware below are counted too
+    'student_management_app.QueryStatsMiddleWare.query_stats_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',